@@ -0,0 +1,232 @@
+"""TTC Route Planner for Toronto, Ontario -- Asyncio Facade
+
+This module provides an asyncio interface to the route planner for embedding it in an event loop
+based service. Database queries and route searches block, so they are run on a bounded thread
+pool executor, and the event loop only awaits their results. Like ``pathfinding``, the planner
+always uses the ``transit.db`` database (see ``graph.DB_FILE``).
+
+Typical use:
+
+    async with AsyncPlanner(max_workers=4) as planner:
+        info = await planner.query.get_stop_info(1000)
+
+        plan = planner.plan_route(start_loc, end_loc, time, day, engine='raptor')
+        async for message in plan:
+            ...  # same ('INFO', n) / ('INC',) / ('DONE', path) messages as find_route
+        path = await plan
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Generator, Optional, Union
+
+import pathfinding
+from data_interface import QueryPool, get_pool
+from graph import DB_FILE
+
+
+class AsyncTransitQuery:
+    """Asynchronous counterpart of ``data_interface.TransitQuery``.
+
+    Every method checks a TransitQuery out of a connection pool on an executor thread, runs the
+    query there, and returns its result to the awaiting coroutine. Method arguments, return
+    values and exceptions are the same as the corresponding TransitQuery method.
+    """
+    # Private Instance Attributes:
+    #   - _executor: bounded executor that database queries are run on
+    #   - _pool: connection pool that queries are checked out of
+    _executor: ThreadPoolExecutor
+    _pool: QueryPool
+
+    def __init__(self, executor: ThreadPoolExecutor, pool: QueryPool) -> None:
+        """Initialize a new AsyncTransitQuery running queries from pool on executor."""
+        self._executor = executor
+        self._pool = pool
+
+    def _query(self, method: str, args: tuple) -> Any:
+        """Run the TransitQuery method with the given name and arguments. Blocks."""
+        with self._pool.connection() as query:
+            return getattr(query, method)(*args)
+
+    async def _run(self, method: str, *args: Any) -> Any:
+        """Run the TransitQuery method with the given name and arguments on the executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._query, method, args)
+
+    async def get_stops(self) -> set[tuple[int, tuple[float, float]]]:
+        """See ``TransitQuery.get_stops``."""
+        return await self._run('get_stops')
+
+    async def get_edges(self) -> set[tuple[int, int]]:
+        """See ``TransitQuery.get_edges``."""
+        return await self._run('get_edges')
+
+    async def get_closest_stops(self, lat: float, lon: float, radius: float = -1) -> list[int]:
+        """See ``TransitQuery.get_closest_stops``."""
+        return await self._run('get_closest_stops', lat, lon, radius)
+
+    async def get_edge_data(self, stop_id_start: int, stop_id_end: int, time_sec: int,
+                            day: int) -> Optional[tuple[int, int, int, int, float]]:
+        """See ``TransitQuery.get_edge_data``."""
+        return await self._run('get_edge_data', stop_id_start, stop_id_end, time_sec, day)
+
+    async def get_route_id(self, trip_id: int) -> int:
+        """See ``TransitQuery.get_route_id``."""
+        return await self._run('get_route_id', trip_id)
+
+    async def get_route_info(self, route_id: int) -> dict[str, Union[str, int]]:
+        """See ``TransitQuery.get_route_info``."""
+        return await self._run('get_route_info', route_id)
+
+    async def get_stop_info(self, stop_id: int) -> dict[str, Union[int, str, float]]:
+        """See ``TransitQuery.get_stop_info``."""
+        return await self._run('get_stop_info', stop_id)
+
+    async def get_shape_data(self, trip_id: int, stop_id_start: int, stop_id_end: int) \
+            -> dict[str, Union[int, list[tuple[float, float]]]]:
+        """See ``TransitQuery.get_shape_data``."""
+        return await self._run('get_shape_data', trip_id, stop_id_start, stop_id_end)
+
+
+class _LoopQueue(queue.Queue):
+    """A message queue for a route search running on an executor thread, which hands each
+    message put on it to an asyncio.Queue of the event loop instead of keeping it.
+    """
+    # Private Instance Attributes:
+    #   - _loop: the event loop that owns _messages
+    #   - _messages: the queue messages are handed to
+    _loop: asyncio.AbstractEventLoop
+    _messages: asyncio.Queue
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, messages: asyncio.Queue) -> None:
+        """Initialize a new queue handing messages to messages, on loop."""
+        super().__init__()
+        self._loop = loop
+        self._messages = messages
+
+    def put(self, item: Any, block: bool = True, timeout: Optional[float] = None) -> None:
+        """Hand item to the event loop's queue. Never blocks."""
+        self._loop.call_soon_threadsafe(self._messages.put_nowait, item)
+
+
+class RoutePlan:
+    """A route search running on an executor.
+
+    Awaiting a RoutePlan returns the path computed by ``pathfinding.find_route``. Iterating over
+    it with ``async for`` yields the progress messages put on the search's message queue, ending
+    after the ``'DONE'`` message.
+    """
+    # Private Instance Attributes:
+    #   - _future: future for the find_route call
+    #   - _messages: queue of the messages put by find_route, in the event loop
+    _future: asyncio.Future
+    _messages: asyncio.Queue
+
+    def __init__(self, future: asyncio.Future, messages: asyncio.Queue) -> None:
+        """Initialize a new RoutePlan for the search with the given future and message queue."""
+        self._future = future
+        self._messages = messages
+
+    def __await__(self) -> Generator[Any, None, list[tuple[int, int, int]]]:
+        """Wait for the search to complete and return its path."""
+        return self._future.__await__()
+
+    async def __aiter__(self) -> AsyncIterator[tuple]:
+        """Yield progress messages from the search until it is done.
+
+        Messages reach the event loop before the search's future completes, so once it has
+        completed with no message left, none will follow.
+        """
+        while True:
+            if self._messages.empty() and self._future.done():
+                self._future.result()  # raise exception from the search, if any
+                return
+            getter = asyncio.ensure_future(self._messages.get())
+            await asyncio.wait({getter, self._future}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                continue
+            message = getter.result()
+            yield message
+            if message[0] == 'DONE':
+                return
+
+    def done(self) -> bool:
+        """Return whether the search has completed."""
+        return self._future.done()
+
+
+class AsyncPlanner:
+    """Runs transit queries and route searches for an asyncio event loop.
+
+    All blocking work shares one executor, so at most ``max_workers`` queries and route
+    searches run at once no matter how many coroutines are waiting on them.
+
+    Instance Attributes:
+        - query: asynchronous query interface to the transit database
+    """
+    # Private Instance Attributes:
+    #   - _executor: bounded executor that blocking work is run on
+    query: AsyncTransitQuery
+    _executor: ThreadPoolExecutor
+
+    def __init__(self, max_workers: int = 4) -> None:
+        """Initialize a new AsyncPlanner running at most max_workers blocking calls at once.
+
+        Preconditions:
+            - max_workers >= 1
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='async_planner')
+        self.query = AsyncTransitQuery(self._executor, get_pool(DB_FILE))
+
+    async def __aenter__(self) -> AsyncPlanner:
+        """Return this planner for use in an ``async with`` statement."""
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Shut down this planner when leaving an ``async with`` statement."""
+        await self.close()
+
+    def plan_route(self, start_loc: tuple[float, float], end_loc: tuple[float, float],
+                   time: int, day: int, **options: Any) -> RoutePlan:
+        """Start computing the quickest transit route and return its RoutePlan.
+
+        Arguments and options (such as engine and cancel) are the same as for
+        ``pathfinding.find_route``.
+
+        Must be called from a running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        future = loop.run_in_executor(
+            self._executor, functools.partial(pathfinding.find_route, start_loc, end_loc, time,
+                                              day, _LoopQueue(loop, messages), **options))
+        return RoutePlan(future, messages)
+
+    async def close(self) -> None:
+        """Wait for running work to complete, then release the executor."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['asyncio', 'functools', 'queue', 'concurrent.futures', 'typing',
+                          'pathfinding', 'data_interface', 'graph'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -0,0 +1,150 @@
+"""TTC Route Planner for Toronto, Ontario -- Connection Scan Algorithm
+
+This module provides an implementation of the Connection Scan Algorithm (CSA, Dibbelt, Pajor,
+Strasser and Wagner, 2013) over the sorted connection array of a ``timetable.Timetable``, as an
+alternative routing engine to the A* search in ``pathfinding``.
+
+CSA answers an earliest arrival query with a single scan over the connections departing after
+the departure time, in order of departure. A connection is used if its trip was already boarded
+or its departure stop can be reached in time, and the scan stops as soon as connections depart
+after the earliest known arrival at the destination. No database queries are made.
+
+The connection array covers a single week. A scan that reaches its end continues from the start
+of the array with all times moved forward by a week, for at most one week in total.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from array import array
+from math import inf
+from typing import Optional, Union
+
+from timetable import WEEK, Timetable
+
+
+def csa(timetable: Timetable, sources: list[tuple[int, float]],
+        targets: list[tuple[int, float]]) \
+        -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
+    """Return the journey with the earliest arrival at the destination, from any of the sources
+    to any of the targets.
+
+    sources and targets, and the returned journey, are in the same format as for
+    ``raptor.raptor``. Return None if no journey arriving within a week of the earliest source
+    departure exists.
+
+    Preconditions:
+        - sources != []
+        - all(0 <= time < WEEK for _, time in sources)
+    """
+    num_stops = len(timetable.graph)
+    egress = dict(targets)
+
+    # arrival[s] is the earliest known arrival at stop s. If s was reached by a trip,
+    # journey[s] is the (enter connection, exit connection) of that trip; if s was reached by
+    # walking, journey[s] is (-1, stop walked from); if s is a source, journey[s] is (-1, -1).
+    arrival = array('d', [inf]) * num_stops
+    journey = {}
+    for stop, time in sources:
+        if time < arrival[stop]:
+            arrival[stop] = time
+            journey[stop] = (-1, -1)
+    for stop in list(journey):
+        _relax_footpaths(timetable, stop, arrival, journey)
+
+    # for each boarded trip instance: (departure time of the enter connection, enter connection,
+    # position of the enter connection in the trip's pattern)
+    boarded = {}
+
+    start_time = min(time for _, time in sources)
+    best = min((arrival[stop] + time for stop, time in egress.items()), default=inf)
+
+    # bind the connection arrays to locals, since this loop is the whole search
+    conn_dep, conn_arr = timetable.conn_dep, timetable.conn_arr
+    conn_from, conn_to = timetable.conn_from, timetable.conn_to
+    conn_trip, conn_pos = timetable.conn_trip, timetable.conn_pos
+    num_connections = len(conn_dep)
+    c, offset = timetable.first_connection(start_time), 0
+
+    while num_connections > 0:
+        if c == num_connections:  # continue with next week's connections
+            c, offset = 0, offset + WEEK
+        departure = conn_dep[c] + offset
+        if departure >= best or departure >= start_time + WEEK:
+            break
+
+        trip = conn_trip[c]
+        entered = boarded.get(trip)
+        # the trip was boarded earlier on this run (rather than on the run a week before)
+        on_trip = entered is not None and departure - entered[0] < WEEK \
+            and conn_pos[c] >= entered[2]
+
+        if on_trip or arrival[conn_from[c]] <= departure:
+            if not on_trip:
+                entered = (departure, c, conn_pos[c])
+                boarded[trip] = entered
+
+            to_stop = conn_to[c]
+            arrival_time = conn_arr[c] + offset
+            if arrival_time < arrival[to_stop]:
+                arrival[to_stop] = arrival_time
+                journey[to_stop] = (entered[1], c)
+                _relax_footpaths(timetable, to_stop, arrival, journey)
+                best = min((arrival[stop] + time for stop, time in egress.items()),
+                           default=inf)
+        c += 1
+
+    return _extract_journey(timetable, arrival, journey, egress)
+
+
+def _relax_footpaths(timetable: Timetable, stop: int, arrival: array,
+                     journey: dict[int, tuple[int, int]]) -> None:
+    """Relax the footpaths from stop, updating arrival and journey."""
+    for j in range(timetable.foot_offsets[stop], timetable.foot_offsets[stop + 1]):
+        target = timetable.foot_targets[j]
+        if arrival[stop] + timetable.foot_times[j] < arrival[target]:
+            arrival[target] = arrival[stop] + timetable.foot_times[j]
+            journey[target] = (-1, stop)
+
+
+def _extract_journey(timetable: Timetable, arrival: array, journey: dict[int, tuple[int, int]],
+                     egress: dict[int, float]) \
+        -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
+    """Return the path and arrival time of the journey with the earliest arrival at the
+    destination, or None if no target was reached.
+    """
+    best_stop = min(egress, key=lambda s: arrival[s] + egress[s])
+    if arrival[best_stop] == inf:
+        return None
+
+    stop_ids = timetable.graph.stop_ids
+    path = []
+    stop = best_stop
+    while journey[stop] != (-1, -1):
+        enter, other = journey[stop]
+        if enter == -1:  # walked from other
+            if path and path[-1][0] == 0:
+                path[-1] = (0, stop_ids[other], path[-1][2])  # merge consecutive walks
+            else:
+                path.append((0, stop_ids[other], stop_ids[stop]))
+            stop = other
+        else:
+            trip_id = timetable.trip_ids[timetable.conn_trip[enter]]
+            path.append((trip_id, stop_ids[timetable.conn_from[enter]], stop_ids[stop]))
+            stop = timetable.conn_from[enter]
+
+    return (path, arrival[best_stop] + egress[best_stop])
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['array', 'math', 'typing', 'timetable'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -6,24 +6,36 @@ Then, ``init_db`` should be called to initialize the ``transit.db`` SQLite datab
 create the required tables. ``init_db`` also has a ``force`` parameter, allowing the database file
 to be forcefully remade by dropping pre-existing tables and recreating them.
 
+Queries are made through ``TransitQuery`` objects. Callers should check these out of the shared
+``QueryPool`` returned by ``get_pool`` rather than opening a new connection for every query.
+
 This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
 """
 
+import atexit
 import csv
+import functools
+import hashlib
 import logging
 import os
 import sqlite3
-from typing import Optional, Union
+import threading
+import time
+from contextlib import contextmanager
+from math import inf
+from typing import Any, Callable, Iterator, Optional, Union
 
 import util
+from query_stats import QueryStats
 
 
 # ---------- DATABASE CREATION ---------- #
 
 def init_db(data_dir: str, force: bool = False) -> None:
     """Initialize a new database in a file called ``transit.db`` containing the GTFS static tables
-    from the given data_directory. If one already exists, this function does nothing, but
-    if ``force is True``, this function will overwrite tables in the ``transit.db`` file.
+    from the given data_directory. If one already exists, this function only adds any network
+    statistics it lacks (see ``_compute_network_stats``), but if ``force is True``, this
+    function will overwrite tables in the ``transit.db`` file.
 
     Preconditions:
         - os.isfile(data_dir + 'calendar.txt')
@@ -142,11 +154,26 @@ def init_db(data_dir: str, force: bool = False) -> None:
         logger.debug('Generating edges table')
         _compute_distances(con, force=force)
 
+        # compute network-wide statistics used by pathfinding
+        logger.debug('Generating network_stats table')
+        _compute_network_stats(con, force=force)
+
         con.commit()
         con.close()
 
         logger.info('Database initialization completed')
-    logger.info('Database already exists, no action')
+    else:
+        # databases initialized by earlier versions may lack current network statistics, which
+        # are added here once. Doing so changes the database's fingerprint, so the files derived
+        # from it are rebuilt once too.
+        con = sqlite3.connect('transit.db')
+        if not _has_network_stats(con):
+            logger.info('Updating network statistics of existing database')
+            _compute_network_stats(con)
+            con.commit()
+        else:
+            logger.info('Database already exists, no action')
+        con.close()
 
 
 def _insert_file(file_path: str, table_name: str, con: sqlite3.Connection) -> None:
@@ -258,8 +285,116 @@ def _compute_distances(con: sqlite3.Connection, force: bool = False) -> None:
                 con.execute("""INSERT INTO edges VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", values)
 
 
+def _compute_network_stats(con: sqlite3.Connection, force: bool = False) -> None:
+    """Compute statistics of the whole transit network and store them in a new table
+    ``network_stats`` of (name, value) rows, using the ``edges`` and ``stops`` tables in the given
+    Connection.
+
+    The statistics stored are:
+        - ``max_speed_bound``: see ``_max_speed``
+
+    The table is also recreated if it was computed by an earlier version, which stored a
+    ``max_speed`` that ignored edges scheduled to take no time (see ``_has_network_stats``).
+
+    DOES NOT commit changes.
+
+    Preconditions:
+        - the ``edges`` and ``stops`` tables exist in the sqlite3 Connection
+    """
+    if not _has_network_stats(con) or force:  # check if table does NOT exist (or force)
+        con.execute("""DROP TABLE IF EXISTS network_stats;""")
+
+        con.execute("""CREATE TABLE network_stats (name TEXT PRIMARY KEY, value REAL);""")
+        con.execute("""INSERT INTO network_stats VALUES ('max_speed_bound', ?)""",
+                    (_max_speed(con),))
+
+
+def _has_network_stats(con: sqlite3.Connection) -> bool:
+    """Return whether the given Connection has a ``network_stats`` table with every statistic
+    of the current version, as computed by ``_compute_network_stats``.
+    """
+    return con.execute("""
+    SELECT COUNT(name) FROM sqlite_master WHERE type='table' AND name='network_stats'
+    """).fetchone()[0] != 0 and con.execute("""
+    SELECT COUNT(name) FROM network_stats WHERE name = 'max_speed_bound'
+    """).fetchone()[0] != 0
+
+
+def _max_speed(con: sqlite3.Connection) -> float:
+    """Return the maximum speed (in km/s) of any vehicle in the ``edges`` table of the given
+    Connection, or 0 if there are no edges.
+
+    The speed of an edge is the great-circle distance between its stops divided by its scheduled
+    travel time, so no vehicle ever gets closer to a destination faster than this speed. An edge
+    between distinct locations scheduled to take no time (due to rounding of the schedule to
+    whole minutes) has no finite speed, so the maximum speed is inf if there is any.
+    """
+    stops = {row[0]: (row[1], row[2])
+             for row in con.execute("""SELECT stop_id, stop_lat, stop_lon FROM stops""")}
+
+    max_speed = 0.0
+    for start, end, duration in con.execute("""
+    SELECT stop_id_start, stop_id_end, MIN(time_arr - time_dep)
+    FROM edges
+    GROUP BY stop_id_start, stop_id_end
+    """):
+        if start in stops and end in stops:
+            dist = util.distance(stops[start], stops[end])
+            if duration <= 0:
+                if dist > 0:
+                    return inf
+            else:
+                max_speed = max(max_speed, dist / duration)
+
+    return max_speed
+
+
+def database_fingerprint(db_file: str = 'transit.db') -> bytes:
+    """Return a 20 byte fingerprint identifying the current contents of the given database file.
+
+    Files derived from the database (such as cached graphs) store this fingerprint and are
+    rebuilt when it changes. The fingerprint is a hash of the file's size and modification time
+    rather than of its contents, so that checking it stays cheap for large databases.
+
+    Preconditions:
+        - os.path.isfile(db_file)
+    """
+    stat = os.stat(db_file)
+    return hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).digest()
+
+
 # ---------- DATABASE QUERY ---------- #
 
+def _instrumented(method: Callable) -> Callable:
+    """Decorator for public TransitQuery methods, recording each call in the object's QueryStats
+    when instrumentation is enabled.
+    """
+    @functools.wraps(method)
+    def wrapper(self: 'TransitQuery', *args, **kwargs) -> Any:
+        if self.stats is None:
+            return method(self, *args, **kwargs)
+
+        self._curr_method = method.__name__
+        rows = None
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+            if result is None:
+                rows = 0
+            elif isinstance(result, (list, set)):
+                rows = len(result)
+            else:
+                rows = 1
+            return result
+        finally:
+            end = time.perf_counter()
+            self._finish_statement(end)
+            self._curr_method = ''
+            self.stats.record_call(method.__name__, (end - start) * 1000, rows)
+
+    return wrapper
+
+
 class TransitQuery:
     """Used for persisting Transit database connections in order to speed up queries and database
     operations.
@@ -271,19 +406,38 @@ class TransitQuery:
 
     Instance Attributes:
         - open: True when the database connection is open, False otherwise
+        - stats: QueryStats that calls to this object's public methods are recorded in, or None
+          if instrumentation is disabled
 
     Representation Invariants:
         - open is True if and only if the sqlite3.Connection is open
     """
     # Private Instance Attributes:
     #   - _con: sqlite3 Connection object. Should only ever be connected to the ``transit.db`` file
+    #   - _curr_method: name of the instrumented method currently running, or '' if none
+    #   - _curr_statement: the expanded SQL and start time of the statement currently running,
+    #     or None if none. Only tracked while instrumentation is enabled.
     open: bool
+    stats: Optional[QueryStats]
     _con: sqlite3.Connection
+    _curr_method: str
+    _curr_statement: Optional[tuple[str, float]]
 
-    def __init__(self, db_file: str = 'transit.db') -> None:
+    def __init__(self, db_file: str = 'transit.db', check_same_thread: bool = True,
+                 stats: Optional[QueryStats] = None) -> None:
         """Initialize a new TransitQuery object.
+
+        ``check_same_thread`` is passed to ``sqlite3.connect``. It should only be disabled when
+        the caller guarantees the object is used by one thread at a time (see ``QueryPool``).
+        The ``SPH_DIST`` and ``MOD`` SQL functions are registered on the new connection.
+
+        Instrumentation is enabled if ``stats`` is given.
         """
-        self._con = sqlite3.connect(db_file)
+        self.open = False
+        self.stats = None
+        self._curr_method = ''
+        self._curr_statement = None
+        self._con = sqlite3.connect(db_file, check_same_thread=check_same_thread)
         self.open = True
 
         # create spherical distance function
@@ -296,6 +450,8 @@ class TransitQuery:
                                   lambda a, b: a % b,
                                   deterministic=True)
 
+        self.set_stats(stats)
+
         logging.getLogger(__name__).debug('Initialized new TransitQuery object')
 
     def __del__(self) -> None:
@@ -303,13 +459,60 @@ class TransitQuery:
         """
         self.close()
 
+    def __enter__(self) -> 'TransitQuery':
+        """Return this TransitQuery for use in a ``with`` statement.
+        """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Close the database connection when leaving a ``with`` statement.
+        """
+        self.close()
+
     def close(self) -> None:
-        """Close database connection.
+        """Close database connection. Does nothing if the connection is already closed.
         """
-        self._con.close()
-        self.open = False
-        logging.getLogger(__name__).debug('Closed TransitQuery connection')
+        if self.open:
+            self._con.close()
+            self.open = False
+            logging.getLogger(__name__).debug('Closed TransitQuery connection')
 
+    def set_stats(self, stats: Optional[QueryStats]) -> None:
+        """Record calls to this object's public methods in ``stats``, or disable instrumentation
+        if ``stats`` is None.
+
+        While enabled, an SQLite trace callback times every statement executed on the
+        connection, and statements slower than ``stats.slow_threshold_ms`` are logged together
+        with their bound parameters.
+
+        Raises ConnectionError if database is not connected.
+        """
+        if not self.open:
+            raise ConnectionError('Database is not connected.')
+
+        self.stats = stats
+        self._curr_statement = None
+        self._con.set_trace_callback(self._trace if stats is not None else None)
+
+    def _trace(self, sql: str) -> None:
+        """SQLite trace callback, called with the expanded SQL of each statement as it starts.
+
+        A statement is timed until the next statement starts or the instrumented method
+        returns, so its time includes fetching its results.
+        """
+        now = time.perf_counter()
+        self._finish_statement(now)
+        self._curr_statement = (sql, now)
+
+    def _finish_statement(self, end: float) -> None:
+        """Record the statement currently running as finished at time ``end``.
+        """
+        if self._curr_statement is not None and self.stats is not None:
+            sql, start = self._curr_statement
+            self.stats.record_statement(self._curr_method, sql, (end - start) * 1000)
+        self._curr_statement = None
+
+    @_instrumented
     def get_stops(self) -> set[tuple[int, tuple[float, float]]]:
         """Return a set of tuples representing all the stops in the database.
 
@@ -328,6 +531,7 @@ class TransitQuery:
 
         return stops
 
+    @_instrumented
     def get_edges(self) -> set[tuple[int, int]]:
         """Return a set of tuples representing directed edges between stops.
 
@@ -341,6 +545,7 @@ class TransitQuery:
         cur = self._con.execute("""SELECT DISTINCT stop_id_start, stop_id_end FROM edges""")
         return set(cur.fetchall())
 
+    @_instrumented
     def get_closest_stops(self, lat: float, lon: float, radius: float = -1) -> list[int]:
         """Return a list of ``stop_id``s corresponding to the closest stops to the given
         latitude and longitude.
@@ -379,6 +584,7 @@ class TransitQuery:
         else:  # radius != -1
             return [stop[0] for stop in cur]
 
+    @_instrumented
     def get_edge_data(self, stop_id_start: int, stop_id_end: int,
                       time_sec: int, day: int) -> Optional[tuple[int, int, int, int, float]]:
         """Return the edge information for the next vehicle that travels between the two stops
@@ -484,6 +690,124 @@ class TransitQuery:
 
         return None
 
+    def get_trip_schedules(self) -> Iterator[tuple[int, list[int], list[tuple[int, int]],
+                                                   list[int]]]:
+        """Return an iterator over the schedule of every trip in the database.
+
+        Each trip is given as a tuple ``(trip_id, stops, times, days)`` where
+            - stops is the list of ``stop_id``s visited by the trip, in order
+            - times is the list of ``(arrival, departure)`` times at each of those stops, in
+              seconds after midnight of the day the trip's service runs (possibly over 86400)
+            - days is the list of days the trip's service runs on, where 1 is Monday and 7 is
+              Sunday
+
+        Rows are read from the database as the iterator advances, so calls to this method are
+        not recorded by instrumentation.
+
+        Raises ConnectionError if database is not connected.
+        """
+        if not self.open:
+            raise ConnectionError('Database is not connected.')
+
+        cur = self._con.execute("""
+        SELECT
+            trip_id,
+            stop_id_start,
+            stop_id_end,
+            time_dep,
+            time_arr,
+            monday, tuesday, wednesday, thursday, friday, saturday, sunday
+        FROM edges
+        INNER JOIN calendar ON edges.service_id = calendar.service_id
+        ORDER BY trip_id, edges.rowid
+        """)
+
+        curr_trip = None
+        for row in cur:
+            if row[0] != curr_trip:
+                if curr_trip is not None:
+                    yield (curr_trip, stops, times, days)
+                curr_trip = row[0]
+                stops = [row[1]]
+                times = [(row[3], row[3])]
+                days = [day for day in range(1, 8) if row[4 + day] == 1]
+            else:  # the departure from the start stop of this edge is only known now
+                times[-1] = (times[-1][0], row[3])
+            stops.append(row[2])
+            times.append((row[4], row[4]))
+
+        if curr_trip is not None:
+            yield (curr_trip, stops, times, days)
+
+    @_instrumented
+    def get_max_speed(self) -> float:
+        """Return the maximum speed of any vehicle in the network, in km/s, as computed when the
+        database was initialized (see ``_max_speed``). This is inf if any vehicle is scheduled
+        to cover a distance in no time.
+
+        For databases initialized before the ``network_stats`` table held this speed, and not
+        updated by ``init_db`` since, the speed is computed from the ``edges`` table instead,
+        which is much slower.
+
+        Raises ConnectionError if database is not connected.
+        """
+        if not self.open:
+            raise ConnectionError('Database is not connected.')
+
+        try:
+            row = self._con.execute("""
+            SELECT value FROM network_stats WHERE name = 'max_speed_bound';
+            """).fetchone()
+        except sqlite3.OperationalError:  # no network_stats table
+            row = None
+
+        if row is None:
+            logging.getLogger(__name__).warning(
+                'No network statistics found in database; computing maximum speed from edges')
+            return _max_speed(self._con)
+        return row[0]
+
+    @_instrumented
+    def get_min_travel_times(self) -> list[tuple[int, int, int]]:
+        """Return the shortest scheduled travel time of every edge between two stops.
+
+        Returned tuples are in the form: ``(stop_id_start, stop_id_end, time)``, where time is
+        the minimum of ``time_arr - time_dep`` over every vehicle travelling between the stops,
+        in seconds, and ``time >= 0``.
+
+        Raises ConnectionError if database is not connected.
+        """
+        if not self.open:
+            raise ConnectionError('Database is not connected.')
+
+        cur = self._con.execute("""
+        SELECT stop_id_start, stop_id_end, MAX(MIN(time_arr - time_dep), 0)
+        FROM edges
+        GROUP BY stop_id_start, stop_id_end
+        """)
+        return cur.fetchall()
+
+    @_instrumented
+    def get_route_type_stops(self, route_type: int) -> list[int]:
+        """Return the ``stop_id`` of every stop served by a route of the given GTFS
+        ``route_type`` (see ``get_route_info``), in increasing order.
+
+        Raises ConnectionError if database is not connected.
+        """
+        if not self.open:
+            raise ConnectionError('Database is not connected.')
+
+        cur = self._con.execute("""
+        SELECT DISTINCT stop_times.stop_id
+        FROM stop_times
+        INNER JOIN trips ON stop_times.trip_id = trips.trip_id
+        INNER JOIN routes ON trips.route_id = routes.route_id
+        WHERE routes.route_type = ?
+        ORDER BY stop_times.stop_id;
+        """, (route_type,))
+        return [row[0] for row in cur]
+
+    @_instrumented
     def get_route_id(self, trip_id: int) -> int:
         """Return ``route_id`` from the given ``trip_id`.
 
@@ -506,6 +830,7 @@ class TransitQuery:
 
         return route_info[0]
 
+    @_instrumented
     def get_route_info(self, route_id: int) -> dict[str, Union[str, int]]:
         """Return route info of the given ``route_id``.
 
@@ -542,6 +867,7 @@ class TransitQuery:
                 'route_color': route_info[3],
                 'route_text_color': route_info[4]}
 
+    @_instrumented
     def get_stop_info(self, stop_id: int) -> dict[str, Union[int, str, float]]:
         """Return stop info of the given ``stop_id``.
 
@@ -580,6 +906,7 @@ class TransitQuery:
                 'stop_lon': stop_info[3],
                 'wheelchair_boarding': stop_info[4]}
 
+    @_instrumented
     def get_shape_data(self, trip_id: int,
                        stop_id_start: int,
                        stop_id_end: int) -> dict[str, Union[int, list[tuple[float, float]]]]:
@@ -669,6 +996,241 @@ class TransitQuery:
                 'shape': [stop_start_coords] + shape_coords_cursor.fetchall() + [stop_end_coords]}
 
 
+class QueryPool:
+    """A pool of ``TransitQuery`` objects connected to the same database file, shared by
+    all callers in a process.
+
+    Connections are opened lazily, have the ``SPH_DIST`` and ``MOD`` functions registered once,
+    and are reused across queries instead of being reopened for every caller. Two styles of use
+    are supported:
+        - ``connection()``: a context manager that checks a TransitQuery out of the pool and
+          returns it when the ``with`` block exits. Checked-out objects may be used from any
+          thread, but only by one thread at a time.
+        - ``local()``: a TransitQuery owned by the calling thread for the lifetime of the pool.
+
+    A pool detects when it is used in a forked child process and discards the connections
+    inherited from the parent rather than sharing them across processes.
+
+    Instance Attributes:
+        - db_file: path of the SQLite database file connected to
+        - max_size: maximum number of checked-out connections open at once
+        - closed: True once the pool has been closed
+        - stats: QueryStats that calls on this pool's connections are recorded in, or None if
+          instrumentation is disabled
+
+    Representation Invariants:
+        - self.max_size >= 1
+    """
+    # Private Instance Attributes:
+    #   - _idle: connections available for checkout
+    #   - _num_checkout: number of connections created for checkout that are still open
+    #   - _local_queries: all thread-local connections created by this pool
+    #   - _thread_data: per-thread storage holding each thread's local connection
+    #   - _cond: guards the attributes above and wakes threads waiting for a connection
+    #   - _pid: id of the process that owns the connections
+    db_file: str
+    max_size: int
+    _idle: list[TransitQuery]
+    _num_checkout: int
+    _local_queries: list[TransitQuery]
+    _thread_data: threading.local
+    _cond: threading.Condition
+    _pid: int
+    closed: bool
+    stats: Optional[QueryStats]
+
+    def __init__(self, db_file: str = 'transit.db', max_size: int = 8,
+                 stats: Optional[QueryStats] = None) -> None:
+        """Initialize an empty pool for the given database file.
+
+        Instrumentation of the pool's connections is enabled if ``stats`` is given.
+
+        Preconditions:
+            - max_size >= 1
+        """
+        self.db_file = db_file
+        self.max_size = max_size
+        self.stats = stats
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self.closed = False
+        self._reset()
+
+    def __enter__(self) -> 'QueryPool':
+        """Return this pool for use in a ``with`` statement.
+        """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Close every connection in the pool when leaving a ``with`` statement.
+        """
+        self.close()
+
+    def _reset(self) -> None:
+        """Forget all connections held by this pool without closing them.
+        """
+        self._idle = []
+        self._num_checkout = 0
+        self._local_queries = []
+        self._thread_data = threading.local()
+
+    def _check_process(self) -> None:
+        """Drop connections inherited from a parent process.
+
+        SQLite connections must not be used across a fork, so a child process starts
+        with an empty pool.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._reset()
+
+    def acquire(self, timeout: Optional[float] = None) -> TransitQuery:
+        """Check out a TransitQuery from this pool, opening a new connection if none are idle.
+
+        Blocks while ``max_size`` connections are checked out. Raises TimeoutError if no
+        connection becomes available within ``timeout`` seconds.
+
+        Raises ConnectionError if the pool is closed.
+        """
+        with self._cond:
+            self._check_process()
+            if self.closed:
+                raise ConnectionError('Connection pool is closed.')
+
+            if not self._idle and self._num_checkout >= self.max_size:
+                if not self._cond.wait_for(lambda: self._idle or self.closed
+                                           or self._num_checkout < self.max_size, timeout):
+                    raise TimeoutError('Timed out waiting for a database connection.')
+                if self.closed:
+                    raise ConnectionError('Connection pool is closed.')
+
+            if self._idle:
+                return self._idle.pop()
+
+            self._num_checkout += 1
+
+        try:
+            return TransitQuery(self.db_file, check_same_thread=False, stats=self.stats)
+        except sqlite3.Error:
+            with self._cond:
+                self._num_checkout -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, query: TransitQuery) -> None:
+        """Return a TransitQuery previously checked out with ``acquire`` to this pool.
+        """
+        with self._cond:
+            if self._pid != os.getpid():
+                return  # query belongs to the parent process' pool
+
+            if self.closed or not query.open:
+                query.close()
+                self._num_checkout -= 1
+            else:
+                if query.stats is not self.stats:
+                    query.set_stats(self.stats)
+                self._idle.append(query)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[TransitQuery]:
+        """Context manager that checks out a TransitQuery for the duration of a ``with`` block.
+
+        Raises TimeoutError if no connection becomes available within ``timeout`` seconds.
+        """
+        query = self.acquire(timeout)
+        try:
+            yield query
+        finally:
+            self.release(query)
+
+    def local(self) -> TransitQuery:
+        """Return the TransitQuery owned by the calling thread, creating it on first use.
+
+        The returned object must not be closed by the caller; it is closed with the pool.
+
+        Raises ConnectionError if the pool is closed.
+        """
+        with self._cond:
+            self._check_process()
+            if self.closed:
+                raise ConnectionError('Connection pool is closed.')
+
+            query = getattr(self._thread_data, 'query', None)
+            if query is None or not query.open:
+                # only ever used by this thread, but closed by whichever thread closes the pool
+                query = TransitQuery(self.db_file, check_same_thread=False, stats=self.stats)
+                self._thread_data.query = query
+                self._local_queries.append(query)
+
+            return query
+
+    def set_stats(self, stats: Optional[QueryStats]) -> None:
+        """Record calls on this pool's connections in ``stats``, or disable instrumentation if
+        ``stats`` is None.
+
+        Connections that are checked out are updated when they are released.
+        """
+        with self._cond:
+            self._check_process()
+            self.stats = stats
+            for query in self._idle + self._local_queries:
+                if query.open:
+                    query.set_stats(stats)
+
+    def close(self) -> None:
+        """Close all idle and thread-local connections in this pool.
+
+        Connections that are checked out are closed when they are released.
+        """
+        with self._cond:
+            self.closed = True
+            if self._pid != os.getpid():
+                self._reset()
+                return
+
+            for query in self._idle:
+                query.close()
+                self._num_checkout -= 1
+            self._idle = []
+
+            for query in self._local_queries:
+                query.close()
+            self._local_queries = []
+            self._cond.notify_all()
+
+        logging.getLogger(__name__).debug('Closed connection pool for %s', self.db_file)
+
+
+# pools shared by every caller in this process, keyed by database file
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(db_file: str = 'transit.db') -> QueryPool:
+    """Return the process-wide QueryPool for the given database file.
+
+    Pools are created on first use and closed automatically when the interpreter exits.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(db_file)
+        if pool is None or pool.closed:
+            pool = QueryPool(db_file)
+            _POOLS[db_file] = pool
+        return pool
+
+
+@atexit.register
+def close_pools() -> None:
+    """Close every pool created by ``get_pool``.
+    """
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+
 if __name__ == '__main__':
     import python_ta.contracts
     python_ta.contracts.check_all_contracts()
@@ -678,7 +1240,8 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['csv', 'logging', 'os', 'sqlite3', 'typing', 'util'],
+        'extra-imports': ['atexit', 'contextlib', 'csv', 'functools', 'hashlib', 'logging', 'math',
+                          'os', 'sqlite3', 'threading', 'time', 'typing', 'util', 'query_stats'],
         'allowed-io': ['download_data', 'init_db', '_insert_file', '_insert_stop_times_file'],
         'max-line-length': 100,
         'disable': ['E1136']})
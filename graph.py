@@ -5,17 +5,37 @@ functions from the ``data_interface`` module.
 
 Graph implementation is based on CSC111 A3.
 
+This file also contains the CSRGraph class, a compact alternative to Graph exposing the same
+``get_vertex`` interface. It numbers stops with dense integer indices and stores adjacency in
+compressed sparse row (CSR) arrays, so it needs no Python object per stop or edge.
+
+Both graphs store the reverse adjacency of each vertex (the vertices directed to it) as well, for
+searches that run backwards from a destination.
+
 This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
 """
 
 from __future__ import annotations
 
-from typing import Any
+import logging
+from array import array
+from bisect import bisect_left
+from typing import Any, Sequence
 
 import data_interface
+import snapshot
+
+DB_FILE = 'transit.db'
+
+# format version of the graph snapshot file. Increment whenever the stored arrays change.
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_KIND = b'GRPH'
+
+# graph returned by get_shared_graph, keyed by the fingerprint of the database it was loaded from
+_SHARED_GRAPH = {}
 
 
-def load_graph() -> Graph():
+def load_graph(use_snapshot: bool = True) -> Graph:
     """Return a directed transit system graph using the processed data from data_interface.py.
 
     The transit system graph stores one vertex for each stop in the dataset.
@@ -23,19 +43,135 @@ def load_graph() -> Graph():
     Each vertex contains information for the
         - Stop ID
         - Location (latitude, longitude)
+
+    The graph is built from the same snapshot as ``load_csr_graph``.
     """
+    csr = load_csr_graph(use_snapshot)
     g = Graph()
+
+    for i in range(len(csr)):
+        g.add_vertex(csr.stop_ids[i], csr.location_of(i))
+    for i in range(len(csr)):
+        for j in csr.neighbour_indices(i):
+            g.add_edge(csr.stop_ids[i], csr.stop_ids[j])
+
+    return g
+
+
+def load_csr_graph(use_snapshot: bool = True) -> CSRGraph:
+    """Return a directed transit system graph stored as a CSRGraph, using the processed data
+    from data_interface.py.
+
+    The first time the graph is loaded, its arrays are written to the ``transit.graph`` snapshot
+    file next to ``transit.db``. Later calls memory-map the snapshot instead of querying the
+    database, until the database changes. If use_snapshot is False, the graph is always built
+    from the database and no snapshot is read or written.
+    """
     data_interface.init_db('data/')
-    q = data_interface.TransitQuery()
+    path = snapshot.snapshot_path(DB_FILE, '.graph')
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if use_snapshot:
+        arrays = snapshot.read_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint)
+        if arrays is not None:
+            return CSRGraph(*arrays)
+
+    with data_interface.get_pool(DB_FILE).connection() as q:
+        g = build_csr_graph(q.get_stops(), q.get_edges())
 
-    for vertex in q.get_stops():
-        g.add_vertex(vertex[0], vertex[1])
-    for edge in q.get_edges():
-        g.add_edge(edge[0], edge[1])
+    if use_snapshot:
+        try:
+            snapshot.write_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint,
+                                    g.to_arrays())
+        except OSError as e:
+            logging.getLogger(__name__).warning('Could not write graph snapshot: %s', e)
 
     return g
 
 
+def get_shared_graph() -> CSRGraph:
+    """Return the CSRGraph shared by every caller in this process, loading it on first use.
+
+    The graph's arrays are memory-mapped from the snapshot file, so every process using the
+    shared graph reads the same physical pages instead of holding its own copy. Child processes
+    forked after the graph is loaded inherit the mapping without reloading it.
+
+    The graph is reloaded if the database changes.
+    """
+    data_interface.init_db('data/')
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _SHARED_GRAPH:
+        _SHARED_GRAPH.clear()
+        _SHARED_GRAPH[fingerprint] = load_csr_graph()
+
+    return _SHARED_GRAPH[fingerprint]
+
+
+def build_csr_graph(stops: set[tuple[int, tuple[float, float]]],
+                    edges: set[tuple[int, int]]) -> CSRGraph:
+    """Return a CSRGraph with the given stops and directed edges.
+
+    stops and edges are in the formats returned by ``TransitQuery.get_stops`` and
+    ``TransitQuery.get_edges``. Stops are indexed in increasing order of stop_id.
+
+    Raise a ValueError if an edge refers to a stop that is not in stops.
+
+    >>> g = build_csr_graph({(3, (43.0, -79.0)), (1, (43.1, -79.1))}, {(1, 3)})
+    >>> [v.stop_id for v in g.get_vertex(1).get_neighbours()]
+    [3]
+    >>> g.index_of(3)
+    1
+    """
+    sorted_stops = sorted(stops)
+    stop_ids = array('q', (stop[0] for stop in sorted_stops))
+    lats = array('d', (stop[1][0] for stop in sorted_stops))
+    lons = array('d', (stop[1][1] for stop in sorted_stops))
+
+    index_edges = []
+    for stop_id1, stop_id2 in edges:
+        i1 = _find_index(stop_ids, stop_id1)
+        i2 = _find_index(stop_ids, stop_id2)
+        if i1 is None or i2 is None:
+            raise ValueError(f'{stop_id1} and/or {stop_id2} not in this graph.')
+        index_edges.append((i1, i2))
+
+    offsets, targets = _to_csr(len(stop_ids), index_edges)
+    rev_offsets, rev_targets = _to_csr(len(stop_ids), [(i2, i1) for i1, i2 in index_edges])
+
+    return CSRGraph(stop_ids, lats, lons, offsets, targets, rev_offsets, rev_targets)
+
+
+def _to_csr(n: int, index_edges: list[tuple[int, int]]) -> tuple[array, array]:
+    """Return the CSR arrays (offsets, targets) of the directed edges between n vertices given
+    as (source index, target index) pairs.
+
+    >>> offsets, targets = _to_csr(3, [(2, 0), (0, 1), (0, 2)])
+    >>> list(offsets), list(targets)
+    ([0, 2, 2, 3], [1, 2, 0])
+    """
+    index_edges = sorted(index_edges)
+
+    # offsets[i]:offsets[i + 1] is the slice of targets holding the neighbours of vertex i
+    offsets = array('q', [0] * (n + 1))
+    for i1, _ in index_edges:
+        offsets[i1 + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+    targets = array('i', (i2 for _, i2 in index_edges))
+
+    return (offsets, targets)
+
+
+def _find_index(stop_ids: Sequence[int], stop_id: int) -> Any:
+    """Return the index of stop_id in the sorted sequence stop_ids, or None if it is not present.
+    """
+    i = bisect_left(stop_ids, stop_id)
+    if i < len(stop_ids) and stop_ids[i] == stop_id:
+        return i
+    return None
+
+
 class _Vertex:
     """A vertex in a transit system graph, used to represent a stop.
 
@@ -44,13 +180,17 @@ class _Vertex:
         - location: The latitude and longitude of the stop represented by the vertex.
         - neighbours: The vertices that are connected to this vertex. These connections
           are directed.
+        - predecessors: The vertices that this vertex is connected to from, i.e. the vertices
+          with this vertex as a neighbour.
 
     Representation Invariants:
         - self not in self.neighbours
+        - all(self in u.neighbours for u in self.predecessors)
     """
     stop_id: int
     location: tuple[float, float]
     neighbours: set[_Vertex]
+    predecessors: set[_Vertex]
 
     def __init__(self, stop_id: Any, location: tuple[float, float]) -> None:
         """Initialize a new vertex with the given item and location.
@@ -60,12 +200,18 @@ class _Vertex:
         self.stop_id = stop_id
         self.location = location
         self.neighbours = set()
+        self.predecessors = set()
 
     def get_neighbours(self) -> set[_Vertex]:
         """Return the vertices that are directed to from this vertex.
         """
         return self.neighbours
 
+    def get_predecessors(self) -> set[_Vertex]:
+        """Return the vertices that are directed from to this vertex.
+        """
+        return self.predecessors
+
 
 class Graph:
     """A directed graph used to represent a transit system network.
@@ -100,6 +246,7 @@ class Graph:
             v2 = self._vertices[stop_id2]
 
             v1.neighbours.add(v2)
+            v2.predecessors.add(v1)
         else:
             raise ValueError(f'{stop_id1} and/or {stop_id2} not in this graph.')
 
@@ -109,6 +256,151 @@ class Graph:
         return self._vertices[stop_id]
 
 
+class _CSRVertex:
+    """A view of a single vertex of a CSRGraph, providing the same interface as _Vertex.
+
+    Views are created on demand and hold no data of their own. Two views are equal if and only if
+    they refer to the same vertex of the same graph.
+
+    Instance Attributes:
+        - graph: the graph containing this vertex
+        - index: the dense index of this vertex in the graph
+
+    Representation Invariants:
+        - 0 <= self.index < len(self.graph)
+    """
+    graph: CSRGraph
+    index: int
+
+    def __init__(self, graph: CSRGraph, index: int) -> None:
+        """Initialize a new view of the vertex with the given index in graph."""
+        self.graph = graph
+        self.index = index
+
+    def __eq__(self, other: Any) -> bool:
+        """Return whether other is a view of the same vertex."""
+        return isinstance(other, _CSRVertex) and self.index == other.index \
+            and self.graph is other.graph
+
+    def __hash__(self) -> int:
+        """Return the hash of this vertex."""
+        return hash(self.index)
+
+    @property
+    def stop_id(self) -> int:
+        """The stop_id of the stop represented by this vertex."""
+        return self.graph.stop_ids[self.index]
+
+    @property
+    def location(self) -> tuple[float, float]:
+        """The latitude and longitude of the stop represented by this vertex."""
+        return self.graph.location_of(self.index)
+
+    def get_neighbours(self) -> list[_CSRVertex]:
+        """Return the vertices that are directed to from this vertex.
+        """
+        return [_CSRVertex(self.graph, i) for i in self.graph.neighbour_indices(self.index)]
+
+    def get_predecessors(self) -> list[_CSRVertex]:
+        """Return the vertices that are directed from to this vertex.
+        """
+        return [_CSRVertex(self.graph, i) for i in self.graph.predecessor_indices(self.index)]
+
+
+class CSRGraph:
+    """A directed graph used to represent a transit system network, stored in flat arrays.
+
+    Stops are identified by dense indices 0 to n - 1, assigned in increasing order of stop_id.
+    The neighbours of the vertex with index i are ``targets[offsets[i]:offsets[i + 1]]``, and its
+    predecessors (the vertices with i as a neighbour) are
+    ``rev_targets[rev_offsets[i]:rev_offsets[i + 1]]``.
+
+    The arrays may be any integer/float sequences supporting indexing and slicing, such as
+    ``array.array`` objects or memoryviews of a memory-mapped file.
+
+    Instance Attributes:
+        - stop_ids: stop_id of each vertex, in increasing order
+        - lats: latitude of each vertex
+        - lons: longitude of each vertex
+        - offsets: start of each vertex's neighbours in targets, followed by len(targets)
+        - targets: indices of the neighbours of every vertex, grouped by vertex
+        - rev_offsets: start of each vertex's predecessors in rev_targets, followed by
+          len(rev_targets)
+        - rev_targets: indices of the predecessors of every vertex, grouped by vertex
+
+    Representation Invariants:
+        - len(self.stop_ids) == len(self.lats) == len(self.lons) == len(self.offsets) - 1
+        - len(self.rev_offsets) == len(self.offsets)
+        - self.offsets[0] == 0 and self.offsets[-1] == len(self.targets)
+        - len(self.rev_targets) == len(self.targets)
+        - all(self.stop_ids[i] < self.stop_ids[i + 1] for i in range(len(self.stop_ids) - 1))
+    """
+    stop_ids: Sequence[int]
+    lats: Sequence[float]
+    lons: Sequence[float]
+    offsets: Sequence[int]
+    targets: Sequence[int]
+    rev_offsets: Sequence[int]
+    rev_targets: Sequence[int]
+
+    def __init__(self, stop_ids: Sequence[int], lats: Sequence[float], lons: Sequence[float],
+                 offsets: Sequence[int], targets: Sequence[int], rev_offsets: Sequence[int],
+                 rev_targets: Sequence[int]) -> None:
+        """Initialize a graph from its CSR arrays.
+        """
+        self.stop_ids = stop_ids
+        self.lats = lats
+        self.lons = lons
+        self.offsets = offsets
+        self.targets = targets
+        self.rev_offsets = rev_offsets
+        self.rev_targets = rev_targets
+
+    def to_arrays(self) -> list[Sequence]:
+        """Return the arrays of this graph, in the order accepted by the initializer."""
+        return [self.stop_ids, self.lats, self.lons, self.offsets, self.targets,
+                self.rev_offsets, self.rev_targets]
+
+    def __len__(self) -> int:
+        """Return the number of vertices in this graph."""
+        return len(self.stop_ids)
+
+    def num_edges(self) -> int:
+        """Return the number of directed edges in this graph."""
+        return len(self.targets)
+
+    def index_of(self, stop_id: int) -> int:
+        """Return the dense index of the vertex with the given stop_id.
+
+        Raise a KeyError if stop_id is not in this graph.
+        """
+        i = _find_index(self.stop_ids, stop_id)
+        if i is None:
+            raise KeyError(stop_id)
+        return i
+
+    def location_of(self, index: int) -> tuple[float, float]:
+        """Return the latitude and longitude of the vertex with the given index."""
+        return (self.lats[index], self.lons[index])
+
+    def neighbour_indices(self, index: int) -> Sequence[int]:
+        """Return the indices of the vertices directed to from the vertex with the given index.
+        """
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def predecessor_indices(self, index: int) -> Sequence[int]:
+        """Return the indices of the vertices directed from to the vertex with the given index.
+        """
+        return self.rev_targets[self.rev_offsets[index]:self.rev_offsets[index + 1]]
+
+    def get_vertex(self, stop_id: int) -> _CSRVertex:
+        """Return a vertex given an item (stop_id).
+
+        Raise a KeyError if stop_id is not in this graph.
+        """
+        return _CSRVertex(self, self.index_of(stop_id))
+
+
 if __name__ == '__main__':
     import python_ta.contracts
     python_ta.contracts.check_all_contracts()
@@ -118,7 +410,7 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['typing', 'data_interface'],
+        'extra-imports': ['array', 'bisect', 'logging', 'typing', 'data_interface', 'snapshot'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['E1136']})
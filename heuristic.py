@@ -0,0 +1,183 @@
+"""TTC Route Planner for Toronto, Ontario -- A* Costs and Heuristics
+
+This module provides the cost models used by ``pathfinding.a_star``. A cost model pairs the cost
+of each edge of the search with a heuristic estimate of the remaining cost to a goal, in the same
+units, so that A* only needs to know the model to search with it.
+
+Each heuristic is admissible (it never overestimates the cost of reaching the goal) and
+consistent (it never decreases along an edge by more than the edge's cost), so a_star settles
+each stop with its optimal cost:
+    - TravelTimeCost scores paths by their travel time in seconds. Its heuristic is the time
+      needed to cover the great-circle distance to the goal at the network's maximum speed,
+      since no vehicle, and no walk, gets closer to the goal any faster. This only holds if the
+      maximum speed counts every edge: schedules rounded to whole minutes have hops that cover
+      a distance in no time, and a network with any such hop has an infinite maximum speed (see
+      ``data_interface.TransitQuery.get_max_speed``), for which the heuristic is zero.
+    - LandmarkCost also scores paths by their travel time, and strengthens the heuristic of
+      TravelTimeCost with the ALT lower bounds of a ``landmarks.LandmarkTable``, whose lower
+      bound edge times count hops that take no time as free. In a network with such hops, only
+      the ALT bounds are used.
+    - DistanceTimeCost scores each edge by its distance times its travel time, the original
+      cost of a_star. No positive lower bound exists for this cost, so its heuristic is zero.
+
+``get_default_cost_model`` returns the LandmarkCost of the transit database, with the maximum
+speed computed when the database was initialized and its shared landmark table.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from math import inf
+
+import data_interface
+from graph import DB_FILE, CSRGraph
+from landmarks import LandmarkTable, get_shared_landmarks
+from timetable import WALK_SPEED
+from util import distance
+
+# cost model returned by get_default_cost_model, keyed by the database fingerprint
+_DEFAULT_COST_MODEL = {}
+
+
+class CostModel:
+    """A cost for the edges of a pathfinding search, with a heuristic in the same units.
+
+    This is an abstract class. Use one of its subclasses.
+    """
+
+    def edge_cost(self, dist: float, elapsed: float) -> float:
+        """Return the cost of an edge travelling dist km, taking elapsed seconds from the time
+        the search reached the start of the edge (including any time spent waiting).
+        """
+        raise NotImplementedError
+
+    def heuristic(self, graph: CSRGraph, curr: int, goal: int) -> float:
+        """Return a lower bound on the cost of any path from the stop with index curr to the
+        stop with index goal in graph.
+        """
+        raise NotImplementedError
+
+
+class TravelTimeCost(CostModel):
+    """The travel time of a path, in seconds.
+
+    Instance Attributes:
+        - max_speed: the maximum speed of any vehicle or walk in the network, in km/s, or inf if
+          some vehicle covers a distance in no time
+
+    Representation Invariants:
+        - self.max_speed > 0
+    """
+    max_speed: float
+
+    def __init__(self, max_speed: float) -> None:
+        """Initialize a travel time cost for a network where nothing travels faster than
+        max_speed km/s. max_speed must be inf if some edge of the network covers a distance in
+        no time, or the heuristic is not admissible.
+
+        Preconditions:
+            - max_speed > 0
+        """
+        self.max_speed = max_speed
+
+    def edge_cost(self, dist: float, elapsed: float) -> float:
+        """Return the cost of an edge travelling dist km, taking elapsed seconds from the time
+        the search reached the start of the edge.
+
+        >>> TravelTimeCost(0.02).edge_cost(1.5, 120)
+        120
+        """
+        return elapsed
+
+    def heuristic(self, graph: CSRGraph, curr: int, goal: int) -> float:
+        """Return the time needed to travel from the stop with index curr to the stop with
+        index goal in a straight line at max_speed, which is 0 if max_speed is inf.
+        """
+        return distance(graph.location_of(curr), graph.location_of(goal)) / self.max_speed
+
+
+class LandmarkCost(TravelTimeCost):
+    """The travel time of a path, in seconds, with the heuristic strengthened by the lower
+    bounds of a landmark table.
+
+    Instance Attributes:
+        - landmarks: the landmark table of the graph searched
+    """
+    landmarks: LandmarkTable
+
+    def __init__(self, max_speed: float, landmarks: LandmarkTable) -> None:
+        """Initialize a travel time cost for a network where nothing travels faster than
+        max_speed km/s, with the given landmark table.
+
+        Preconditions:
+            - max_speed > 0
+        """
+        super().__init__(max_speed)
+        self.landmarks = landmarks
+
+    def heuristic(self, graph: CSRGraph, curr: int, goal: int) -> float:
+        """Return the larger of the straight line bound of TravelTimeCost and the landmark
+        bound on the travel time from the stop with index curr to the stop with index goal.
+        If max_speed is inf, this is the landmark bound alone.
+
+        Preconditions:
+            - graph is self.landmarks.graph
+        """
+        bound = self.landmarks.lower_bound(curr, goal)
+        if bound == inf:
+            return inf
+        if self.max_speed == inf:
+            return bound
+        return max(bound, super().heuristic(graph, curr, goal))
+
+
+class DistanceTimeCost(CostModel):
+    """The sum over the edges of a path of the distance travelled times the time taken.
+    """
+
+    def edge_cost(self, dist: float, elapsed: float) -> float:
+        """Return the cost of an edge travelling dist km, taking elapsed seconds from the time
+        the search reached the start of the edge.
+
+        >>> DistanceTimeCost().edge_cost(1.5, 120)
+        180.0
+        """
+        return dist * elapsed
+
+    def heuristic(self, graph: CSRGraph, curr: int, goal: int) -> float:
+        """Return 0, the only lower bound on the cost from curr to goal that holds for every
+        network.
+        """
+        return 0.0
+
+
+def get_default_cost_model() -> CostModel:
+    """Return the cost model used by pathfinding by default: the LandmarkCost for the
+    maximum speed of the transit database and its shared landmark table.
+
+    The maximum speed is read from the database once per process, and again if the database
+    changes.
+    """
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _DEFAULT_COST_MODEL:
+        with data_interface.get_pool(DB_FILE).connection() as query:
+            max_speed = max(query.get_max_speed(), WALK_SPEED)
+        _DEFAULT_COST_MODEL.clear()
+        _DEFAULT_COST_MODEL[fingerprint] = LandmarkCost(max_speed, get_shared_landmarks())
+
+    return _DEFAULT_COST_MODEL[fingerprint]
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['math', 'data_interface', 'graph', 'landmarks', 'timetable', 'util'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -0,0 +1,406 @@
+"""TTC Route Planner for Toronto, Ontario -- Hub Transfer Patterns
+
+This module provides a routing engine over a ``timetable.Timetable`` that answers queries from
+precomputed transfer patterns (Bast et al., 2010) between hubs: the major transfer stations of
+the network, which are the stops served by the subway (GTFS route_type 1).
+
+A transfer pattern is the sequence of legs of a journey, without its times: the stops each trip
+is boarded and left at, and the walks between. A heavy preprocessing step runs a profile
+Connection Scan (see ``profile_csa.stop_profiles``) for the whole week to every hub, and keeps
+the distinct transfer patterns of the optimal journeys from every other hub. Patterns are
+computed in parallel, one target hub per task, and stored in a memory-mapped snapshot file next
+to the database, like the transfer set of ``trip_based``. This takes hours for a large network,
+so it is never done at query time: ``precompute_hub_labels`` must be run offline, from a main
+process, before the 'hub_labels' engine is used, and again whenever the database changes.
+
+A query then considers the journeys that reach the destination directly (by walking, or by a
+single trip), and those that reach a hub directly, follow a transfer pattern to another hub, and
+reach the destination directly from there. Each leg of a pattern is evaluated with a direct
+connection lookup: the earliest trip of the route patterns through both of its stops. No search
+is run. Journeys that transfer only between routes outside the hubs are not considered, so the
+journey found may arrive later than the earliest arrival. Its travel time is checked against
+the ALT lower bound of the landmark table (see ``landmarks.LandmarkTable.lower_bound``): if it
+takes more than MAX_DETOUR times the lower bound, or no journey is found this way, the query
+falls back to a Connection Scan (see the ``csa`` module). A journey returned never takes more
+than MAX_DETOUR times as long as the fastest one.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import logging
+from array import array
+from math import inf
+from multiprocessing import Pool
+from typing import Optional, Sequence
+
+import data_interface
+import snapshot
+from csa import csa
+from graph import DB_FILE
+from landmarks import get_shared_landmarks
+from profile_csa import journey_legs, stop_profiles
+from timetable import DAY, WEEK, Timetable, get_shared_timetable
+
+# GTFS route_type of the routes whose stops are hubs (subway and metro)
+HUB_ROUTE_TYPE = 1
+
+# the most times the lower bound on the travel time a journey through the hubs may take before
+# a query falls back to a Connection Scan
+MAX_DETOUR = 1.5
+
+# format version of the hub pattern snapshot file. Increment whenever the stored arrays or the
+# way patterns are computed change.
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_KIND = b'HUBS'
+
+# hub labels returned by get_shared_hub_labels, keyed by the database fingerprint
+_SHARED_HUB_LABELS = {}
+
+
+class HubLabels:
+    """The transfer patterns between the hubs of a timetable.
+
+    Hub number a is the stop with index ``hubs[a]``. The transfer patterns from hub a to hub b
+    are the q with ``pair_offsets[a * len(hubs) + b] <= q < pair_offsets[a * len(hubs) + b + 1]``,
+    and the legs of pattern q are the l with ``pattern_offsets[q] <= l < pattern_offsets[q + 1]``.
+    Leg l goes from stop ``leg_from[l]`` to stop ``leg_to[l]``, by walking if ``leg_walk[l]``
+    and on a single trip otherwise.
+
+    Instance Attributes:
+        - timetable: the timetable whose stops are connected
+        - hubs, pair_offsets, pattern_offsets, leg_from, leg_to, leg_walk: see above
+        - hub_numbers: the hub number of each hub, keyed by its stop index
+
+    Representation Invariants:
+        - len(self.pair_offsets) == len(self.hubs) ** 2 + 1
+        - len(self.leg_from) == len(self.leg_to) == len(self.leg_walk)
+    """
+    timetable: Timetable
+    hubs: Sequence[int]
+    pair_offsets: Sequence[int]
+    pattern_offsets: Sequence[int]
+    leg_from: Sequence[int]
+    leg_to: Sequence[int]
+    leg_walk: Sequence[int]
+    hub_numbers: dict[int, int]
+
+    def __init__(self, timetable: Timetable, arrays: Sequence[Sequence[int]]) -> None:
+        """Initialize hub labels for timetable from their arrays, given in the order returned
+        by ``to_arrays``.
+        """
+        self.timetable = timetable
+        (self.hubs, self.pair_offsets, self.pattern_offsets, self.leg_from, self.leg_to,
+         self.leg_walk) = arrays
+        self.hub_numbers = {hub: a for a, hub in enumerate(self.hubs)}
+
+    def to_arrays(self) -> list[Sequence[int]]:
+        """Return the arrays of these hub labels, in the order accepted by the initializer."""
+        return [self.hubs, self.pair_offsets, self.pattern_offsets, self.leg_from, self.leg_to,
+                self.leg_walk]
+
+    def num_patterns(self) -> int:
+        """Return the number of transfer patterns stored."""
+        return len(self.pattern_offsets) - 1
+
+    def patterns(self, a: int, b: int) -> list[list[tuple[int, int, bool]]]:
+        """Return the transfer patterns from hub number a to hub number b, each a list of
+        (from stop, to stop, walk) legs.
+        """
+        pair = a * len(self.hubs) + b
+        return [[(self.leg_from[l], self.leg_to[l], bool(self.leg_walk[l]))
+                 for l in range(self.pattern_offsets[q], self.pattern_offsets[q + 1])]
+                for q in range(self.pair_offsets[pair], self.pair_offsets[pair + 1])]
+
+
+def precompute_hub_labels(processes: Optional[int] = None) -> HubLabels:
+    """Compute the HubLabels for the shared timetable of the transit database, write their
+    arrays to the ``transit.hubs`` snapshot file next to ``transit.db``, and return them.
+
+    This is the offline preprocessing step of the 'hub_labels' engine, run with processes worker
+    processes (by default, one per CPU). It takes a long time for a large network, and must be
+    called from a main process, not from a worker of a process pool.
+
+    Raises OSError if the snapshot cannot be written.
+    """
+    timetable = get_shared_timetable()
+    with data_interface.get_pool(DB_FILE).connection() as query:
+        hubs = [timetable.graph.index_of(stop_id)
+                for stop_id in query.get_route_type_stops(HUB_ROUTE_TYPE)]
+    labels = compute_hub_labels(timetable, hubs, processes)
+
+    snapshot.write_snapshot(snapshot.snapshot_path(DB_FILE, '.hubs'), _SNAPSHOT_KIND,
+                            SNAPSHOT_VERSION, data_interface.database_fingerprint(DB_FILE),
+                            labels.to_arrays())
+    return labels
+
+
+def load_hub_labels() -> HubLabels:
+    """Return the HubLabels for the shared timetable of the transit database, memory-mapped
+    from the snapshot file written by precompute_hub_labels.
+
+    Raises FileNotFoundError if there is no snapshot for the current database. The patterns are
+    not computed here, since that takes far too long for a query.
+    """
+    path = snapshot.snapshot_path(DB_FILE, '.hubs')
+    arrays = snapshot.read_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION,
+                                    data_interface.database_fingerprint(DB_FILE))
+    if arrays is None:
+        raise FileNotFoundError(f'No transfer patterns for the current database in "{path}". '
+                                'Run hub_labels.precompute_hub_labels() first.')
+    return HubLabels(get_shared_timetable(), arrays)
+
+
+def get_shared_hub_labels() -> HubLabels:
+    """Return the HubLabels shared by every caller in this process, loading them on first use.
+
+    As with ``timetable.get_shared_timetable``, the labels are memory-mapped from their snapshot
+    file and reloaded if the database changes.
+
+    Raises FileNotFoundError if there is no snapshot for the current database.
+    """
+    timetable = get_shared_timetable()
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _SHARED_HUB_LABELS \
+            or _SHARED_HUB_LABELS[fingerprint].timetable is not timetable:
+        _SHARED_HUB_LABELS.clear()
+        _SHARED_HUB_LABELS[fingerprint] = load_hub_labels()
+
+    return _SHARED_HUB_LABELS[fingerprint]
+
+
+def compute_hub_labels(timetable: Timetable, hubs: list[int],
+                       processes: Optional[int] = None) -> HubLabels:
+    """Return the transfer patterns between the given hub stops of timetable, computed by
+    processes worker processes (by default, one per CPU).
+
+    timetable must be the shared timetable, which each worker process uses.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Computing transfer patterns between %d hubs', len(hubs))
+
+    with Pool(processes) as pool:
+        # the patterns to each hub, from every hub
+        patterns_to = pool.map(_patterns_to, [(hubs, b) for b in range(len(hubs))])
+
+    pair_offsets, pattern_offsets = array('q', [0]), array('q', [0])
+    leg_from, leg_to, leg_walk = array('i'), array('i'), array('b')
+    for a in range(len(hubs)):
+        for b in range(len(hubs)):
+            for pattern in patterns_to[b][a]:
+                for walk, from_stop, to_stop in pattern:
+                    leg_from.append(from_stop)
+                    leg_to.append(to_stop)
+                    leg_walk.append(walk)
+                pattern_offsets.append(len(leg_from))
+            pair_offsets.append(len(pattern_offsets) - 1)
+
+    logger.info('Computed %d transfer patterns', len(pattern_offsets) - 1)
+    return HubLabels(timetable, [array('i', hubs), pair_offsets, pattern_offsets, leg_from,
+                                 leg_to, leg_walk])
+
+
+def _patterns_to(task: tuple[list[int], int]) -> list[list[tuple[tuple[int, int, int], ...]]]:
+    """Return the distinct transfer patterns of the optimal journeys from every hub to hub
+    number b over the week, for the task (hubs, b), in a worker process of compute_hub_labels.
+    Each pattern is a tuple of (walk, from stop, to stop) legs.
+    """
+    hubs, b = task
+    timetable = get_shared_timetable()
+    # journeys departing late in the week may arrive in the next one
+    profiles = stop_profiles(timetable, hubs, [(hubs[b], 0)], 0, WEEK + DAY)
+
+    patterns = []
+    for a, hub in enumerate(hubs):
+        found = set()
+        if a != b:
+            for departure, _, journey in profiles.get(hub, []):
+                if departure < WEEK:
+                    found.add(tuple((int(trip == -1), from_stop, to_stop)
+                                    for trip, from_stop, to_stop in journey_legs(journey)))
+        patterns.append(sorted(found))
+    return patterns
+
+
+def hub_route(timetable: Timetable, sources: list[tuple[int, float]],
+              targets: list[tuple[int, float]]) \
+        -> Optional[tuple[list[tuple[int, int, int]], float]]:
+    """Return the journey with the earliest arrival at the destination, from any of the sources
+    to any of the targets, among those going directly to the destination or through the hubs.
+
+    sources and targets are given as for ``raptor.raptor``, and the journey is returned in the
+    same format: a tuple of the path and the time of arrival at the destination, or None if no
+    journey is found. If no journey goes directly to the destination or through the hubs, or if
+    the best one takes more than MAX_DETOUR times the lower bound on the travel time, the
+    journey is found with ``csa.csa`` instead.
+
+    Raises FileNotFoundError if the transfer patterns were not precomputed for the current
+    database (see precompute_hub_labels).
+
+    Preconditions:
+        - timetable is the shared timetable
+    """
+    labels = get_shared_hub_labels()
+    departure = min(time for _, time in sources)
+    bound = _arrival_bound(sources, targets)
+    if bound == inf:  # the destination cannot be reached at all
+        return None
+    egress = dict(targets)
+    # the best journey found, as (arrival at the destination, legs)
+    best = (inf, None)
+
+    # the earliest arrival at each hub reached directly from a source, with the legs taken
+    at_hub = {}
+    for source, time in sources:
+        for stop, (arrival, legs) in _direct(timetable, source, time).items():
+            if stop in egress and arrival + egress[stop] < best[0]:
+                best = (arrival + egress[stop], legs)
+            if stop in labels.hub_numbers and arrival < at_hub.get(stop, (inf,))[0]:
+                at_hub[stop] = (arrival, legs)
+
+    # the earliest arrival at each hub from which the destination can be reached directly
+    exits = _exit_hubs(timetable, labels, egress)
+    at_exit = {hub: at_hub[hub] for hub in exits if hub in at_hub}
+    for hub, (time, legs) in at_hub.items():
+        a = labels.hub_numbers[hub]
+        for exit_hub in exits:
+            for pattern in labels.patterns(a, labels.hub_numbers[exit_hub]):
+                followed = _follow(timetable, pattern, time)
+                if followed is not None and followed[0] < at_exit.get(exit_hub, (inf,))[0]:
+                    at_exit[exit_hub] = (followed[0], legs + followed[1])
+
+    for hub, (time, legs) in at_exit.items():
+        for stop, (arrival, exit_legs) in _direct(timetable, hub, time).items():
+            if stop in egress and arrival + egress[stop] < best[0]:
+                best = (arrival + egress[stop], legs + exit_legs)
+
+    if best[1] is None or best[0] - departure > MAX_DETOUR * (bound - departure):
+        return csa(timetable, sources, targets)
+    stop_ids = timetable.graph.stop_ids
+    path = [(trip_id, stop_ids[from_stop], stop_ids[to_stop])
+            for trip_id, from_stop, to_stop in reversed(best[1])]
+    return (path, best[0])
+
+
+def _arrival_bound(sources: list[tuple[int, float]], targets: list[tuple[int, float]]) -> float:
+    """Return a lower bound on the arrival at the destination of any journey from the sources
+    to the targets, or inf if none can reach it, from the shared landmark table.
+    """
+    landmarks = get_shared_landmarks()
+    return min((time + landmarks.lower_bound(source, target) + egress
+                for source, time in sources for target, egress in targets), default=inf)
+
+
+def _direct(timetable: Timetable, stop: int, time: float) \
+        -> dict[int, tuple[float, list[tuple[int, int, int]]]]:
+    """Return the earliest arrival at every stop reached from stop at time without a transfer:
+    the stop itself, the stops one footpath away, and the stops reached by a single trip, each
+    with the legs taken as (trip_id, from stop, to stop), where the trip_id is 0 for walking.
+    """
+    reached = {stop: (time, [])}
+    for j in range(timetable.foot_offsets[stop], timetable.foot_offsets[stop + 1]):
+        arrival = time + timetable.foot_times[j]
+        if arrival < reached.get(timetable.foot_targets[j], (inf,))[0]:
+            reached[timetable.foot_targets[j]] = (arrival, [(0, stop, timetable.foot_targets[j])])
+
+    for j in range(timetable.stop_pattern_offsets[stop], timetable.stop_pattern_offsets[stop + 1]):
+        pattern, position = timetable.stop_patterns[j], timetable.stop_pattern_positions[j]
+        trip = timetable.earliest_trip(pattern, position, time)
+        if trip is None:
+            continue
+        trip_id = timetable.trip_id(pattern, trip[0])
+        first = timetable.pattern_stop_offsets[pattern]
+        for i in range(position + 1, timetable.pattern_length(pattern)):
+            arrival = timetable.trip_time(pattern, trip[0], i, departure=False) + trip[1]
+            to_stop = timetable.pattern_stops[first + i]
+            if arrival < reached.get(to_stop, (inf,))[0]:
+                reached[to_stop] = (arrival, [(trip_id, stop, to_stop)])
+    return reached
+
+
+def _follow(timetable: Timetable, pattern: list[tuple[int, int, bool]], time: float) \
+        -> Optional[tuple[float, list[tuple[int, int, int]]]]:
+    """Return the earliest arrival at the end of the transfer pattern starting at time, with
+    the legs taken, or None if a leg cannot be taken.
+    """
+    legs = []
+    for from_stop, to_stop, walk in pattern:
+        if walk:
+            time += _walk_time(timetable, from_stop, to_stop)
+            legs.append((0, from_stop, to_stop))
+        else:
+            ride = _ride(timetable, from_stop, to_stop, time)
+            if ride is None:
+                return None
+            time = ride[0]
+            legs.append((ride[1], from_stop, to_stop))
+    return (time, legs)
+
+
+def _ride(timetable: Timetable, from_stop: int, to_stop: int,
+          time: float) -> Optional[tuple[float, int]]:
+    """Return the earliest arrival at to_stop on a single trip boarded at from_stop at or after
+    time, with the trip_id of the trip, or None if no trip goes from one to the other.
+    """
+    best = None
+    for j in range(timetable.stop_pattern_offsets[from_stop],
+                   timetable.stop_pattern_offsets[from_stop + 1]):
+        pattern, position = timetable.stop_patterns[j], timetable.stop_pattern_positions[j]
+        first = timetable.pattern_stop_offsets[pattern]
+        for i in range(position + 1, timetable.pattern_length(pattern)):
+            if timetable.pattern_stops[first + i] == to_stop:
+                trip = timetable.earliest_trip(pattern, position, time)
+                if trip is not None:
+                    arrival = timetable.trip_time(pattern, trip[0], i, departure=False) + trip[1]
+                    if best is None or arrival < best[0]:
+                        best = (arrival, timetable.trip_id(pattern, trip[0]))
+                break
+    return best
+
+
+def _walk_time(timetable: Timetable, from_stop: int, to_stop: int) -> float:
+    """Return the walking time of the footpath from from_stop to to_stop.
+
+    Preconditions:
+        - a footpath goes from from_stop to to_stop
+    """
+    for j in range(timetable.foot_offsets[from_stop], timetable.foot_offsets[from_stop + 1]):
+        if timetable.foot_targets[j] == to_stop:
+            return timetable.foot_times[j]
+    raise ValueError(f'No footpath from stop {from_stop} to stop {to_stop}.')
+
+
+def _exit_hubs(timetable: Timetable, labels: HubLabels, egress: dict[int, float]) -> set[int]:
+    """Return the hubs from which a target can be reached without a transfer: the targets that
+    are hubs, and the hubs one footpath away from a target or before it on a route pattern.
+    """
+    exits = set()
+    for target in egress:
+        exits.add(target)
+        exits.update(timetable.foot_targets[j] for j in range(timetable.foot_offsets[target],
+                                                              timetable.foot_offsets[target + 1]))
+        for j in range(timetable.stop_pattern_offsets[target],
+                       timetable.stop_pattern_offsets[target + 1]):
+            pattern, position = timetable.stop_patterns[j], timetable.stop_pattern_positions[j]
+            first = timetable.pattern_stop_offsets[pattern]
+            exits.update(timetable.pattern_stops[first:first + position])
+    return {stop for stop in exits if stop in labels.hub_numbers}
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['logging', 'array', 'math', 'multiprocessing', 'typing',
+                          'data_interface', 'snapshot', 'csa', 'graph', 'landmarks',
+                          'profile_csa', 'timetable'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
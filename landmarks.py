@@ -0,0 +1,271 @@
+"""TTC Route Planner for Toronto, Ontario -- Landmarks
+
+This module provides the LandmarkTable class, used for the ALT (A*, Landmarks, Triangle
+inequality) heuristic of ``heuristic.LandmarkCost``, and the functions for building it.
+
+A small set of landmark stops is chosen spread out over the network, and the lower-bound travel
+time from every stop to and from each landmark is precomputed. Lower-bound travel times are
+shortest paths in the graph where each edge takes the shortest time any vehicle is scheduled to
+travel it, and each walking footpath takes its walking time. By the triangle inequality, for
+any landmark L, no journey from a stop v to a stop t is faster than
+``dist(v, L) - dist(t, L)`` or ``dist(L, t) - dist(L, v)``.
+
+Landmarks are chosen when the tables are first built for a database, and the tables are cached
+in a memory-mapped snapshot file next to the database, like the graph.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+from array import array
+from math import inf
+from typing import Sequence
+
+import data_interface
+import snapshot
+from graph import DB_FILE, CSRGraph, get_shared_graph
+from timetable import compute_footpaths
+from util import distance
+
+# number of landmarks chosen
+NUM_LANDMARKS = 16
+
+# format version of the landmark snapshot file. Increment whenever the stored arrays or the way
+# they are computed change.
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_KIND = b'LMRK'
+
+# stored lower-bound time of a stop that cannot reach, or cannot be reached from, a landmark
+UNREACHABLE = 2 ** 31 - 1
+
+# landmark table returned by get_shared_landmarks, keyed by the database fingerprint
+_SHARED_LANDMARKS = {}
+
+# (graph, lower-bound graphs) returned by get_shared_lower_bound_graphs, keyed by the database
+# fingerprint
+_SHARED_LOWER_BOUNDS = {}
+
+
+class LandmarkTable:
+    """The lower-bound travel times between every stop of a graph and a set of landmark stops.
+
+    Times are stored as whole seconds, rounded down, with UNREACHABLE for stops that cannot
+    reach (or be reached from) a landmark. The lower-bound time from the stop with index v to
+    the l-th landmark is ``to_landmark[l * len(graph) + v]``, and from the l-th landmark to v is
+    ``from_landmark[l * len(graph) + v]``.
+
+    Instance Attributes:
+        - graph: the transit graph whose stop indices this table uses
+        - landmarks: the index of each landmark stop
+        - to_landmark, from_landmark: see above
+
+    Representation Invariants:
+        - len(self.to_landmark) == len(self.from_landmark) == len(self.landmarks) * len(self.graph)
+    """
+    graph: CSRGraph
+    landmarks: Sequence[int]
+    to_landmark: Sequence[int]
+    from_landmark: Sequence[int]
+
+    def __init__(self, graph: CSRGraph, arrays: Sequence[Sequence[int]]) -> None:
+        """Initialize a landmark table for graph from its arrays, given in the order returned
+        by ``to_arrays``.
+        """
+        self.graph = graph
+        self.landmarks, self.to_landmark, self.from_landmark = arrays
+
+    def to_arrays(self) -> list[Sequence[int]]:
+        """Return the arrays of this table, in the order accepted by the initializer."""
+        return [self.landmarks, self.to_landmark, self.from_landmark]
+
+    def num_landmarks(self) -> int:
+        """Return the number of landmarks in this table."""
+        return len(self.landmarks)
+
+    def lower_bound(self, curr: int, goal: int) -> float:
+        """Return a lower bound on the travel time, in seconds, from the stop with index curr to
+        the stop with index goal. Return inf if curr cannot reach goal.
+        """
+        n = len(self.graph)
+        bound = 0
+        for i in range(curr, len(self.to_landmark), n):
+            curr_to, goal_to = self.to_landmark[i], self.to_landmark[i - curr + goal]
+            curr_from, goal_from = self.from_landmark[i], self.from_landmark[i - curr + goal]
+            if goal_to != UNREACHABLE:
+                if curr_to == UNREACHABLE:  # curr reaching goal would make it reach L
+                    return inf
+                # each stored time is rounded down by less than a second
+                bound = max(bound, curr_to - goal_to - 1)
+            if curr_from != UNREACHABLE:
+                if goal_from == UNREACHABLE:  # L reaching curr would make it reach goal
+                    return inf
+                bound = max(bound, goal_from - curr_from - 1)
+        return bound
+
+
+def load_landmarks(use_snapshot: bool = True) -> LandmarkTable:
+    """Return the LandmarkTable for the transit database.
+
+    The landmarks are chosen and the table is built the first time it is loaded, and its arrays
+    are written to the ``transit.landmarks`` snapshot file next to ``transit.db``. Later calls
+    memory-map the snapshot, until the database changes. If use_snapshot is False, the table is
+    always built and no snapshot is read or written.
+    """
+    graph = get_shared_graph()
+    path = snapshot.snapshot_path(DB_FILE, '.landmarks')
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if use_snapshot:
+        arrays = snapshot.read_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint)
+        if arrays is not None:
+            return LandmarkTable(graph, arrays)
+
+    table = build_landmarks(graph)
+
+    if use_snapshot:
+        try:
+            snapshot.write_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint,
+                                    table.to_arrays())
+        except OSError as e:
+            logging.getLogger(__name__).warning('Could not write landmark snapshot: %s', e)
+
+    return table
+
+
+def get_shared_landmarks() -> LandmarkTable:
+    """Return the LandmarkTable shared by every caller in this process, loading it on first use.
+
+    As with ``graph.get_shared_graph``, the table is memory-mapped from its snapshot file and
+    reloaded if the database changes.
+    """
+    graph = get_shared_graph()
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _SHARED_LANDMARKS or _SHARED_LANDMARKS[fingerprint].graph is not graph:
+        _SHARED_LANDMARKS.clear()
+        _SHARED_LANDMARKS[fingerprint] = load_landmarks()
+
+    return _SHARED_LANDMARKS[fingerprint]
+
+
+def build_landmarks(graph: CSRGraph, num_landmarks: int = NUM_LANDMARKS) -> LandmarkTable:
+    """Return a new LandmarkTable for graph with num_landmarks landmarks, using the travel times
+    in the transit database.
+
+    Landmarks are chosen greedily: the first is the stop furthest from the centre of the
+    network, and each next landmark is the stop furthest (in lower-bound travel time, there and
+    back) from the landmarks chosen so far.
+
+    Preconditions:
+        - 1 <= num_landmarks <= len(graph)
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Building landmark tables')
+
+    forward, backward = lower_bound_graphs(graph)
+    n = len(graph)
+
+    centre = (sum(graph.lats) / n, sum(graph.lons) / n)
+    landmark = max(range(n), key=lambda v: distance(centre, graph.location_of(v)))
+
+    landmarks = array('i')
+    to_landmark = array('i')
+    from_landmark = array('i')
+    # lower-bound time there and back between each stop and its closest landmark
+    closest = [inf] * n
+    for _ in range(num_landmarks):
+        landmarks.append(landmark)
+        times_to = _dijkstra(backward, landmark)
+        times_from = _dijkstra(forward, landmark)
+        to_landmark.extend(UNREACHABLE if t == inf else int(t) for t in times_to)
+        from_landmark.extend(UNREACHABLE if t == inf else int(t) for t in times_from)
+
+        for v in range(n):
+            closest[v] = min(closest[v], times_to[v] + times_from[v])
+        # stops not connected both ways to every landmark are only chosen once all others are
+        landmark = max((v for v in range(n) if v not in landmarks),
+                       key=lambda v: (closest[v] < inf, closest[v]), default=None)
+        if landmark is None:
+            break
+
+    logger.info('Built landmark tables for %d landmarks', len(landmarks))
+    return LandmarkTable(graph, [landmarks, to_landmark, from_landmark])
+
+
+def get_shared_lower_bound_graphs() \
+        -> tuple[list[list[tuple[int, float]]], list[list[tuple[int, float]]]]:
+    """Return the lower_bound_graphs of the shared graph, computing them once per process
+    (and again if the database changes).
+    """
+    graph = get_shared_graph()
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    cached = _SHARED_LOWER_BOUNDS.get(fingerprint)
+    if cached is None or cached[0] is not graph:
+        _SHARED_LOWER_BOUNDS.clear()
+        _SHARED_LOWER_BOUNDS[fingerprint] = (graph, lower_bound_graphs(graph))
+
+    return _SHARED_LOWER_BOUNDS[fingerprint][1]
+
+
+def lower_bound_graphs(graph: CSRGraph) \
+        -> tuple[list[list[tuple[int, float]]], list[list[tuple[int, float]]]]:
+    """Return the adjacency lists of the lower-bound graph of graph and of its reverse.
+
+    The lower-bound graph has an edge for every edge of graph, taking the shortest time any
+    vehicle is scheduled to travel it, and an edge for every walking footpath, taking its walking
+    time. The adjacency list of a stop is a list of (neighbour index, time) pairs.
+    """
+    with data_interface.get_pool(DB_FILE).connection() as query:
+        min_times = {(graph.index_of(stop_id1), graph.index_of(stop_id2)): time
+                     for stop_id1, stop_id2, time in query.get_min_travel_times()}
+
+    forward = [[(j, min_times.get((i, j), 0)) for j in graph.neighbour_indices(i)]
+               for i in range(len(graph))]
+    backward = [[(j, min_times.get((j, i), 0)) for j in graph.predecessor_indices(i)]
+                for i in range(len(graph))]
+
+    foot_offsets, foot_targets, foot_times = compute_footpaths(graph)
+    for i in range(len(graph)):
+        for j in range(foot_offsets[i], foot_offsets[i + 1]):
+            forward[i].append((foot_targets[j], foot_times[j]))
+            backward[foot_targets[j]].append((i, foot_times[j]))
+
+    return (forward, backward)
+
+
+def _dijkstra(adjacency: list[list[tuple[int, float]]], source: int) -> list[float]:
+    """Return the shortest time from source to every stop in the graph with the given adjacency
+    lists, or inf for stops that cannot be reached.
+    """
+    times = [inf] * len(adjacency)
+    times[source] = 0
+    heap = [(0, source)]
+    while heap:
+        time, v = heapq.heappop(heap)
+        if time > times[v]:
+            continue
+        for w, edge_time in adjacency[v]:
+            if time + edge_time < times[w]:
+                times[w] = time + edge_time
+                heapq.heappush(heap, (time + edge_time, w))
+    return times
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['heapq', 'logging', 'array', 'math', 'typing', 'data_interface',
+                          'snapshot', 'graph', 'timetable', 'util'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -8,15 +8,15 @@ This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
 
 import logging
 import queue
-from multiprocessing import Manager, Process
+from multiprocessing import Manager
 from typing import Union
 
 import pygame
 
-import pathfinding
 from image import Image, load_images
 from path import Path
 from pygui import draw_dec, draw_inc, PygButton, PygDropdown, PygLabel, PygPageLabel, Rect
+from routing_service import RoutingService
 from waypoint import Waypoint
 
 ALLOWED = [pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP,
@@ -25,6 +25,11 @@ DAYS_TEXT = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday',
 DAY_TO_INT = {'Monday': 1, 'Tuesday': 2, 'Wednesday': 3, 'Thursday': 4,
               'Friday': 5, 'Saturday': 6, 'Sunday': 7}
 
+# heuristic weight and time budget (in seconds) of the anytime route search, which draws a good
+# route quickly and refines it until it is optimal or the time budget runs out
+ROUTE_EPSILON = 1.5
+ROUTE_TIME_BUDGET = 10.0
+
 
 def initialize_screen(allowed: list, width: int, height: int) -> pygame.Surface:
     """Initialize a pygame screen."""
@@ -189,9 +194,12 @@ def run_map(filename: str = "data/image_data/images_data.csv") -> None:
     # create path
     path = Path()
 
-    # create objects for multiprocessing
+    # create objects for multiprocessing. The routing workers load the graph once, now, so
+    # that routes are computed without starting a process or loading the graph per request.
     manager = Manager()
     result_queue = manager.Queue()
+    service = RoutingService()
+    request = None
 
     logger = logging.getLogger(__name__)
 
@@ -248,6 +256,14 @@ def run_map(filename: str = "data/image_data/images_data.csv") -> None:
                 # setup route find progress bar
                 total_prog = message[1]
                 logger.info('Setup progress bar with total steps %d' % total_prog)
+            elif message[0] == 'INC' and len(message) == 3:
+                # draw the best route found so far while the search refines it
+                logger.info('Displaying route within a factor %.3f of optimal' % message[2])
+                path.get_shapes(waypoints[0].get_lat_lon(), waypoints[1].get_lat_lon(),
+                                message[1])
+                path.set_visible(True)
+                routes = PygPageLabel(20, 200, 160, 250, path.routes_to_text(),
+                                      font=font, background_color=(255, 255, 255), visible=True)
             elif message[0] == 'INC':
                 # increase progress bar
                 curr_prog += 1
@@ -264,6 +280,7 @@ def run_map(filename: str = "data/image_data/images_data.csv") -> None:
                 (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
             # Exit the event loop
             logger.info('QUITTING')
+            service.close()
             pygame.quit()
             return
 
@@ -291,27 +308,34 @@ def run_map(filename: str = "data/image_data/images_data.csv") -> None:
                 tile = load_zoom_image(images, zoom)
             clicked = True
 
-        if not calculating:
-            if settings_b[0].on_click(event) and len(waypoints) == 2:  # Get Routes
-                time = int(settings_l[4].text) * 3600 + int(settings_l[5].text) * 60 + int(
-                    settings_l[6].text)
-
-                route_find_process = Process(target=pathfinding.find_route,
-                                             args=(waypoints[0].get_lat_lon(),
-                                                   waypoints[1].get_lat_lon(),
-                                                   time,
-                                                   DAY_TO_INT[settings_dd.selected],
-                                                   result_queue))
-
-                progress_bar.set_visible(True)
-                calculating = True
-                route_find_process.start()
-
-            elif settings_b[1].on_click(event):  # Reset
-                waypoints = []
-                path.set_visible(False)
-                routes.set_visible(False)
-            elif settings_b[2].on_click(event):  # hour inc
+        if settings_b[0].on_click(event) and len(waypoints) == 2:  # Get Routes
+            time = int(settings_l[4].text) * 3600 + int(settings_l[5].text) * 60 + int(
+                settings_l[6].text)
+
+            # the new request supersedes the route being calculated, if any, and the messages
+            # of the superseded request are left behind in its queue
+            result_queue = manager.Queue()
+            request = service.submit(waypoints[0].get_lat_lon(), waypoints[1].get_lat_lon(),
+                                     time, DAY_TO_INT[settings_dd.selected], result_queue,
+                                     epsilon=ROUTE_EPSILON, time_budget=ROUTE_TIME_BUDGET)
+
+            progress_bar.set_visible(True)
+            progress_bar.set_text('0%')
+            curr_prog = 0
+            calculating = True
+
+        elif settings_b[1].on_click(event):  # Reset
+            if calculating:  # stop calculating the route between the old waypoints
+                request.cancel()
+                progress_bar.set_visible(False)
+                progress_bar.set_text('0%')
+                curr_prog = 0
+                calculating = False
+            waypoints = []
+            path.set_visible(False)
+            routes.set_visible(False)
+        elif not calculating:
+            if settings_b[2].on_click(event):  # hour inc
                 time_nums[0] = (time_nums[0] + 1) % 24
                 settings_l[4].set_text(str(time_nums[0]))  # refresh time label
             elif settings_b[3].on_click(event):  # hour dec
@@ -384,8 +408,8 @@ if __name__ == "__main__":
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['pygame', 'pathfinding', 'image', 'pygui', 'waypoint', 'path', 'graph',
-                          'logging', 'queue', 'multiprocessing'],
+        'extra-imports': ['pygame', 'routing_service', 'image', 'pygui', 'waypoint', 'path',
+                          'graph', 'logging', 'queue', 'multiprocessing'],
         'allowed-io': [],
         'max-line-length': 100,
         'max-nested-blocks': 4,
@@ -0,0 +1,210 @@
+"""TTC Route Planner for Toronto, Ontario -- Origin-Destination Matrices
+
+This module provides the functions for computing origin-destination (OD) travel time matrices:
+the earliest arrival from every origin stop to every destination stop, for one departure time.
+
+Each row of the matrix is computed by a single ``pathfinding.one_to_all`` search from its origin,
+and the rows are spread over a pool of worker processes in chunks. Rows are written, as they
+arrive, into a matrix file that is memory-mapped for writing, so the matrix never has to fit in
+memory. The file has a flag for each row, set once the row is written, and the file is flushed to
+disk every CHECKPOINT_INTERVAL rows. An interrupted computation run again with the same
+arguments only computes the rows not yet flagged.
+
+A matrix file contains:
+    - a header with a magic number, the format version, a key identifying the origins,
+      destinations, departure time, horizon and database the matrix is computed for (a matrix
+      file computed for anything else is started over), and the number of rows and columns
+    - a flag byte for each row, set once the row is complete
+    - the matrix of travel times in seconds, as native doubles in row-major order, starting at an
+      8 byte boundary, with inf for pairs not connected within the horizon
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from array import array
+from math import inf
+from multiprocessing import Pool
+from typing import Optional
+
+import data_interface
+from graph import DB_FILE, get_shared_graph
+from pathfinding import one_to_all
+
+# magic number, format version, key, number of rows, number of columns
+_HEADER = struct.Struct('<4sI20sQQ')
+_MAGIC = b'TTOD'
+MATRIX_VERSION = 1
+
+# default number of origins sent to a worker process at once
+DEFAULT_CHUNK_SIZE = 4
+
+# number of rows written between flushes of the matrix file
+CHECKPOINT_INTERVAL = 64
+
+# the arguments of the rows computed by the worker processes of compute_od_matrix: the
+# destinations' stop indices, the departure time and day, and the horizon
+_WORKER_ARGS = {}
+
+
+def compute_od_matrix(path: str, origins: list[int], destinations: list[int], time: int,
+                      day: int, horizon: float = inf, processes: Optional[int] = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """Compute the travel time from every origin stop to every destination stop, departing at
+    the given time and day, and write the matrix to the matrix file at path.
+
+    origins and destinations are lists of stop_ids. Row i of the matrix holds the travel times,
+    in seconds, from origins[i] to each destination, or inf if it is not reached within horizon
+    seconds. Rows are computed by processes worker processes (by default, one per CPU), which are
+    sent chunk_size origins at a time.
+
+    If path holds a matrix file for the same arguments and database, only its incomplete rows
+    are computed. Any other file at path is replaced.
+
+    Preconditions:
+        - 0 <= time < 86400
+        - 1 <= day <= 7
+        - processes is None or processes >= 1
+        - chunk_size >= 1
+    """
+    logger = logging.getLogger(__name__)
+    key = _matrix_key(origins, destinations, time, day, horizon)
+    rows, cols = len(origins), len(destinations)
+    buffer = _open_matrix(path, key, rows, cols)
+    flags, matrix = _matrix_views(buffer, rows, cols)
+
+    todo = [(i, origins[i]) for i in range(rows) if not flags[i]]
+    logger.info('Computing %d of %d rows of OD matrix "%s"', len(todo), rows, path)
+
+    graph = get_shared_graph()
+    dest_indices = [graph.index_of(stop_id) for stop_id in destinations]
+    try:
+        with Pool(processes, initializer=_init_worker,
+                  initargs=(dest_indices, time, day, horizon)) as pool:
+            for count, (i, row) in enumerate(pool.imap_unordered(_compute_row, todo,
+                                                                 chunksize=chunk_size), 1):
+                matrix[i * cols:(i + 1) * cols] = row
+                flags[i] = 1
+                if count % CHECKPOINT_INTERVAL == 0:
+                    buffer.flush()
+                    logger.info('Computed %d of %d rows', count, len(todo))
+    finally:
+        flags.release()
+        matrix.release()
+        buffer.flush()
+        buffer.close()
+
+
+def read_od_matrix(path: str) -> memoryview:
+    """Return a read-only two-dimensional memoryview of the complete matrix in the matrix file
+    at path, indexed by [origin, destination].
+
+    Raises ValueError if path is not a matrix file, or if the matrix is incomplete.
+    """
+    with open(path, mode='rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) < _HEADER.size:
+        raise ValueError(f'"{path}" is not an OD matrix file.')
+    magic, version, _, rows, cols = _HEADER.unpack_from(buffer)
+    if (magic, version) != (_MAGIC, MATRIX_VERSION) or len(buffer) != _file_size(rows, cols):
+        raise ValueError(f'"{path}" is not an OD matrix file.')
+
+    flags, matrix = _matrix_views(buffer, rows, cols)
+    if not all(flags):
+        raise ValueError(f'OD matrix "{path}" is incomplete.')
+    return matrix.cast('B').cast('d', (rows, cols))
+
+
+def _matrix_key(origins: list[int], destinations: list[int], time: int, day: int,
+                horizon: float) -> bytes:
+    """Return the 20 byte key of the matrix for the given arguments and the current database."""
+    digest = hashlib.sha1(data_interface.database_fingerprint(DB_FILE))
+    digest.update(repr((origins, destinations, time, day, horizon)).encode())
+    return digest.digest()
+
+
+def _file_size(rows: int, cols: int) -> int:
+    """Return the size, in bytes, of a matrix file with the given number of rows and columns."""
+    return _matrix_offset(rows) + rows * cols * array('d').itemsize
+
+
+def _matrix_offset(rows: int) -> int:
+    """Return the offset of the matrix in a matrix file with the given number of rows, which is
+    the first 8 byte boundary after the row flags.
+
+    >>> _matrix_offset(0), _matrix_offset(4), _matrix_offset(5)
+    (48, 48, 56)
+    """
+    return -(-(_HEADER.size + rows) // 8) * 8
+
+
+def _open_matrix(path: str, key: bytes, rows: int, cols: int) -> mmap.mmap:
+    """Return a writable memory map of the matrix file at path for the given key and size,
+    creating a new file with no complete rows unless path already holds one.
+    """
+    try:
+        with open(path, mode='r+b') as f:
+            header = f.read(_HEADER.size)
+            if len(header) == _HEADER.size \
+                    and _HEADER.unpack(header) == (_MAGIC, MATRIX_VERSION, key, rows, cols) \
+                    and os.fstat(f.fileno()).st_size == _file_size(rows, cols):
+                logging.getLogger(__name__).info('Resuming OD matrix "%s"', path)
+                return mmap.mmap(f.fileno(), 0)
+    except FileNotFoundError:
+        pass
+
+    with open(path, mode='w+b') as f:
+        f.truncate(_file_size(rows, cols))
+        buffer = mmap.mmap(f.fileno(), 0)
+    _HEADER.pack_into(buffer, 0, _MAGIC, MATRIX_VERSION, key, rows, cols)
+    return buffer
+
+
+def _matrix_views(buffer: mmap.mmap, rows: int, cols: int) -> tuple[memoryview, memoryview]:
+    """Return memoryviews of the row flags and of the matrix (as a flat array of doubles) in
+    the matrix file mapped by buffer.
+    """
+    view = memoryview(buffer)
+    offset = _matrix_offset(rows)
+    flags = view[_HEADER.size:_HEADER.size + rows]
+    matrix = view[offset:offset + rows * cols * array('d').itemsize].cast('d')
+    view.release()
+    return (flags, matrix)
+
+
+def _init_worker(dest_indices: list[int], time: int, day: int, horizon: float) -> None:
+    """Keep the arguments of the rows computed by this worker process, and load the graph."""
+    _WORKER_ARGS['args'] = (dest_indices, time, day, horizon)
+    get_shared_graph()
+    data_interface.get_pool().local()
+
+
+def _compute_row(task: tuple[int, int]) -> tuple[int, array]:
+    """Return the row number and the row of travel times of the task (row number, origin
+    stop_id), in a worker process of compute_od_matrix.
+    """
+    i, origin = task
+    dest_indices, time, day, horizon = _WORKER_ARGS['args']
+    arrivals = one_to_all([(origin, 0)], time, day, horizon)
+    return (i, array('d', (arrivals[j] for j in dest_indices)))
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['hashlib', 'logging', 'mmap', 'os', 'struct', 'array', 'math',
+                          'multiprocessing', 'typing', 'data_interface', 'graph',
+                          'pathfinding'],
+        'allowed-io': ['read_od_matrix', '_open_matrix'],
+        'max-line-length': 100,
+        'disable': ['E1136']})
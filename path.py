@@ -8,7 +8,7 @@ This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
 
 from typing import Union
 import pygame
-from data_interface import TransitQuery
+from data_interface import get_pool
 from image import Image
 
 
@@ -82,8 +82,8 @@ class Path:
         if stops != []:
             shapes = []
 
-            # Create TransitQuery
-            query = TransitQuery()
+            # Use the calling thread's pooled TransitQuery
+            query = get_pool().local()
 
             # Add path in order (originally given in reverse)
             for j in range(len(stops) - 1, -1, -1):
@@ -107,9 +107,6 @@ class Path:
                     for lat_lon in shapes[i]['shape']:
                         self.shapes[-1][1].append(lat_lon)
 
-            # Close TransitQuery
-            query.close()
-
         # Add destination
         if self.shapes[-1][0] != -1:
             self.shapes.append((-1, [self.shapes[-1][1][-1], end]))
@@ -127,8 +124,8 @@ class Path:
             stops = {}
             route_types = {0: 'Tram', 1: 'Subway', 3: 'Bus'}
 
-            # Open TransitQuery
-            query = TransitQuery()
+            # Use the calling thread's pooled TransitQuery
+            query = get_pool().local()
 
             # Add walking to first stop info
             if self.routes[0]['start'] not in stops:
@@ -2,25 +2,140 @@
 
 This module provides the functions for computing an optimal path through TTC transit using the
 A* pathfinding algorithm. The returned path can either include every stop on the route, or only
-the start and end stops of distinct routes.
+the start and end stops of distinct routes. The costs and heuristics A* can search with are
+provided by the ``heuristic`` module.
+
+A* can also run bidirectionally: a backward search from the destination over the lower-bound
+graph of ``landmarks.lower_bound_graphs`` runs alongside the forward search and prunes the stops
+the forward search cannot reach the destination through in time. Or it can run as an anytime
+search, weighting its heuristic to find a good path quickly and then improving it for as long
+as it is given (see ``a_star``).
+
+``find_route`` can also compute routes with the timetable-based engines listed in ENGINES:
+    - 'a_star': A* search over the transit graph (see ``a_star``)
+    - 'bidirectional': bidirectional A* search over the transit graph (see ``a_star``)
+    - 'raptor': RAPTOR over the week's timetable (see the ``raptor`` module)
+    - 'csa': Connection Scan Algorithm over the week's timetable (see the ``csa`` module)
+    - 'trip_based': trip-based routing over precomputed transfers (see the ``trip_based`` module)
+    - 'hub_labels': lookups of transfer patterns between subway hubs, precomputed offline, which
+      may return a later arrival than the other engines (see the ``hub_labels`` module)
+
+A search can be stopped early with a CancelToken, which the caller cancels, or which expires at
+a deadline. Searches check their token as they run and raise SearchCancelled or TimeoutError.
+
+``find_profile`` answers range queries: every optimal route for departures across a time window,
+computed in one run of the ``profile_csa`` module. ``isochrone`` and ``one_to_all`` find the
+earliest arrival at every stop within a time horizon, in a single one-to-all search.
 
 This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
 """
 
-from collections import defaultdict
+from array import array
 from math import inf
-from multiprocessing import Pool
-from queue import PriorityQueue, Queue
-from typing import Optional, Union
+from heapq import heapify, heappop, heappush
+from queue import Queue
+from typing import Any, Optional, Union
 import logging
+from multiprocessing import Pool, Value
+import threading
+from time import perf_counter, time as wall_clock
 
-from data_interface import TransitQuery
-from graph import _Vertex, load_graph
+from csa import csa
+from data_interface import TransitQuery, get_pool
+from graph import CSRGraph, get_shared_graph
+from heuristic import CostModel, TravelTimeCost, get_default_cost_model
+from hub_labels import hub_route
+from landmarks import get_shared_lower_bound_graphs
+from profile_csa import profile_csa
+from raptor import raptor
+from route_cache import get_shared_route_cache
+from search_state import SearchState, get_search_state
+from timetable import DAY, WALK_RADIUS, WALK_SPEED, WEEK, get_shared_timetable
+from trip_based import trip_based
 from util import distance
 
+# routing engines supported by find_route
+ENGINES = ('a_star', 'bidirectional', 'raptor', 'csa', 'trip_based', 'hub_labels')
+
+# search functions of the timetable-based engines, which all take the same arguments
+_TIMETABLE_ENGINES = {'raptor': raptor, 'csa': csa, 'trip_based': trip_based,
+                      'hub_labels': hub_route}
+
+# number of nodes a_star pops between checks of its CancelToken
+CANCEL_CHECK_INTERVAL = 16
+
+# the bound shared by the searches of parallel_a_star, set in each of its worker processes
+_PARALLEL_BOUND = {}
+
+# the IncrementalSearch continued by find_route in each thread
+_THREAD_SEARCHES = threading.local()
+
+# tolerance, in seconds, of the bidirectional search's pruning, so that paths that tie with the
+# best one found but sum their walking times in a different order are not pruned
+_PRUNE_TOLERANCE = 1e-6
+
+
+class SearchCancelled(Exception):
+    """Raised by a route search whose CancelToken was cancelled."""
+
+
+class CancelToken:
+    """A request to stop a route search, shared between the caller and the search.
+
+    A search given a CancelToken checks it as it runs, and stops once the token is cancelled or
+    its deadline has passed. The token's flag is an event-like object with ``set`` and
+    ``is_set`` methods: a ``threading.Event`` for a search in the same process, or an event from
+    a ``multiprocessing.Manager`` for a search in another process.
+
+    Instance Attributes:
+        - deadline: the time after which the search stops, in seconds since the epoch (as
+          returned by ``time.time``), or None for no deadline
+    """
+    # Private Instance Attributes:
+    #   - _flag: the event set when the search is cancelled
+    deadline: Optional[float]
+    _flag: Any
+
+    def __init__(self, deadline: Optional[float] = None, flag: Optional[Any] = None) -> None:
+        """Initialize a token with the given deadline, cancelled by setting flag. If flag is
+        None, a new ``threading.Event`` is used.
+        """
+        self.deadline = deadline
+        self._flag = threading.Event() if flag is None else flag
+
+    def cancel(self) -> None:
+        """Cancel the search using this token."""
+        self._flag.set()
+
+    def is_cancelled(self) -> bool:
+        """Return whether this token was cancelled.
+
+        >>> token = CancelToken()
+        >>> token.cancel()
+        >>> token.is_cancelled()
+        True
+        """
+        return self._flag.is_set()
+
+    def is_expired(self) -> bool:
+        """Return whether the deadline of this token has passed."""
+        return self.deadline is not None and wall_clock() >= self.deadline
+
+    def check(self) -> None:
+        """Raise SearchCancelled if this token was cancelled, or TimeoutError if its deadline
+        has passed.
+        """
+        if self.is_cancelled():
+            raise SearchCancelled('Route search was cancelled.')
+        if self.is_expired():
+            raise TimeoutError('Route search passed its deadline.')
+
 
 def find_route(start_loc: tuple[float, float], end_loc: tuple[float, float], time: int,
-               day: int, message_queue: Queue) -> list[tuple[int, int, int]]:
+               day: int, message_queue: Queue, engine: str = 'a_star', epsilon: float = 1.0,
+               time_budget: Optional[float] = None, cancel: Optional[CancelToken] = None,
+               processes: int = 1, cache: bool = False,
+               incremental: bool = False) -> list[tuple[int, int, int]]:
     """Given a start location, end location, and time block, compute the quickest transit route.
     Returns a list of tuples (trip_id, start stop_id, end stop_id).
     Note that the list is in reverse order of the actual route, i.e. element 0 of the returned list
@@ -29,151 +144,981 @@ def find_route(start_loc: tuple[float, float], end_loc: tuple[float, float], tim
     Coordinates are given as (latitude, longitude), in degrees north and degrees east.
     Time is given in the number of seconds from the most recent midnight.
     Day is given as integers [1, 7], where 1 is Monday and 7 is Sunday.
+
+    engine is the name of the routing engine used, one of ENGINES. With the 'a_star' engine,
+    an epsilon greater than 1 runs an anytime search with the given time budget, which puts
+    each improved path on message_queue before the final one (see ``a_star``). Timetable-based
+    engines ignore epsilon and time_budget.
+
+    If cancel is not None, the search stops once it is cancelled or its deadline passes (see
+    ``a_star``). Timetable-based engines only check it before they start.
+
+    If processes is greater than 1 and engine is 'a_star' with an epsilon of 1, the start stops
+    are split between that many processes searching in parallel (see ``parallel_a_star``). Other
+    engines ignore processes.
+
+    If incremental is True and engine is 'a_star' with an epsilon of 1, the last search in this
+    thread is continued if it searched from the same start stops, walking distances and day, at
+    the same time or earlier (see IncrementalSearch). Otherwise, a new IncrementalSearch is kept
+    for the next request.
+
+    If cache is True, the route is looked up in this process's shared route cache (see
+    ``route_cache.get_shared_route_cache``) before searching, under the engine, the start and
+    end stops and the walking distances to them. The route found is added to it, unless the
+    search was an anytime search or used the 'hub_labels' engine, which may not find the
+    optimal route.
+
+    Raises ValueError if engine is not a supported routing engine, SearchCancelled if cancel was
+    cancelled, and TimeoutError if the deadline of cancel passed. Raises FileNotFoundError if
+    engine is 'hub_labels' and its transfer patterns were not precomputed (see
+    ``hub_labels.precompute_hub_labels``).
     """
-    query = TransitQuery()
-    graph = load_graph()
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown routing engine {engine}.')
+    if cancel is not None:
+        cancel.check()
 
-    start_id = query.get_closest_stops(start_loc[0], start_loc[1])
-    end_id = query.get_closest_stops(end_loc[0], end_loc[1])
+    graph = get_shared_graph()
 
     if distance(start_loc, end_loc) <= 1.5:  # check for close/walking dist
         message_queue.put(('DONE', []))
         return []
 
-    start_stop_coords = graph.get_vertex(start_id[0]).location
-    end_stop_coords = graph.get_vertex(end_id[0]).location
-
-    start_ids = query.get_closest_stops(start_stop_coords[0], start_stop_coords[1], 0.1)
-    end_ids = query.get_closest_stops(end_stop_coords[0], end_stop_coords[1], 0.1)
+    start_ids = _stops_near(start_loc)
+    end_ids = _stops_near(end_loc)
+    # the start and end stops, with the walks from the start location and to the end location
+    starts = [(stop_id, distance(start_loc, graph.get_vertex(stop_id).location))
+              for stop_id in start_ids]
+    goals = [(stop_id, distance(graph.get_vertex(stop_id).location, end_loc))
+             for stop_id in end_ids]
 
-    message_queue.put(('INFO', len(start_ids) * len(end_ids)))
+    if cache:
+        path = get_shared_route_cache().lookup(starts, goals, time, day, engine)
+        if path is not None:
+            message_queue.put(('INFO', 1))
+            message_queue.put(('INC',))
+            message_queue.put(('DONE', path[0]))
+            return path[0]
 
-    with Pool(maxtasksperchild=1) as p:
-        paths = p.starmap(a_star, ((id1, id2, time, day, message_queue)
-                                   for id1 in start_ids for id2 in end_ids))
+    if engine in ('a_star', 'bidirectional'):
+        # a search from every start stop to every end stop, including the walks
+        if engine == 'a_star' and epsilon == 1 and incremental:
+            message_queue.put(('INFO', 1))
+            path = _incremental_route(starts, goals, time, day, cancel)
+            message_queue.put(('INC',))
+        elif engine == 'a_star' and epsilon == 1 and processes > 1 and len(starts) > 1:
+            message_queue.put(('INFO', min(processes, len(starts))))
+            path = parallel_a_star(starts, goals, time, day, message_queue, processes,
+                                   cancel=cancel)
+        else:
+            message_queue.put(('INFO', 1))
+            path = a_star(starts, goals, time, day, message_queue,
+                          bidirectional=engine == 'bidirectional', epsilon=epsilon,
+                          time_budget=time_budget, cancel=cancel)
+    else:
+        message_queue.put(('INFO', 1))
+        if cancel is not None:
+            cancel.check()
+        path = timetable_route(engine, starts, goals, time, day)
+        message_queue.put(('INC',))
 
-    path = min(paths, key=lambda x: x[1])
+    if cache and engine != 'hub_labels' and (engine not in ('a_star', 'bidirectional')
+                                             or epsilon == 1):
+        get_shared_route_cache().store(starts, goals, time, day, engine, *path)
     message_queue.put(('DONE', path[0]))  # tell parent process pathfinding complete
     return path[0]
 
 
-def a_star(id1: int, id2: int, time: int, day: int, message_queue: Queue) \
-        -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
-    """A* algorithm for graph pathfinding.
+def _incremental_route(starts: list[tuple[int, float]], goals: list[tuple[int, float]],
+                       time: int, day: int, cancel: Optional[CancelToken] = None) \
+        -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+    """Return the route found by continuing this thread's IncrementalSearch, or a new one if it
+    cannot be continued, in the format of a_star. cancel is passed to IncrementalSearch.route.
+    """
+    search = getattr(_THREAD_SEARCHES, 'search', None)
+    if search is None or search.graph is not get_shared_graph() or search.starts != starts \
+            or search.day != day or search.time > time:
+        search = IncrementalSearch(starts, goals, time, day)
+        _THREAD_SEARCHES.search = search
+    else:
+        search.set_time(time)
+        if search.goals != goals:
+            search.set_goals(goals)
+    return search.route(cancel)
+
+
+def find_profile(start_loc: tuple[float, float], end_loc: tuple[float, float], earliest: int,
+                 latest: int, day: int, message_queue: Queue) \
+        -> list[tuple[Union[int, float], Union[int, float], list[tuple[int, int, int]]]]:
+    """Given a start location, end location, and a window of departure times, compute every
+    route that is the quickest for some departure time in the window.
+
+    Returns a list of tuples (departure time, travel time, path) in increasing order of departure
+    time, where each path is in the format returned by find_route. Departure times are given in
+    seconds from midnight of the given day, when leaving the start location, and travel times
+    include the walks from the start location and to the end location, as for find_route. The
+    last route may depart after latest, if it is the quickest route for departing at latest. For
+    a start and end location within walking distance, the list is empty.
+
+    Locations and the day are given as for find_route, and earliest and latest in the number of
+    seconds from midnight of the given day.
+
+    Preconditions:
+        - 0 <= earliest < DAY
+        - earliest <= latest < earliest + DAY
+        - 1 <= day <= 7
+    """
+    if distance(start_loc, end_loc) <= 1.5:  # check for close/walking dist
+        message_queue.put(('DONE', []))
+        return []
+
+    message_queue.put(('INFO', 1))
+    timetable = get_shared_timetable()
+    # week time of midnight of day, moved back a week if the window ends after the week does
+    midnight = (day - 1) * DAY
+    if midnight + latest >= WEEK:
+        midnight -= WEEK
+
+    # the start and end stops, with the walks from the start location and to the end location,
+    # as in find_route
+    graph = timetable.graph
+    sources = [(graph.index_of(stop_id),
+                distance(start_loc, graph.get_vertex(stop_id).location) / WALK_SPEED)
+               for stop_id in _stops_near(start_loc)]
+    targets = [(graph.index_of(stop_id),
+                distance(graph.get_vertex(stop_id).location, end_loc) / WALK_SPEED)
+               for stop_id in _stops_near(end_loc)]
+    journeys = profile_csa(timetable, sources, targets, midnight + earliest, midnight + latest)
+    profile = [(departure - midnight, arrival - departure, path)
+               for departure, arrival, path in journeys]
+    message_queue.put(('INC',))
+
+    message_queue.put(('DONE', profile))
+    return profile
+
+
+def isochrone(start_loc: tuple[float, float], time: int, day: int,
+              horizon: float = inf) -> array:
+    """Return the earliest arrival at every stop from the start location, departing at the
+    given time and day, in seconds after the departure time.
+
+    The result is an array indexed by the stops' indices in the shared graph (see
+    ``graph.CSRGraph.index_of``), holding inf for the stops not reached within horizon seconds.
+    Start stops are found and walked to as in find_route.
+
+    Preconditions:
+        - 0 <= time < DAY
+        - 1 <= day <= 7
+    """
+    graph = get_shared_graph()
+    starts = [(stop_id, distance(start_loc, graph.get_vertex(stop_id).location))
+              for stop_id in _stops_near(start_loc)]
+    return one_to_all(starts, time, day, horizon)
+
+
+def _stops_near(location: tuple[float, float]) -> list[int]:
+    """Return the stop_ids of the stops routes to or from location are searched from: the stop
+    closest to location, and the stops within 100 m of it.
+    """
+    query = get_pool().local()
+    graph = get_shared_graph()
+
+    closest_id = query.get_closest_stops(location[0], location[1])
+    stop_coords = graph.get_vertex(closest_id[0]).location
+    return query.get_closest_stops(stop_coords[0], stop_coords[1], 0.1)
+
+
+def timetable_route(engine: str, starts: list[tuple[int, float]], goals: list[tuple[int, float]],
+                    time: int, day: int) -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+    """Compute the quickest route from any of the start stops to any of the goal stops with the
+    given timetable-based engine, leaving at the given time and day.
+
+    starts and goals are lists of (stop_id, walking distance) pairs, as for ``a_star``: each
+    start stop is reached by walking from the start location after departing, and each goal
+    stop is left by walking to the destination.
+
+    Returns a tuple of the path and the time the path takes, in seconds, including the walks,
+    in the same format as ``a_star``.
+
+    Preconditions:
+        - engine in ENGINES and engine not in ('a_star', 'bidirectional')
+        - 1 <= day <= 7
+    """
+    timetable = get_shared_timetable()
+    departure = (day - 1) * DAY + time
+
+    sources = [(timetable.graph.index_of(stop_id), departure + dist / WALK_SPEED)
+               for stop_id, dist in starts]
+    targets = [(timetable.graph.index_of(stop_id), dist / WALK_SPEED) for stop_id, dist in goals]
+    journey = _TIMETABLE_ENGINES[engine](timetable, sources, targets)
+
+    if journey is None:
+        return ([(0, 0, 0)], inf)
+    # the arrival of the journey includes the walk from the goal stop
+    return (journey[0], journey[1] - departure)
 
-    The inputs to this function are given as stop_ids.
 
-    Returns a tuple of the path and the time the path takes, in seconds.
+def a_star(starts: list[tuple[int, float]], goals: list[tuple[int, float]], time: int, day: int,
+           message_queue: Queue, cost: Optional[CostModel] = None, bidirectional: bool = False,
+           epsilon: float = 1.0, time_budget: Optional[float] = None,
+           cancel: Optional[CancelToken] = None, shared_bound: Optional[Any] = None) \
+        -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+    """A* algorithm for graph pathfinding, from any of the start stops to any of the goal stops.
+
+    starts is a list of (stop_id, walking distance) pairs, where the walking distance (in km) is
+    the distance walked to reach the start stop before departing at the given time and day.
+    goals is likewise a list of (stop_id, walking distance) pairs, giving the distance walked
+    from each goal stop to the destination. Every start stop is searched from at once, and the
+    search ends when the destination is reached through any of the goal stops.
+
+    cost is the cost model the path found minimizes, together with its heuristic. If cost is
+    None, the default cost model (``heuristic.get_default_cost_model``) is used, which finds the
+    path with the earliest arrival.
+
+    If bidirectional is True, a backward search from the destination runs alongside, one step
+    per stop the forward search pops. The backward search finds the lower-bound travel time lb(n)
+    from each stop n to the destination, in the graph where every edge takes its shortest
+    scheduled time. When the forward search settles a stop the backward search has settled, the
+    actual time of following the backward search's path from there is an upper bound mu on the
+    optimal travel time. A stop n with g_score + lb(n) > mu cannot be on an optimal path, so the
+    forward search skips it without querying its edges. Once every stop left in the backward
+    search has lb(n) > mu, the backward search stops, and the forward search skips every stop the
+    backward search never settled. The path found is the same as without the backward search.
+
+    If epsilon is greater than 1, the search is an anytime weighted A* search: the heuristic is
+    multiplied by epsilon, so the search heads for the destination more greedily, and stops may
+    be expanded again when a cheaper path to them is found. The search does not end when it
+    first reaches the destination. Instead, each path it finds is kept as the best path so far,
+    and put on message_queue as ('INC', path, bound), where bound is a proven upper bound on
+    the ratio of the path's cost to the optimal cost. Stops whose unweighted f_score is no less
+    than the best path's cost are skipped. The search ends when the best path is proven optimal,
+    or once time_budget seconds have passed since it started, if time_budget is not None. The
+    search runs past time_budget until it finds its first path.
+
+    If cancel is not None, it is checked every CANCEL_CHECK_INTERVAL nodes popped, and the
+    search raises SearchCancelled once it is cancelled. Once its deadline passes, an anytime
+    search that has found a path returns its best path, and any other search raises
+    TimeoutError.
+
+    shared_bound is an optional ``multiprocessing.Value('d')`` shared with other searches for
+    the same destination and cost model running at the same time, such as those started by
+    parallel_a_star. It holds the least cost of any path to the destination found by them so far.
+    The search lowers it as soon as it reaches the destination through a cheaper path, and skips
+    every stop whose unweighted f_score is no less than it, so once a search is beaten by
+    another, it empties its open set without querying any more edges and returns no path.
+
+    Returns a tuple of the path and the time the path takes, in seconds, including the walks to
+    the first stop and from the last stop.
+
+    Raises ValueError if bidirectional is True and cost does not measure travel time, or if
+    bidirectional is True and epsilon is not 1. Raises SearchCancelled or TimeoutError as
+    described above.
+
+    Preconditions:
+        - epsilon >= 1
+        - time_budget is None or time_budget >= 0
     """
     logger = logging.getLogger(__name__)
-    logger.info("Finding path from %d -> %d" % (id1, id2))
+    logger.info('Finding path from %s -> %s', [s[0] for s in starts], [g[0] for g in goals])
 
-    query = TransitQuery()
-    graph = load_graph()
-    logger.debug("Graph loaded for %d -> %d" % (id1, id2))
+    query = get_pool().local()
+    graph = get_shared_graph()
 
-    start = graph.get_vertex(id1)
-    goal = graph.get_vertex(id2)
+    if cost is None:
+        cost = get_default_cost_model()
+    if bidirectional and not isinstance(cost, TravelTimeCost):
+        raise ValueError('Bidirectional search needs a travel time cost model.')
+    if bidirectional and epsilon != 1:
+        raise ValueError('Bidirectional search cannot be weighted.')
+    # whether the search is anytime, and may expand stops again
+    reopen = epsilon > 1
+    deadline = None if time_budget is None else perf_counter() + time_budget
 
-    # heap of nodes to look at, sorted by f_score. The f_score of any given node n is g_score(n) +
-    # h(n), i.e. the shortest path currently known to this node + estimated distance to the goal
-    # based on the heuristic
-    open_set = PriorityQueue()
-    open_set.put((h(start, goal), 0, start))
+    # index of the goal stops, with the walking time to the destination from each
+    egress = {graph.index_of(stop_id): dist / WALK_SPEED for stop_id, dist in goals}
+    # index of each goal stop, with the cost of the walk to the destination from it
+    goal_costs = [(graph.index_of(stop_id), cost.edge_cost(dist, dist / WALK_SPEED))
+                  for stop_id, dist in goals]
+
+    def estimate(index: int) -> float:
+        """Return the heuristic estimate of the cost from the stop with the given index to the
+        destination.
+        """
+        return min(cost.heuristic(graph, index, goal) + walk for goal, walk in goal_costs)
 
-    # For a stop_id n, path_bin[n] is the information for the trip/edge connecting it to the
-    # previous node. The information is given as a tuple:
-    # (trip_id, start stop_id, end stop_id, time arrived, day)
-    path_bin = {}
+    # the destination is a virtual node reached from the goal stops, numbered after every stop
+    destination = len(graph)
+    dest_pred, dest_g = -1, inf
 
-    # score of cheapest path from start to curr currently known
-    g_score = defaultdict(lambda: inf)
-    g_score[start] = 0
+    # For a node n, state holds the score of the cheapest path from start to n currently known,
+    # and the information for the trip/edge connecting it to the previous node:
+    # (trip_id, previous node, time arrived, day). The arrays in state are reused by every
+    # search run in this thread.
+    state = get_search_state(len(graph))
 
+    # heap of nodes to look at, sorted by f_score. The f_score of any given node n is g_score(n) +
+    # epsilon * h(n), i.e. the shortest path currently known to this node + estimated cost to the
+    # goal based on the cost model's heuristic. Entries are (f_score, push counter, node, g_score),
+    # where nodes are given as their index in graph. Entries are never removed when a node's
+    # score improves; instead, entries whose g_score is no longer the node's are skipped when
+    # popped.
+    open_set = []
     push_counter = 0
-    while not open_set.empty():
-        curr = open_set.get()[2]
-
-        if curr == goal:
-            # Use construct_path for a path with all stops included
-            # Use construct_filtered_path for a path that only describe entire trip segments
-            delta_t = 86400 - time + (((path_bin[curr.stop_id][4] - day) % 7) - 1) * 86400 \
-                + path_bin[curr.stop_id][3]
-            logger.info('Found path for %d -> %d' % (id1, id2))
+    for stop_id, dist in starts:
+        start = graph.index_of(stop_id)
+        # the walk to the start stop is scored like any other walk
+        walk_t = dist / WALK_SPEED
+        walk_cost = cost.edge_cost(dist, walk_t)
+        if walk_cost < state.get_g(start):
+            state.set_label(start, walk_cost, -1, 0, (time + walk_t) % DAY,
+                            (day - 1 + int((time + walk_t) // DAY)) % 7 + 1)
+            heappush(open_set, (walk_cost + epsilon * estimate(start),
+                                push_counter, start, walk_cost))
+            push_counter += 1
+
+    def current_path() -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+        """Return the path to the destination through dest_pred, and the time it takes."""
+        # Use construct_path for a path with all stops included
+        # Use construct_filtered_path for a path that only describe entire trip segments
+        arrival, arrival_day = state.get_arrival(dest_pred)
+        delta_t = ((arrival_day - day) % 7) * DAY - time + arrival + egress[dest_pred]
+        if not state.has_predecessor(dest_pred):  # the goal is a start stop
+            return ([], delta_t)
+        return (construct_filtered_path(state.path_bin(graph), graph.stop_ids[dest_pred]),
+                delta_t)
+
+    def suboptimality(best_g: float) -> float:
+        """Return an upper bound on the ratio of best_g to the optimal cost: best_g divided by
+        the least unweighted f_score of the nodes left to expand.
+        """
+        lower = min((g + (f - g) / epsilon for f, _, node, g in open_set
+                     if node != destination and g <= state.get_g(node)), default=best_g)
+        lower = min(lower, best_g)
+        if lower <= 0:
+            return 1.0 if best_g <= 0 else inf
+        return best_g / lower
+
+    backward = _BackwardSearch(query, graph, egress) if bidirectional else None
+    # the best path to the destination found by an anytime search, with the time it takes and
+    # its g_score
+    best = None
+
+    expanded = skipped = pruned = pops = 0
+    while open_set:
+        if best is not None and deadline is not None and perf_counter() >= deadline:
+            logger.info('Stopped search at time budget')
+            break
+        if cancel is not None and pops % CANCEL_CHECK_INTERVAL == 0:
+            if best is not None and cancel.is_expired():
+                logger.info('Stopped search at deadline')
+                break
+            cancel.check()
+        pops += 1
+
+        entry_f, _, curr, entry_g = heappop(open_set)
+
+        if curr == destination:
+            if entry_g > dest_g:
+                skipped += 1
+                continue
+            logger.info('Found path to %d, expanded %d stops and skipped %d stale entries',
+                        graph.stop_ids[dest_pred], expanded, skipped)
+            if backward is not None:
+                logger.info('Pruned %d stops, backward search settled %d stops',
+                            pruned, backward.num_settled())
+            if not reopen:
+                message_queue.put(('INC',))
+                return current_path()
+
+            best = (*current_path(), entry_g)
+            bound = suboptimality(entry_g)
+            logger.info('Path is within a factor %.3f of optimal', bound)
+            if bound <= 1:
+                break
+            message_queue.put(('INC', best[0], bound))
+            continue
+
+        if (not reopen and state.is_settled(curr)) or entry_g > state.get_g(curr):
+            skipped += 1
+            continue
+        if best is not None and entry_g + (entry_f - entry_g) / epsilon >= best[2]:
+            pruned += 1  # no path through curr is cheaper than the best path
+            continue
+        if shared_bound is not None \
+                and entry_g + (entry_f - entry_g) / epsilon >= shared_bound.value:
+            pruned += 1  # no path through curr is cheaper than one already found
+            continue
+        state.settle(curr)
+
+        if backward is not None:
+            backward.step()
+            if backward.prunes(curr, entry_g, *state.get_arrival(curr)):
+                pruned += 1
+                continue
+        expanded += 1
+
+        if curr in egress:
+            # the walk to the destination is scored like any other walk
+            temp_gscore = entry_g + cost.edge_cost(egress[curr] * WALK_SPEED, egress[curr])
+            if temp_gscore < dest_g:
+                dest_pred, dest_g = curr, temp_gscore
+                heappush(open_set, (temp_gscore, push_counter, destination, temp_gscore))
+                push_counter += 1
+                if shared_bound is not None:
+                    _lower_bound_to(shared_bound, temp_gscore)
+
+        for node, temp_gscore, _ in _expand(query, graph, state, cost, curr, entry_g, reopen):
+            # Calculate f_score for the node and push onto open_set. If h is consistent, any
+            # node removed from open_set is guaranteed to be optimal. Then by extension we know
+            # we are not pushing any "bad" nodes.
+            f_score = temp_gscore + epsilon * estimate(node)
+            heappush(open_set, (f_score, push_counter, node, temp_gscore))
+            push_counter += 1
+
+    if best is not None:
+        logger.info('Best path is within a factor %.3f of optimal, expanded %d stops',
+                    suboptimality(best[2]), expanded)
+        message_queue.put(('INC', best[0], suboptimality(best[2])))
+        message_queue.put(('INC',))
+        return (best[0], best[1])
+
+    logger.info('Found no path, expanded %d stops, skipped %d stale entries and pruned %d stops',
+                expanded, skipped, pruned)
+    return ([(0, 0, 0)], inf)
+
+
+def _expand(query: TransitQuery, graph: CSRGraph, state: SearchState, cost: CostModel,
+            curr: int, entry_g: float, reopen: bool) -> list[tuple[int, float, Optional[float]]]:
+    """Relax the transit and walking edges leaving the stop with index curr, reached with
+    g_score entry_g, and label every stop whose g_score improves. Settled stops are skipped,
+    unless reopen is True.
+
+    Return a list of (stop index, new g_score, wait) for the stops labelled, where wait is the
+    time, in seconds, spent at curr waiting for the vehicle taken, or None for a walk.
+    """
+    improved = []
+    curr_id = graph.stop_ids[curr]
+    curr_location = graph.location_of(curr)
+
+    # Note that this only works if the heuristic is both consistent and admissible. Then
+    # the arrival time to the current stop will be on the optimal path, and therefore we
+    # want to query all stops connected to this stop after this time
+    # If the time rolls over to the next day, query using the next day's timetable
+    # Returned as (trip_id, day, time_dep, time_arr, dist)
+    t, d = state.get_arrival(curr)
+
+    neighbours = graph.neighbour_indices(curr)
+
+    for neighbour in neighbours:
+        # the label of a settled neighbour is final, so skip the edge query
+        if not reopen and state.is_settled(neighbour):
+            continue
+        edge = query.get_edge_data(curr_id, graph.stop_ids[neighbour], t, d)
+        if edge is not None:
+            # score the edge by the distance travelled between stops and the time taken to
+            # reach the next stop
+            if edge[3] - edge[2] >= 0:
+                day_arrival = edge[1]
+            else:
+                day_arrival = edge[1] + 1
+            edge_weight = cost.edge_cost(edge[4], 86400 - t + (((day_arrival - d) % 7) - 1)
+                                         * 86400 + edge[3])
+            temp_gscore = entry_g + edge_weight
+
+            if temp_gscore < state.get_g(neighbour):
+                # record optimum path and update g_score for neighbour
+                state.set_label(neighbour, temp_gscore, curr, edge[0], edge[3],
+                                (day_arrival - 1) % 7 + 1)
+                improved.append((neighbour, temp_gscore,
+                                 ((edge[1] - d) % 7) * DAY + edge[2] - t))
+
+    for stop in query.get_closest_stops(curr_location[0], curr_location[1], WALK_RADIUS):
+        node = graph.index_of(stop)
+        if node != curr and node not in neighbours and (reopen or not state.is_settled(node)):
+            node_location = graph.location_of(node)
+
+            delta_d = distance(curr_location, node_location)
+            delta_t = delta_d / WALK_SPEED
+            edge_weight = cost.edge_cost(delta_d, delta_t)
+            temp_gscore = entry_g + edge_weight
+
+            if temp_gscore < state.get_g(node):
+                # record optimum path and update g_score for neighbour
+                state.set_label(node, temp_gscore, curr, 0, (t + delta_t) % DAY,
+                                (d - 1 + int((t + delta_t) // DAY)) % 7 + 1)
+                improved.append((node, temp_gscore, None))
+
+    return improved
+
+
+def parallel_a_star(starts: list[tuple[int, float]], goals: list[tuple[int, float]], time: int,
+                    day: int, message_queue: Queue, processes: int,
+                    cost: Optional[CostModel] = None, cancel: Optional[CancelToken] = None) \
+        -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+    """Run a_star from the start stops split into groups, one group per process, and return the
+    quickest path found, in the same format as a_star.
+
+    The searches share a ``multiprocessing.Value`` holding the least cost of any path to the
+    destination found so far (see the shared_bound argument of a_star), so a search that cannot
+    beat another stops early, and the searches take about as long as the one finding the best
+    path. ('INC',) is put on message_queue as each search finishes.
+
+    cost and cancel are passed to every search, so they must be picklable, and the flag of
+    cancel must be shareable between processes. If cost is None, each search uses the default
+    cost model of its process. This must not be called from a daemonic process, such as a worker
+    of a RoutingService, since it starts its own processes.
+
+    Preconditions:
+        - starts != []
+        - processes >= 1
+    """
+    groups = [starts[i::processes] for i in range(min(processes, len(starts)))]
+    bound = Value('d', inf)
+    results = []
+    with Pool(len(groups), initializer=_init_parallel_worker, initargs=(bound,)) as pool:
+        for result in pool.imap_unordered(_parallel_search,
+                                          [(group, goals, time, day, cost, cancel)
+                                           for group in groups]):
+            results.append(result)
             message_queue.put(('INC',))
-            return (construct_filtered_path(path_bin, curr.stop_id), delta_t)
-
-        # Note that this only works if the heuristic is both consistent and admissible. Then
-        # the arrival time to the current stop will be on the optimal path, and therefore we
-        # want to query all stops connected to this stop after this time
-        # If the time rolls over to the next day, query using the next day's timetable
-        # Returned as (trip_id, day, time_dep, time_arr, dist)
-        t = time if curr.stop_id not in path_bin else path_bin[curr.stop_id][3]
-        d = day if curr.stop_id not in path_bin else path_bin[curr.stop_id][4]
-
-        neighbour_id = set()
-
-        for neighbour in curr.get_neighbours():
-            neighbour_id.add(neighbour.stop_id)
-            edge = query.get_edge_data(curr.stop_id, neighbour.stop_id, t, d)
-            if edge is not None:
-                # optimize for both distance travelled between stops and time taken to reach
-                # next stop
-                if edge[3] - edge[2] >= 0:
-                    day_arrival = edge[1]
+    return min(results, key=lambda result: result[1])
+
+
+def _init_parallel_worker(bound: Any) -> None:
+    """Keep the bound shared by the searches of parallel_a_star for this worker process."""
+    _PARALLEL_BOUND['bound'] = bound
+
+
+def _parallel_search(task: tuple) -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+    """Run one search of parallel_a_star in a worker process, where task is the tuple
+    (starts, goals, time, day, cost, cancel) of its arguments to a_star.
+    """
+    starts, goals, time, day, cost, cancel = task
+    return a_star(starts, goals, time, day, Queue(), cost=cost, cancel=cancel,
+                  shared_bound=_PARALLEL_BOUND['bound'])
+
+
+def _lower_bound_to(shared_bound: Any, value: float) -> None:
+    """Set the multiprocessing.Value shared_bound to value, if value is smaller."""
+    with shared_bound.get_lock():
+        if value < shared_bound.value:
+            shared_bound.value = value
+
+
+def one_to_all(starts: list[tuple[int, float]], time: int, day: int, horizon: float = inf,
+               cancel: Optional[CancelToken] = None) -> array:
+    """Return the earliest arrival at every stop from any of the start stops, departing at the
+    given time and day, in seconds after the departure time.
+
+    starts is a list of (stop_id, walking distance) pairs, as for a_star. The search is a single
+    time-dependent Dijkstra search over the same transit and walking edges as a_star, and stops
+    once every stop left to expand is more than horizon seconds away.
+
+    The result is an array indexed by the stops' indices in the shared graph, holding inf for
+    the stops not reached within horizon seconds.
+
+    If cancel is not None, it is checked every CANCEL_CHECK_INTERVAL stops expanded, as in
+    a_star.
+    """
+    logger = logging.getLogger(__name__)
+    query = get_pool().local()
+    graph = get_shared_graph()
+    cost = TravelTimeCost(WALK_SPEED)  # only its edge costs are used
+    state = get_search_state(len(graph))
+    arrivals = array('d', [inf]) * len(graph)
+
+    open_set = []
+    for stop_id, dist in starts:
+        start = graph.index_of(stop_id)
+        walk_t = dist / WALK_SPEED
+        if walk_t < state.get_g(start):
+            state.set_label(start, walk_t, -1, 0, (time + walk_t) % DAY,
+                            (day - 1 + int((time + walk_t) // DAY)) % 7 + 1)
+            heappush(open_set, (walk_t, start))
+
+    expanded = 0
+    while open_set and open_set[0][0] <= horizon:
+        if cancel is not None and expanded % CANCEL_CHECK_INTERVAL == 0:
+            cancel.check()
+        entry_g, curr = heappop(open_set)
+        if state.is_settled(curr) or entry_g > state.get_g(curr):
+            continue
+        state.settle(curr)
+        arrivals[curr] = entry_g
+        expanded += 1
+
+        for node, temp_gscore, _ in _expand(query, graph, state, cost, curr, entry_g, False):
+            heappush(open_set, (temp_gscore, node))
+
+    logger.info('Reached %d stops within %s seconds', expanded, horizon)
+    return arrivals
+
+
+class IncrementalSearch:
+    """An A* search for the earliest arrival from a set of start stops, kept after it finds a
+    route so that later queries from the same start stops continue it instead of starting over.
+
+    Every stop the search settles keeps its optimal label whatever the goal, since the heuristic
+    is consistent. So when the goals change, the stops left to expand are ordered by the
+    heuristic of the new goals and the search resumes: a route through goal stops already settled
+    is found without expanding any more stops.
+
+    When the departure time moves later by delta seconds, the path to a stop can still be taken,
+    and arrives at the same time, if the wait for the first vehicle on it is at least delta.
+    Since the earliest arrival never decreases with the departure time, such a stop keeps its
+    label, which is still optimal. Only the other stops are searched again: stops reached by
+    walking alone are kept as unsettled, their stops reached with shorter waits are unlabelled,
+    and the settled stops with an edge to any of them are expanded again.
+
+    Instance Attributes:
+        - starts: the (stop_id, walking distance) pairs searched from, as for a_star
+        - goals: the (stop_id, walking distance) pairs of the current goals, as for a_star
+        - time: the current departure time, in seconds from midnight
+        - day: the day of departure, from 1 (Monday) to 7 (Sunday)
+        - graph: the graph searched
+
+    Representation Invariants:
+        - 0 <= self.time < DAY
+        - 1 <= self.day <= 7
+    """
+    # Private Instance Attributes:
+    #   - _cost: the travel time cost model searched with
+    #   - _state: the labels of the search, which are kept between queries
+    #   - _open_set: heap of the stops left to expand, as in a_star
+    #   - _push_counter: number of entries pushed onto _open_set
+    #   - _first_wait: for each labelled stop, the time waited for the first vehicle on its path,
+    #     or inf if its path only walks
+    #   - _egress: the index of each goal stop, with the walking time to the destination
+    #   - _dest_pred, _dest_g: the goal stop of the best path to the destination found, and its
+    #     g_score
+    starts: list[tuple[int, float]]
+    goals: list[tuple[int, float]]
+    time: int
+    day: int
+    graph: CSRGraph
+    _cost: TravelTimeCost
+    _state: SearchState
+    _open_set: list[tuple[float, int, int, float]]
+    _push_counter: int
+    _first_wait: array
+    _egress: dict[int, float]
+    _dest_pred: int
+    _dest_g: float
+
+    def __init__(self, starts: list[tuple[int, float]], goals: list[tuple[int, float]],
+                 time: int, day: int, cost: Optional[TravelTimeCost] = None) -> None:
+        """Initialize a search from the start stops to the goal stops, departing at the given
+        time and day. Nothing is searched until route is called.
+
+        cost is the cost model searched with, or None for the default cost model.
+
+        Raises ValueError if cost does not measure travel time.
+        """
+        self.graph = get_shared_graph()
+        self._cost = get_default_cost_model() if cost is None else cost
+        if not isinstance(self._cost, TravelTimeCost):
+            raise ValueError('Incremental search needs a travel time cost model.')
+        self.starts = starts
+        self.time = time
+        self.day = day
+        self._state = SearchState(len(self.graph))
+        self._first_wait = array('d', [inf]) * len(self.graph)
+        self._open_set = []
+        self._push_counter = 0
+
+        for stop_id, dist in starts:
+            start = self.graph.index_of(stop_id)
+            walk_t = dist / WALK_SPEED
+            if walk_t < self._state.get_g(start):
+                self._state.set_label(start, walk_t, -1, 0, (time + walk_t) % DAY,
+                                      (day - 1 + int((time + walk_t) // DAY)) % 7 + 1)
+                self._open_set.append((walk_t, 0, start, walk_t))
+        self.set_goals(goals)
+
+    def set_goals(self, goals: list[tuple[int, float]]) -> None:
+        """Change the goal stops of the search to goals, given as for a_star."""
+        self.goals = goals
+        self._egress = {self.graph.index_of(stop_id): dist / WALK_SPEED for stop_id, dist in goals}
+
+        # the stops left to expand, ordered by the heuristic of the new goals
+        frontier = {node for _, _, node, g in self._open_set
+                    if node != len(self.graph) and not self._state.is_settled(node)
+                    and g == self._state.get_g(node)}
+        self._rebuild_open_set(frontier)
+
+    def set_time(self, time: int) -> None:
+        """Change the departure time of the search to time, in seconds from midnight of the same
+        day.
+
+        Raises ValueError if time is earlier than the current departure time.
+
+        Preconditions:
+            - time < DAY
+        """
+        if time < self.time:
+            raise ValueError('Incremental search cannot move to an earlier departure time.')
+        delta = time - self.time
+        self.time = time
+        if delta == 0:
+            return
+
+        state = self._state
+        # stops whose labels are no longer final, and whose predecessors must be expanded again
+        changed = []
+        frontier = set()
+        for node in range(len(self.graph)):
+            if not state.is_labelled(node):
+                continue
+            trip_id, pred, arrival, day = state.get_label(node)
+            g = state.get_g(node)
+            if self._first_wait[node] == inf:
+                # a path walking from a start stop leaves and arrives delta seconds later
+                state.set_label(node, g, pred, trip_id, (arrival + delta) % DAY,
+                                (day - 1 + int((arrival + delta) // DAY)) % 7 + 1)
+                state.unsettle(node)
+                frontier.add(node)
+                changed.append(node)
+            elif self._first_wait[node] >= delta:
+                # the same path arrives at the same time, delta seconds sooner after departure
+                state.set_label(node, g - delta, pred, trip_id, arrival, day)
+                self._first_wait[node] -= delta
+                if not state.is_settled(node):
+                    frontier.add(node)
+            else:
+                state.unlabel(node)
+                changed.append(node)
+
+        query = get_pool().local()
+        for node in changed:
+            location = self.graph.location_of(node)
+            preds = set(self.graph.predecessor_indices(node))
+            preds.update(self.graph.index_of(stop) for stop in
+                         query.get_closest_stops(location[0], location[1], WALK_RADIUS))
+            for pred in preds:
+                if state.is_settled(pred):
+                    state.unsettle(pred)
+                    frontier.add(pred)
+
+        self._rebuild_open_set(frontier)
+
+    def route(self, cancel: Optional[CancelToken] = None) \
+            -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+        """Continue the search until it reaches the destination, and return the path found and
+        the time it takes, in the format of a_star.
+
+        If cancel is not None, it is checked every CANCEL_CHECK_INTERVAL stops popped, as in
+        a_star. It is checked before a stop is popped, so a cancelled search can still be
+        continued.
+        """
+        logger = logging.getLogger(__name__)
+        query = get_pool().local()
+        graph, state, open_set = self.graph, self._state, self._open_set
+        destination = len(graph)
+
+        expanded = pops = 0
+        while open_set and open_set[0][0] < inf:
+            if cancel is not None and pops % CANCEL_CHECK_INTERVAL == 0:
+                cancel.check()
+            pops += 1
+            # stops that cannot reach the current goals are left unsettled, since they are not
+            # popped in order of g_score
+            _, _, curr, entry_g = heappop(open_set)
+
+            if curr == destination:
+                if entry_g > self._dest_g:
+                    continue
+                logger.info('Found path to %d, expanded %d stops',
+                            graph.stop_ids[self._dest_pred], expanded)
+                self._push(destination, entry_g)  # so the same route is found again
+                return self._current_path()
+
+            if state.is_settled(curr) or entry_g > state.get_g(curr):
+                continue
+            state.settle(curr)
+            expanded += 1
+
+            if curr in self._egress:
+                self._reach_destination(curr)
+
+            for node, temp_gscore, wait in _expand(query, graph, state, self._cost, curr,
+                                                   entry_g, False):
+                if wait is None or self._first_wait[curr] != inf:
+                    self._first_wait[node] = self._first_wait[curr]
                 else:
-                    day_arrival = edge[1] + 1
-                edge_weight = edge[4] * (86400 - t + (((day_arrival - d) % 7) - 1)
-                                         * 86400 + edge[3])
-                temp_gscore = g_score[curr] + edge_weight
-
-                if temp_gscore < g_score[neighbour]:
-                    # record optimum path
-                    path_bin[neighbour.stop_id] = (
-                        edge[0], curr.stop_id, neighbour.stop_id, edge[3],
-                        (day_arrival - 1) % 7 + 1)
-                    g_score[neighbour] = temp_gscore  # update g_score for neighbour
-
-                    # Calculate f_score for neighbour and push onto open_set. If h is consistent,
-                    # any node removed from open_set is guaranteed to be optimal. Then by extension
-                    # we know we are not pushing any "bad" nodes.
-                    f_score = g_score[neighbour] + h(neighbour, goal)
-                    open_set.put((f_score, push_counter, neighbour))
-                    push_counter += 1
-
-        for stop in query.get_closest_stops(curr.location[0], curr.location[1], 0.05):
-            if stop != curr.stop_id and stop not in neighbour_id:
-                node = graph.get_vertex(stop)
-
-                delta_d = distance(curr.location, node.location)
-                delta_t = delta_d / 0.0014
-                edge_weight = delta_d * delta_t
-                temp_gscore = g_score[curr] + edge_weight
-
-                if temp_gscore < g_score[node]:
-                    if t + delta_t > 86400:
-                        d += 1
-                    # record optimum path
-                    path_bin[stop] = (0, curr.stop_id, stop, (t + delta_t) % 86400, (d - 1) % 7 + 1)
-                    g_score[node] = temp_gscore  # update g_score for neighbour
-
-                    # Calculate f_score for neighbour and push onto open_set. If h is consistent,
-                    # any node removed from open_set is guaranteed to be optimal. Then by extension
-                    # we know we are not pushing any "bad" nodes.
-                    f_score = g_score[node] + h(node, goal)
-                    open_set.put((f_score, push_counter, node))
-                    push_counter += 1
+                    self._first_wait[node] = wait
+                self._push(node, temp_gscore)
 
-    return ([(0, 0, 0)], inf)
+        logger.info('Found no path, expanded %d stops', expanded)
+        return ([(0, 0, 0)], inf)
+
+    def _rebuild_open_set(self, frontier: set[int]) -> None:
+        """Replace the stops left to expand by frontier, ordered by the heuristic of the current
+        goals, and add the paths to the destination through the settled goal stops.
+        """
+        state = self._state
+        self._open_set = []
+        self._push_counter = 0
+        for node in frontier:
+            self._open_set.append((state.get_g(node) + self._estimate(node), self._push_counter,
+                                   node, state.get_g(node)))
+            self._push_counter += 1
+        heapify(self._open_set)
+
+        self._dest_pred, self._dest_g = -1, inf
+        for goal in self._egress:
+            if state.is_settled(goal):
+                self._reach_destination(goal)
+
+    def _reach_destination(self, goal: int) -> None:
+        """Add the path to the destination through the settled goal stop with the given index,
+        if it is the best found so far.
+        """
+        g = self._state.get_g(goal) + self._egress[goal]
+        if g < self._dest_g:
+            self._dest_pred, self._dest_g = goal, g
+            self._push(len(self.graph), g)
+
+    def _push(self, node: int, g: float) -> None:
+        """Push node onto the open set with the given g_score."""
+        f = g if node == len(self.graph) else g + self._estimate(node)
+        heappush(self._open_set, (f, self._push_counter, node, g))
+        self._push_counter += 1
 
+    def _estimate(self, index: int) -> float:
+        """Return the heuristic estimate of the time from the stop with the given index to the
+        destination.
+        """
+        return min((self._cost.heuristic(self.graph, index, goal) + walk
+                    for goal, walk in self._egress.items()), default=inf)
 
-def h(curr: _Vertex, goal: _Vertex) -> float:
-    """A* heuristic function.
+    def _current_path(self) -> tuple[list[tuple[int, int, int]], Union[int, float]]:
+        """Return the path to the destination through _dest_pred, and the time it takes."""
+        arrival, arrival_day = self._state.get_arrival(self._dest_pred)
+        delta_t = ((arrival_day - self.day) % 7) * DAY - self.time + arrival \
+            + self._egress[self._dest_pred]
+        if not self._state.has_predecessor(self._dest_pred):  # the goal is a start stop
+            return ([], delta_t)
+        return (construct_filtered_path(self._state.path_bin(self.graph),
+                                        self.graph.stop_ids[self._dest_pred]), delta_t)
 
-    In this particular case, calculate the great-circle distance between the curr and goal nodes
-    using the haversine formula.
+
+class _BackwardSearch:
+    """The backward half of a bidirectional a_star search: a Dijkstra search from the
+    destination over the reverse of the lower-bound graph, one stop per call to step.
+
+    Instance Attributes:
+        - mu: the travel time of the fastest path to the destination found so far, or inf
+        - done: whether the backward search has stopped, either because it settled every stop
+          that can reach the destination or because every stop it has not settled has a lower
+          bound greater than mu
+
+    Representation Invariants:
+        - self.mu >= 0
     """
-    return distance(curr.location, goal.location)
+    # Private Instance Attributes:
+    #   - _query: the query used for the actual edge data of paths
+    #   - _graph: the graph searched
+    #   - _egress: the walking time to the destination from each goal stop
+    #   - _backward: the adjacency lists of the reverse lower-bound graph
+    #   - _lb: the lower-bound travel time to the destination of each stop settled
+    #   - _next: the next stop towards the destination of each stop settled, or -1 for a goal
+    #     stop whose lower bound is its walk to the destination
+    #   - _dist: the shortest lower-bound travel time known for each stop reached
+    #   - _reached_from: the stop each stop was reached from in _dist
+    #   - _heap: heap of (lower-bound travel time, stop index) of stops reached
+    mu: float
+    done: bool
+    _query: TransitQuery
+    _graph: CSRGraph
+    _egress: dict[int, float]
+    _backward: list[list[tuple[int, float]]]
+    _lb: dict[int, float]
+    _next: dict[int, int]
+    _dist: dict[int, float]
+    _reached_from: dict[int, int]
+    _heap: list[tuple[float, int]]
+
+    def __init__(self, query: TransitQuery, graph: CSRGraph, egress: dict[int, float]) -> None:
+        """Initialize a backward search in graph from the goal stops in egress, which maps each
+        goal stop's index to the walking time from it to the destination.
+        """
+        self.mu = inf
+        self.done = False
+        self._query = query
+        self._graph = graph
+        self._egress = egress
+        self._backward = get_shared_lower_bound_graphs()[1]
+        self._lb = {}
+        self._next = {}
+        self._dist = dict(egress)
+        self._reached_from = {goal: -1 for goal in egress}
+        self._heap = [(walk, goal) for goal, walk in egress.items()]
+        heapify(self._heap)
+
+    def num_settled(self) -> int:
+        """Return the number of stops settled by the backward search."""
+        return len(self._lb)
+
+    def step(self) -> None:
+        """Settle the next stop of the backward search, or stop the search if it is done."""
+        while self._heap and not self.done:
+            dist, curr = heappop(self._heap)
+            if curr in self._lb or dist > self._dist[curr]:
+                continue
+            if dist > self.mu + _PRUNE_TOLERANCE:  # every stop left is too far to matter
+                self.done = True
+                return
+            self._lb[curr] = dist
+            self._next[curr] = self._reached_from[curr]
+            for pred, time in self._backward[curr]:
+                if pred not in self._lb and dist + time < self._dist.get(pred, inf):
+                    self._dist[pred] = dist + time
+                    self._reached_from[pred] = curr
+                    heappush(self._heap, (dist + time, pred))
+            return
+        self.done = True
+
+    def prunes(self, index: int, g_score: float, time: Union[int, float], day: int) -> bool:
+        """Return whether the forward search, having settled the stop with the given index
+        with the given g_score at the given time and day, can skip expanding it.
+
+        If the stop could improve mu, mu is updated with the travel time of the path found by
+        following the backward search from the stop.
+        """
+        if index not in self._lb:
+            return self.done
+        if g_score + self._lb[index] > self.mu + _PRUNE_TOLERANCE:
+            return True
+        if g_score + self._lb[index] < self.mu:
+            self.mu = min(self.mu, g_score + self._follow(index, time, day))
+        return False
+
+    def _follow(self, index: int, time: Union[int, float], day: int) -> float:
+        """Return the actual travel time from the stop with the given index to the destination,
+        leaving at the given time and day and taking the path the backward search found, or inf
+        if the path cannot be taken.
+
+        Each step of the path is taken as a_star would take it: by transit to a neighbour, and
+        by walking to any other stop.
+        """
+        elapsed = 0
+        while self._next[index] != -1:
+            next_index = self._next[index]
+            if next_index in self._graph.neighbour_indices(index):
+                edge = self._query.get_edge_data(self._graph.stop_ids[index],
+                                                 self._graph.stop_ids[next_index], time, day)
+                if edge is None:
+                    return inf
+                day_arrival = edge[1] if edge[3] - edge[2] >= 0 else edge[1] + 1
+                elapsed += DAY - time + (((day_arrival - day) % 7) - 1) * DAY + edge[3]
+                time, day = edge[3], (day_arrival - 1) % 7 + 1
+            else:
+                walk_t = distance(self._graph.location_of(index),
+                                  self._graph.location_of(next_index)) / WALK_SPEED
+                elapsed += walk_t
+                time, day = (time + walk_t) % DAY, (day - 1 + int((time + walk_t) // DAY)) % 7 + 1
+            index = next_index
+        return elapsed + self._egress[index]
 
 
 def construct_path(path_bin: dict[int, tuple[int, int, int, int, int]],
@@ -184,7 +1129,7 @@ def construct_path(path_bin: dict[int, tuple[int, int, int, int, int]],
     path = [path_bin[goal_id][:3]]
 
     curr_id = path_bin[goal_id][1]
-    while curr_id in path_bin.keys():
+    while curr_id in path_bin:
         path.append(path_bin[curr_id][:3])
         curr_id = path_bin[curr_id][1]
 
@@ -205,7 +1150,7 @@ def construct_filtered_path(path_bin: dict[int, tuple[int, int, int, int, int]],
     start_stop = path_bin[goal_id][1]
     end_stop = path_bin[goal_id][2]
 
-    while curr_id in path_bin.keys():
+    while curr_id in path_bin:
         if path_bin[curr_id][0] == curr_trip:
             start_stop = path_bin[curr_id][1]
         else:
@@ -229,8 +1174,10 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['collections', 'math', 'multiprocessing', 'queue', 'typing',
-                          'data_interface', 'graph', 'util', 'logging'],
+        'extra-imports': ['array', 'math', 'heapq', 'queue', 'typing', 'data_interface', 'graph',
+                          'heuristic', 'hub_labels', 'landmarks', 'csa', 'profile_csa', 'raptor',
+                          'route_cache', 'search_state', 'timetable', 'trip_based', 'util',
+                          'logging', 'multiprocessing', 'threading', 'time'],
         'allowed-io': [],
         'max-line-length': 100,
         'max-nested-blocks': 5,
@@ -0,0 +1,310 @@
+"""TTC Route Planner for Toronto, Ontario -- Profile Connection Scan
+
+This module provides profile (range) queries over a ``timetable.Timetable``: every optimal
+journey from the sources to the targets for departures across a time window, computed in one run
+of the profile Connection Scan Algorithm (Dibbelt, Pajor, Strasser and Wagner, 2013).
+
+Where ``csa`` scans connections forwards from a single departure time, the profile scan goes
+through them backwards, from the latest connection that can matter down to the start of the
+window. Every stop keeps a profile: the Pareto set of (departure time, arrival time at the
+destination) pairs of the journeys found from it so far. Every trip instance keeps the earliest
+arrival at the destination of staying on board. A connection arrives at the destination as early
+as the best of leaving the trip to walk to a target, staying on the trip, or transferring to the
+journeys in the profile of its arrival stop. Its departure (and the departures of the walks to
+it) is then added to the profiles of the stops it can be boarded from.
+
+The result is the set of journeys an earliest arrival query returns for some departure time in
+the window, so one range query replaces a point query for every departure time in it.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from bisect import bisect_left, bisect_right
+from math import inf
+from typing import Any, Optional
+
+from csa import csa
+from timetable import WEEK, Timetable
+
+# A journey is stored as a linked chain of legs, each ('ride', trip index, from stop, to stop,
+# next leg) or ('walk', from stop, to stop, next leg), where the last leg's next leg is None.
+# Chains found by the scan share their tails, so no journey is copied.
+_Journey = Optional[tuple]
+
+
+class _Profile:
+    """The Pareto set of the journeys found from one stop, as (departure time, arrival time)
+    pairs with the journey taken.
+
+    Instance Attributes:
+        - deps: the departure time of each journey, in increasing order
+        - arrs: the arrival time of each journey, in increasing order
+        - journeys: each journey
+
+    Representation Invariants:
+        - len(self.deps) == len(self.arrs) == len(self.journeys)
+        - all(self.deps[i] < self.deps[i + 1] for i in range(len(self.deps) - 1))
+        - all(self.arrs[i] < self.arrs[i + 1] for i in range(len(self.arrs) - 1))
+    """
+    deps: list[float]
+    arrs: list[float]
+    journeys: list[_Journey]
+
+    def __init__(self) -> None:
+        """Initialize an empty profile."""
+        self.deps = []
+        self.arrs = []
+        self.journeys = []
+
+    def evaluate(self, time: float) -> tuple[float, _Journey]:
+        """Return the earliest arrival time of the journeys departing at or after time, with the
+        journey, or (inf, None) if there are none.
+
+        >>> profile = _Profile()
+        >>> profile.insert(10, 50, None) and profile.insert(20, 40, None)
+        True
+        >>> profile.evaluate(15), profile.evaluate(25)
+        ((40, None), (inf, None))
+        """
+        i = bisect_left(self.deps, time)
+        if i == len(self.deps):
+            return (inf, None)
+        return (self.arrs[i], self.journeys[i])
+
+    def insert(self, dep: float, arr: float, journey: _Journey) -> bool:
+        """Add the journey departing at dep and arriving at arr, unless a journey in this profile
+        departs no earlier and arrives no later. Remove the journeys it dominates.
+
+        Return whether the journey was added.
+
+        >>> profile = _Profile()
+        >>> profile.insert(10, 50, None), profile.insert(5, 50, None), profile.insert(20, 30, None)
+        (True, False, True)
+        >>> profile.deps, profile.arrs
+        ([20], [30])
+        """
+        i = bisect_left(self.deps, dep)
+        if i < len(self.deps) and self.arrs[i] <= arr:
+            return False
+        j = i
+        if j < len(self.deps) and self.deps[j] == dep:
+            j += 1
+        while i > 0 and self.arrs[i - 1] >= arr:
+            i -= 1
+        self.deps[i:j] = [dep]
+        self.arrs[i:j] = [arr]
+        self.journeys[i:j] = [journey]
+        return True
+
+
+def profile_csa(timetable: Timetable, sources: list[tuple[int, float]],
+                targets: list[tuple[int, float]], earliest: float, latest: float) \
+        -> list[tuple[float, float, list[tuple[int, int, int]]]]:
+    """Return every journey from any of the sources to any of the targets that has the earliest
+    arrival at the destination for some departure time from the origin in [earliest, latest].
+
+    sources is a list of (stop index, access time) pairs, giving the time needed to reach each
+    source stop from the origin, and targets is a list of (stop index, egress time) pairs, as
+    for ``raptor.raptor``. Times are given in seconds after Monday 00:00, so an earliest time
+    below 0 is in the previous week.
+
+    Each journey is returned as a tuple (departure time from the origin, arrival time at the
+    destination, path), in increasing order of departure, where the path is in the format of
+    ``raptor.raptor``. The last journey may depart after latest, if it is the one with the
+    earliest arrival for departing at latest. Journeys arriving more than a week after latest
+    are not found.
+
+    Preconditions:
+        - sources != []
+        - latest - WEEK < earliest <= latest
+        - 0 <= latest < WEEK
+    """
+    # journeys departing at or before latest that arrive after the earliest arrival for
+    # departing at latest are dominated by it, so no connection departing later can matter.
+    # Connections departing exactly then can, if they take no time.
+    latest_journey = csa(timetable, [(stop, latest + access) for stop, access in sources],
+                         targets)
+    horizon = latest + WEEK if latest_journey is None else latest_journey[1]
+
+    origin = _Profile()
+    _scan(timetable, targets, earliest, horizon, dict(sources), origin)
+
+    journeys = []
+    for dep, arr, journey in zip(origin.deps, origin.arrs, origin.journeys):
+        if dep >= earliest:
+            journeys.append((dep, arr, _extract_path(timetable, journey)))
+            if dep >= latest:
+                break
+    return journeys
+
+
+def stop_profiles(timetable: Timetable, stops: list[int], targets: list[tuple[int, float]],
+                  earliest: float, horizon: float) \
+        -> dict[int, list[tuple[float, float, _Journey]]]:
+    """Return the profile of each of the given stops: every journey from the stop to any of the
+    targets that has the earliest arrival at the destination for some departure time in
+    [earliest, horizon], as a list of (departure time, arrival time, journey) tuples in
+    increasing order of departure. Only journeys arriving at or before horizon are found.
+
+    targets and times are given as for profile_csa. Journeys are given as linked chains of legs,
+    which journey_legs turns into lists.
+
+    Preconditions:
+        - earliest <= horizon
+    """
+    profiles = _scan(timetable, targets, earliest, horizon, {}, _Profile())
+    return {stop: [(dep, arr, journey) for dep, arr, journey
+                   in zip(profiles[stop].deps, profiles[stop].arrs, profiles[stop].journeys)
+                   if dep >= earliest]
+            for stop in stops if stop in profiles}
+
+
+def journey_legs(journey: _Journey) -> list[tuple[int, int, int]]:
+    """Return the legs of journey as a list of (trip index, from stop, to stop) tuples, in order,
+    where the trip index is -1 for walking legs.
+
+    >>> journey_legs(('walk', 1, 2, ('ride', 7, 2, 5, None)))
+    [(-1, 1, 2), (7, 2, 5)]
+    """
+    legs = []
+    while journey is not None:
+        if journey[0] == 'walk':
+            _, from_stop, to_stop, journey = journey
+            legs.append((-1, from_stop, to_stop))
+        else:
+            _, trip, from_stop, to_stop, journey = journey
+            legs.append((trip, from_stop, to_stop))
+    return legs
+
+
+def _scan(timetable: Timetable, targets: list[tuple[int, float]], earliest: float,
+          horizon: float, access_times: dict[int, float], origin: _Profile) -> dict[int, _Profile]:
+    """Scan the connections departing in [earliest, horizon] backwards, and return the profile
+    of every stop a journey to the targets was found from.
+
+    Journeys from the stops in access_times are also inserted into origin, with their
+    departures moved back by the access time of the stop.
+    """
+    final, final_walk = _final_walks(timetable, targets)
+
+    profiles = {}
+    # for each trip instance seen: (earliest arrival at the destination when on board,
+    # departure time and position of the last connection of the instance scanned,
+    # stop left at, journey after leaving)
+    on_board = {}
+
+    conn_dep, conn_arr = timetable.conn_dep, timetable.conn_arr
+    conn_from, conn_to = timetable.conn_from, timetable.conn_to
+    conn_trip, conn_pos = timetable.conn_trip, timetable.conn_pos
+    foot_offsets, foot_targets, foot_times = \
+        timetable.foot_offsets, timetable.foot_targets, timetable.foot_times
+
+    for c, offset in _connections_before(timetable, earliest, horizon):
+        departure, arrival = conn_dep[c] + offset, conn_arr[c] + offset
+        to_stop, trip = conn_to[c], conn_trip[c]
+
+        # leave the trip and walk to the destination
+        best, exit_stop, exit_journey = arrival + final.get(to_stop, inf), to_stop, \
+            final_walk.get(to_stop)
+        # transfer to another journey at the arrival stop
+        if to_stop in profiles:
+            transfer, journey = profiles[to_stop].evaluate(arrival)
+            if transfer < best:
+                best, exit_journey = transfer, journey
+        # stay on the trip, if it is the same instance (a week apart at most), which is
+        # preferred to leaving it for a journey arriving at the same time
+        seated = on_board.get(trip)
+        if seated is not None and seated[2] > conn_pos[c] and seated[1] - departure < WEEK \
+                and seated[0] <= best:
+            best, exit_stop, exit_journey = seated[0], seated[3], seated[4]
+
+        on_board[trip] = (best, departure, conn_pos[c], exit_stop, exit_journey)
+        if best == inf:
+            continue
+
+        from_stop = conn_from[c]
+        ride = ('ride', trip, from_stop, exit_stop, exit_journey)
+        walks = [(from_stop, 0, ride)]
+        walks.extend((foot_targets[j], foot_times[j], ('walk', foot_targets[j], from_stop, ride))
+                     for j in range(foot_offsets[from_stop], foot_offsets[from_stop + 1]))
+        for stop, walk, journey in walks:
+            if stop not in profiles:
+                profiles[stop] = _Profile()
+            if profiles[stop].insert(departure - walk, best, journey) and stop in access_times:
+                origin.insert(departure - walk - access_times[stop], best, journey)
+
+    return profiles
+
+
+def _final_walks(timetable: Timetable, targets: list[tuple[int, float]]) \
+        -> tuple[dict[int, float], dict[int, _Journey]]:
+    """Return the shortest time from each stop to the destination without boarding a trip,
+    by walking to a target (if needed) and leaving through it, with the walk taken.
+    """
+    final = {}
+    final_walk = {}
+    for target, egress in targets:
+        if egress < final.get(target, inf):
+            final[target], final_walk[target] = egress, None
+        for j in range(timetable.foot_offsets[target], timetable.foot_offsets[target + 1]):
+            # footpaths are symmetric, so this is also the walk from stop to target
+            stop = timetable.foot_targets[j]
+            if timetable.foot_times[j] + egress < final.get(stop, inf):
+                final[stop] = timetable.foot_times[j] + egress
+                final_walk[stop] = ('walk', stop, target, None)
+    return (final, final_walk)
+
+
+def _connections_before(timetable: Timetable, start: float, end: float) -> Any:
+    """Yield (connection, offset) for every connection departing in [start, end], in decreasing
+    order of departure time, where offset is the multiple of WEEK to add to the times of the
+    connection.
+
+    Connections departing at the same time are yielded in the reverse of their order in the
+    connection array, so that each is scanned after the connections it can transfer to.
+    """
+    num_connections = timetable.num_connections()
+    if num_connections == 0:
+        return
+    offset = (end // WEEK) * WEEK
+    c = bisect_right(timetable.conn_dep, end - offset) - 1
+    while True:
+        if c < 0:  # continue with the previous week's connections
+            c, offset = num_connections - 1, offset - WEEK
+        if timetable.conn_dep[c] + offset < start:
+            return
+        yield (c, offset)
+        c -= 1
+
+
+def _extract_path(timetable: Timetable, journey: _Journey) -> list[tuple[int, int, int]]:
+    """Return the path of journey, in the format of ``raptor.raptor``."""
+    stop_ids = timetable.graph.stop_ids
+    path = []
+    while journey is not None:
+        if journey[0] == 'walk':
+            _, from_stop, to_stop, journey = journey
+            if path and path[-1][0] == 0:  # merge consecutive walks
+                path[-1] = (0, path[-1][1], stop_ids[to_stop])
+            else:
+                path.append((0, stop_ids[from_stop], stop_ids[to_stop]))
+        else:
+            _, trip, from_stop, to_stop, journey = journey
+            path.append((timetable.trip_ids[trip], stop_ids[from_stop], stop_ids[to_stop]))
+    path.reverse()
+    return path
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['bisect', 'math', 'typing', 'csa', 'timetable'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
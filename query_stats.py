@@ -0,0 +1,197 @@
+"""TTC Route Planner for Toronto, Ontario -- Query Statistics
+
+This module provides the QueryStats class, used to record opt-in instrumentation of
+``data_interface.TransitQuery`` objects:
+    - call counts, latency histograms and number of rows returned for each public method
+    - a log of the SQL statements slower than a threshold, with their bound parameters
+
+Statistics are enabled by passing a QueryStats object to a TransitQuery or QueryPool, and can be
+exported with ``QueryStats.snapshot`` or ``QueryStats.to_json`` to compare runs. A QueryStats
+object may be shared by TransitQuery objects in different threads, but each process records its
+own statistics.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+# upper bounds (in milliseconds) of the latency histogram buckets. The last bucket is unbounded.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class _MethodStats:
+    """Statistics recorded for a single TransitQuery method.
+
+    Instance Attributes:
+        - calls: number of completed calls
+        - errors: number of calls that raised an exception
+        - rows: total number of rows returned
+        - total_ms: total latency of all calls, in milliseconds
+        - max_ms: latency of the slowest call, in milliseconds
+        - buckets: counts of calls in each latency bucket, parallel to LATENCY_BUCKETS_MS with
+          one extra bucket for latencies above the last bound
+
+    Representation Invariants:
+        - sum(self.buckets) == self.calls + self.errors
+    """
+    calls: int
+    errors: int
+    rows: int
+    total_ms: float
+    max_ms: float
+    buckets: list[int]
+
+    def __init__(self) -> None:
+        """Initialize empty method statistics."""
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms: float, rows: Optional[int]) -> None:
+        """Record one call taking elapsed_ms milliseconds and returning the given number of rows.
+
+        rows is None if the call raised an exception.
+        """
+        if rows is None:
+            self.errors += 1
+        else:
+            self.calls += 1
+            self.rows += rows
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and elapsed_ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return these statistics as a JSON-serializable dictionary."""
+        labels = [f'<={bound}ms' for bound in LATENCY_BUCKETS_MS] \
+            + [f'>{LATENCY_BUCKETS_MS[-1]}ms']
+        num_calls = self.calls + self.errors
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'rows': self.rows,
+                'total_ms': self.total_ms,
+                'mean_ms': self.total_ms / num_calls if num_calls > 0 else 0.0,
+                'max_ms': self.max_ms,
+                'histogram': dict(zip(labels, self.buckets))}
+
+
+class QueryStats:
+    """Instrumentation data collected from TransitQuery objects.
+
+    Instance Attributes:
+        - slow_threshold_ms: SQL statements taking at least this many milliseconds are added to
+          the slow statement log
+        - max_slow_statements: maximum number of entries kept in the slow statement log. The
+          oldest entries are discarded first.
+
+    Representation Invariants:
+        - self.slow_threshold_ms >= 0
+        - self.max_slow_statements >= 0
+    """
+    # Private Instance Attributes:
+    #   - _methods: statistics for each TransitQuery method, keyed by method name
+    #   - _slow: slow statement log, oldest first
+    #   - _lock: guards _methods and _slow
+    slow_threshold_ms: float
+    max_slow_statements: int
+    _methods: dict[str, _MethodStats]
+    _slow: deque
+    _lock: threading.Lock
+
+    def __init__(self, slow_threshold_ms: float = 50, max_slow_statements: int = 1000) -> None:
+        """Initialize an empty QueryStats object.
+
+        Preconditions:
+            - slow_threshold_ms >= 0
+            - max_slow_statements >= 0
+        """
+        self.slow_threshold_ms = slow_threshold_ms
+        self.max_slow_statements = max_slow_statements
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Discard all recorded statistics."""
+        with self._lock:
+            self._methods = {}
+            self._slow = deque(maxlen=self.max_slow_statements)
+
+    def record_call(self, method: str, elapsed_ms: float, rows: Optional[int]) -> None:
+        """Record a call to the TransitQuery method with the given name.
+
+        rows is the number of rows returned, or None if the call raised an exception.
+        """
+        with self._lock:
+            if method not in self._methods:
+                self._methods[method] = _MethodStats()
+            self._methods[method].record(elapsed_ms, rows)
+
+    def record_statement(self, method: str, sql: str, elapsed_ms: float) -> None:
+        """Record the execution of a single SQL statement by the given TransitQuery method.
+
+        sql is the statement text with its bound parameters expanded. It is only kept if the
+        statement is slower than slow_threshold_ms.
+        """
+        if elapsed_ms >= self.slow_threshold_ms:
+            with self._lock:
+                self._slow.append({'method': method,
+                                   'sql': ' '.join(sql.split()),  # collapse whitespace
+                                   'elapsed_ms': elapsed_ms,
+                                   'timestamp': time.time()})
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return a JSON-serializable copy of the recorded statistics.
+
+        The returned dictionary contains the following keys:
+            - slow_threshold_ms: the slow statement threshold in milliseconds
+            - methods: dictionary mapping method names to their statistics dictionary, containing
+              the keys calls, errors, rows, total_ms, mean_ms, max_ms and histogram
+            - slow_statements: list of slow statements, oldest first, each a dictionary with the
+              keys method, sql, elapsed_ms and timestamp
+
+        >>> stats = QueryStats()
+        >>> stats.record_call('get_stops', 1.5, 10)
+        >>> stats.snapshot()['methods']['get_stops']['rows']
+        10
+        """
+        with self._lock:
+            return {'slow_threshold_ms': self.slow_threshold_ms,
+                    'methods': {name: method_stats.to_dict()
+                                for name, method_stats in sorted(self._methods.items())},
+                    'slow_statements': list(self._slow)}
+
+    def to_json(self, file_path: Optional[str] = None) -> str:
+        """Return the snapshot of the recorded statistics as a JSON string. If file_path is
+        given, the JSON is also written to that file.
+        """
+        data = json.dumps(self.snapshot(), indent=2)
+        if file_path is not None:
+            with open(file_path, mode='w') as f:
+                f.write(data)
+        return data
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['json', 'threading', 'time', 'collections', 'typing'],
+        'allowed-io': ['to_json'],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -0,0 +1,216 @@
+"""TTC Route Planner for Toronto, Ontario -- RAPTOR
+
+This module provides an implementation of RAPTOR (Round-bAsed Public Transit Optimized Router,
+Delling, Pajor and Werneck, 2012) over a ``timetable.Timetable``, as an alternative routing
+engine to the A* search in ``pathfinding``.
+
+Round k of RAPTOR computes the earliest arrival at every stop using at most k trips. Each round
+scans every route pattern through a stop improved in the previous round once, hopping on the
+earliest trip that can be caught, and then relaxes the walking footpaths from the stops it
+improved. No database queries are made during a search. Among the journeys with the earliest
+arrival, the one with the fewest trips is returned.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from array import array
+from math import inf
+from typing import Optional, Union
+
+from timetable import Timetable
+
+# maximum number of trips in a journey
+MAX_ROUNDS = 8
+
+# kinds of labels in _RoundLabels
+_SOURCE = 0
+_TRIP = 1
+_WALK = 2
+
+
+class _RoundLabels:
+    """The labels of every stop computed in one round of RAPTOR.
+
+    Instance Attributes:
+        - arrival: the earliest arrival at each stop found in this round, or inf if none
+        - kind: how each stop was reached: _SOURCE, _TRIP or _WALK
+        - parent: the stop the trip was boarded at or the walk started from
+        - trip_id: the trip_id of the trip taken, or 0 for walking
+    """
+    arrival: array
+    kind: array
+    parent: array
+    trip_id: array
+
+    def __init__(self, num_stops: int) -> None:
+        """Initialize labels for num_stops stops, none of which are reached."""
+        self.arrival = array('d', [inf]) * num_stops
+        self.kind = array('b', [_SOURCE]) * num_stops
+        self.parent = array('i', [-1]) * num_stops
+        self.trip_id = array('q', [0]) * num_stops
+
+
+def raptor(timetable: Timetable, sources: list[tuple[int, float]],
+           targets: list[tuple[int, float]], max_rounds: int = MAX_ROUNDS) \
+        -> Optional[tuple[list[tuple[int, int, int]], float]]:
+    """Return the journey with the earliest arrival at the destination, from any of the sources
+    to any of the targets.
+
+    sources is a list of (stop index, departure time) pairs, giving the times the journey can
+    start at each source stop. targets is a list of (stop index, egress time) pairs, giving the
+    time needed to get from each target stop to the destination. Times are in seconds after
+    Monday 00:00 of the current week.
+
+    Returns a tuple of the path and the time of arrival at the destination, or None if no
+    journey with at most max_rounds trips exists. The path is given in the same format as
+    ``pathfinding.find_route``: a list of (trip_id, start stop_id, end stop_id) tuples in
+    reverse order, where walking legs have a trip_id of 0.
+
+    Preconditions:
+        - sources != []
+        - max_rounds >= 0
+    """
+    num_stops = len(timetable.graph)
+    egress = dict(targets)
+
+    # best[s] is the earliest arrival at stop s over all rounds so far
+    best = array('d', [inf]) * num_stops
+    rounds = [_RoundLabels(num_stops)]
+    marked = set()
+    for stop, time in sources:
+        if time < rounds[0].arrival[stop]:
+            rounds[0].arrival[stop] = time
+            best[stop] = time
+            marked.add(stop)
+    marked |= _relax_footpaths(timetable, rounds[0], best, marked)
+
+    for _ in range(max_rounds):
+        if not marked:
+            break
+        prev, curr = rounds[-1], _RoundLabels(num_stops)
+        rounds.append(curr)
+        bound = min((best[stop] + time for stop, time in egress.items()), default=inf)
+
+        # collect the patterns through marked stops, with the first marked stop on each
+        queue = {}
+        for stop in marked:
+            for j in range(timetable.stop_pattern_offsets[stop],
+                           timetable.stop_pattern_offsets[stop + 1]):
+                pattern = timetable.stop_patterns[j]
+                position = timetable.stop_pattern_positions[j]
+                if position < queue.get(pattern, inf):
+                    queue[pattern] = position
+
+        marked = set()
+        for pattern, start in queue.items():
+            marked |= _scan_pattern(timetable, pattern, start, prev, curr, best, bound)
+        marked |= _relax_footpaths(timetable, curr, best, marked)
+
+    return _extract_journey(timetable, rounds, egress)
+
+
+def _scan_pattern(timetable: Timetable, pattern: int, start: int, prev: _RoundLabels,
+                  curr: _RoundLabels, best: array, bound: float) -> set[int]:
+    """Scan the pattern from the stop at position start, updating the labels of curr and best
+    with the arrivals of the trips that can be boarded using the labels of prev.
+
+    Arrivals no earlier than bound are pruned. Return the set of stops whose labels improved.
+    """
+    improved = set()
+    first = timetable.pattern_stop_offsets[pattern]
+
+    trip = None  # (instance number, week offset) of the trip currently ridden
+    board_stop = -1
+    for position in range(start, timetable.pattern_length(pattern)):
+        stop = timetable.pattern_stops[first + position]
+
+        if trip is not None:
+            arrival = timetable.trip_time(pattern, trip[0], position, departure=False) + trip[1]
+            if arrival < best[stop] and arrival < bound:
+                curr.arrival[stop] = arrival
+                curr.kind[stop] = _TRIP
+                curr.parent[stop] = board_stop
+                curr.trip_id[stop] = timetable.trip_id(pattern, trip[0])
+                best[stop] = arrival
+                improved.add(stop)
+
+        # hop on an earlier trip if one can be caught here
+        ready = prev.arrival[stop]
+        if ready < inf and (trip is None or ready <= timetable.trip_time(
+                pattern, trip[0], position) + trip[1]):
+            earlier = timetable.earliest_trip(pattern, position, ready)
+            if earlier is not None and (trip is None or (
+                    timetable.trip_time(pattern, earlier[0], position) + earlier[1]
+                    < timetable.trip_time(pattern, trip[0], position) + trip[1])):
+                trip = earlier
+                board_stop = stop
+
+    return improved
+
+
+def _relax_footpaths(timetable: Timetable, labels: _RoundLabels, best: array,
+                     stops: set[int]) -> set[int]:
+    """Relax the footpaths from the given stops, updating labels and best.
+
+    Return the set of stops whose labels improved.
+    """
+    improved = set()
+    for stop in stops:
+        for j in range(timetable.foot_offsets[stop], timetable.foot_offsets[stop + 1]):
+            target = timetable.foot_targets[j]
+            arrival = labels.arrival[stop] + timetable.foot_times[j]
+            if arrival < best[target]:
+                labels.arrival[target] = arrival
+                labels.kind[target] = _WALK
+                labels.parent[target] = stop
+                labels.trip_id[target] = 0
+                best[target] = arrival
+                improved.add(target)
+    return improved
+
+
+def _extract_journey(timetable: Timetable, rounds: list[_RoundLabels],
+                     egress: dict[int, float]) \
+        -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
+    """Return the path and arrival time of the journey with the earliest arrival at the
+    destination and, among those, the fewest rounds. Return None if no target was reached.
+    """
+    best_arrival, best_round, best_stop = inf, -1, -1
+    for k, labels in enumerate(rounds):
+        for stop, time in egress.items():
+            if labels.arrival[stop] + time < best_arrival:
+                best_arrival, best_round, best_stop = labels.arrival[stop] + time, k, stop
+
+    if best_round == -1:
+        return None
+
+    stop_ids = timetable.graph.stop_ids
+    path = []
+    k, stop = best_round, best_stop
+    while rounds[k].kind[stop] != _SOURCE:
+        labels = rounds[k]
+        leg = (labels.trip_id[stop], stop_ids[labels.parent[stop]], stop_ids[stop])
+        if labels.kind[stop] == _WALK and path and path[-1][0] == 0:
+            path[-1] = (0, leg[1], path[-1][2])  # merge consecutive walks into one leg
+        else:
+            path.append(leg)
+        if labels.kind[stop] == _TRIP:
+            k -= 1
+        stop = labels.parent[stop]
+
+    return (path, best_arrival)
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['array', 'math', 'typing', 'timetable'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -0,0 +1,315 @@
+"""TTC Route Planner for Toronto, Ontario -- Route Cache
+
+This module provides the RouteCache class, a least recently used cache of the routes computed by
+``pathfinding.find_route``, so that repeated requests (the same commute, at the same time of
+day) are answered without running a search.
+
+Routes are cached under the routing engine, the stops the start and end locations snap to with
+the walking distances to them (rounded to the metre), the day, and a bucket of departure times
+of a configurable width. Every engine counts the walks, so routes from different locations
+differ even between the same stops, and engines may break ties between equally quick routes
+differently. A key holds the routes computed for a few departure times in its bucket, as
+samples (departure time, arrival time, path). A cached route is only returned if it is proven
+optimal for the exact departure time requested. The earliest arrival
+never decreases with the departure time, since a traveller can always wait, so a request is
+answered from the cache if:
+    - a sample departs at exactly the requested time, or
+    - the samples departing just before and just after the requested time arrive at the same
+      time, in which case every departure between them arrives then too, and the later sample's
+      route (waiting at the origin until it departs) is optimal.
+
+The cache can be persisted to a JSON file next to ``transit.db``, which is discarded when the
+database changes (see ``data_interface.database_fingerprint``). A persistent cache is saved
+every SAVE_INTERVAL routes stored, and when the process exits. Hits, misses and evictions are
+counted for the cache's hit rate.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+import data_interface
+import snapshot
+from graph import DB_FILE
+
+# default maximum number of keys kept in a cache
+DEFAULT_CAPACITY = 4096
+
+# default width of the departure time buckets, in seconds
+DEFAULT_BUCKET = 600
+
+# maximum number of samples kept for a key. The oldest sample is discarded first.
+MAX_SAMPLES = 8
+
+# format version of the cache file. Increment whenever its contents change.
+CACHE_VERSION = 2
+
+# number of decimal places the walking distances (in km) of a key are rounded to
+WALK_PRECISION = 3
+
+# tolerance, in seconds, of comparing arrival times, which may differ by rounding when the
+# same route is computed for different departure times
+_ARRIVAL_TOLERANCE = 1e-6
+
+# number of routes stored between writes of a persistent cache to its file
+SAVE_INTERVAL = 32
+
+# route cache returned by get_shared_route_cache, keyed by the database fingerprint
+_SHARED_ROUTE_CACHE = {}
+
+# ((start stop_id, walking distance) pairs, (end stop_id, walking distance) pairs, engine, day,
+# departure time bucket)
+_Key = tuple[tuple[tuple[int, float], ...], tuple[tuple[int, float], ...], str, int, int]
+# (departure time, arrival time, path), in seconds from midnight of the key's day
+_Sample = tuple[int, Union[int, float], list[tuple[int, int, int]]]
+
+
+class RouteCache:
+    """A least recently used cache of optimal routes between snapped stops.
+
+    Instance Attributes:
+        - capacity: the maximum number of keys kept
+        - bucket: the width of the departure time buckets, in seconds
+        - path: the file the cache is persisted to, or None if it is only kept in memory
+        - hits: the number of lookups answered from the cache
+        - misses: the number of lookups not answered from the cache
+        - evictions: the number of keys discarded to stay within capacity
+
+    Representation Invariants:
+        - self.capacity >= 1
+        - self.bucket >= 1
+        - self.hits >= 0 and self.misses >= 0 and self.evictions >= 0
+    """
+    # Private Instance Attributes:
+    #   - _entries: the samples of each key, least recently used key first
+    #   - _unsaved: the number of routes stored since the cache was last saved
+    #   - _lock: guards _entries, _unsaved and the counters
+    capacity: int
+    bucket: int
+    path: Optional[str]
+    hits: int
+    misses: int
+    evictions: int
+    _entries: OrderedDict[_Key, list[_Sample]]
+    _unsaved: int
+    _lock: threading.Lock
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, bucket: int = DEFAULT_BUCKET,
+                 path: Optional[str] = None) -> None:
+        """Initialize a route cache keeping at most capacity keys, with departure time buckets
+        of the given width. If path is given, the routes saved there for the current database
+        and bucket width are loaded, and the cache is saved there as routes are stored and
+        when the process exits.
+
+        Preconditions:
+            - capacity >= 1
+            - bucket >= 1
+        """
+        self.capacity = capacity
+        self.bucket = bucket
+        self.path = path
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+            atexit.register(self._save_unsaved)
+
+    def lookup(self, starts: list[tuple[int, float]], goals: list[tuple[int, float]], time: int,
+               day: int, engine: str) \
+            -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
+        """Return the cached optimal route found by engine from the start stops to the end
+        stops departing at the given time and day, as a tuple of the path and the time it takes,
+        in the format of ``pathfinding.a_star``. Return None if no cached route is proven
+        optimal.
+
+        starts and goals are lists of (stop_id, walking distance) pairs, as for
+        ``pathfinding.a_star``.
+
+        >>> cache = RouteCache(bucket=600)
+        >>> cache.store([(1, 0.1)], [(2, 0.0)], 100, 1, 'a_star', [(7, 1, 2)], 900)
+        >>> cache.lookup([(1, 0.1)], [(2, 0.0)], 200, 1, 'a_star') is None
+        True
+        >>> cache.store([(1, 0.1)], [(2, 0.0)], 300, 1, 'a_star', [(7, 1, 2)], 700)
+        >>> cache.lookup([(1, 0.1)], [(2, 0.0)], 200, 1, 'a_star')
+        ([(7, 1, 2)], 800)
+        >>> cache.lookup([(1, 0.4)], [(2, 0.0)], 200, 1, 'a_star') is None
+        True
+        """
+        key = self._key(starts, goals, time, day, engine)
+        with self._lock:
+            samples = self._entries.get(key)
+            if samples is not None:
+                self._entries.move_to_end(key)
+                before = max((s for s in samples if s[0] <= time), default=None,
+                             key=lambda s: s[0])
+                after = min((s for s in samples if s[0] >= time), default=None,
+                            key=lambda s: s[0])
+                if before is not None and after is not None \
+                        and (before[1] == after[1] or after[1] - before[1] <= _ARRIVAL_TOLERANCE):
+                    self.hits += 1
+                    return (after[2], after[1] - time)
+            self.misses += 1
+            return None
+
+    def store(self, starts: list[tuple[int, float]], goals: list[tuple[int, float]], time: int,
+              day: int, engine: str, path: list[tuple[int, int, int]],
+              travel_time: Union[int, float]) -> None:
+        """Add the optimal route found by engine from the start stops to the end stops
+        departing at the given time and day, which takes travel_time seconds, to the cache.
+
+        starts and goals are given as for lookup.
+
+        Preconditions:
+            - path is an optimal route for the departure time, not an approximate one
+        """
+        key = self._key(starts, goals, time, day, engine)
+        with self._lock:
+            samples = self._entries.setdefault(key, [])
+            self._entries.move_to_end(key)
+            samples[:] = [s for s in samples if s[0] != time]
+            samples.append((time, time + travel_time, path))
+            if len(samples) > MAX_SAMPLES:
+                samples.pop(0)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._unsaved += 1
+            save = self.path is not None and self._unsaved >= SAVE_INTERVAL
+        if save:
+            self.save()
+
+    def hit_rate(self) -> float:
+        """Return the fraction of lookups answered from the cache, or 0.0 if there were none.
+
+        >>> cache = RouteCache()
+        >>> cache.lookup([(1, 0.0)], [(2, 0.0)], 100, 1, 'a_star') is None
+        True
+        >>> cache.hit_rate()
+        0.0
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self) -> dict[str, Any]:
+        """Return a JSON-serializable dictionary of the cache's size and counters, with the keys
+        keys, capacity, hits, misses, evictions and hit_rate.
+        """
+        with self._lock:
+            return {'keys': len(self._entries),
+                    'capacity': self.capacity,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hit_rate()}
+
+    def clear(self) -> None:
+        """Discard every cached route. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def save(self) -> None:
+        """Write the cache to its file, if it has one, tagged with the database fingerprint.
+
+        As with snapshots, the file is written to a temporary file first and then moved into
+        place. A cache that cannot be written is logged and kept in memory only.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            data = {'version': CACHE_VERSION,
+                    'fingerprint': data_interface.database_fingerprint(DB_FILE).hex(),
+                    'bucket': self.bucket,
+                    'entries': [[list(key[0]), list(key[1]), key[2], key[3], key[4],
+                                 list(samples)]
+                                for key, samples in self._entries.items()]}
+            self._unsaved = 0
+
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, mode='w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.getLogger(__name__).warning('Could not write route cache: %s', e)
+
+    def _save_unsaved(self) -> None:
+        """Save the cache if routes were stored since it was last saved."""
+        if self._unsaved > 0:
+            self.save()
+
+    def _load(self) -> None:
+        """Load the routes saved in the cache's file, unless it is missing, or was written for a
+        different database, format version or bucket width.
+        """
+        logger = logging.getLogger(__name__)
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):  # missing or corrupt file
+            return
+
+        fingerprint = data_interface.database_fingerprint(DB_FILE).hex()
+        if (data.get('version'), data.get('fingerprint'), data.get('bucket')) != \
+                (CACHE_VERSION, fingerprint, self.bucket):
+            logger.info('Route cache "%s" is out of date', self.path)
+            return
+
+        for starts, goals, engine, day, bucket, samples in data['entries'][-self.capacity:]:
+            key = (tuple(tuple(start) for start in starts), tuple(tuple(goal) for goal in goals),
+                   engine, day, bucket)
+            self._entries[key] = \
+                [(time, arrival, [tuple(leg) for leg in path]) for time, arrival, path in samples]
+        logger.info('Loaded %d routes from route cache "%s"', len(self._entries), self.path)
+
+    def _key(self, starts: list[tuple[int, float]], goals: list[tuple[int, float]], time: int,
+             day: int, engine: str) -> _Key:
+        """Return the key of the routes found by engine from the start stops to the end stops
+        departing at the given time and day.
+
+        >>> RouteCache(bucket=600)._key([(2, 0.12345), (1, 0.5)], [(3, 0.0)], 1300, 1, 'csa')
+        (((1, 0.5), (2, 0.123)), ((3, 0.0),), 'csa', 1, 2)
+        """
+        return (tuple(sorted((stop_id, round(walk, WALK_PRECISION)) for stop_id, walk in starts)),
+                tuple(sorted((stop_id, round(walk, WALK_PRECISION)) for stop_id, walk in goals)),
+                engine, day, time // self.bucket)
+
+
+def get_shared_route_cache() -> RouteCache:
+    """Return the RouteCache shared by every caller in this process, persisted to the
+    ``transit.routes`` file next to ``transit.db``. A new cache is loaded if the database
+    changes.
+    """
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _SHARED_ROUTE_CACHE:
+        _SHARED_ROUTE_CACHE.clear()
+        _SHARED_ROUTE_CACHE[fingerprint] = \
+            RouteCache(path=snapshot.snapshot_path(DB_FILE, '.routes'))
+
+    return _SHARED_ROUTE_CACHE[fingerprint]
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['atexit', 'json', 'logging', 'os', 'threading', 'collections', 'typing',
+                          'data_interface', 'snapshot', 'graph'],
+        'allowed-io': ['save', '_load'],
+        'max-line-length': 100,
+        'disable': ['E1136']})
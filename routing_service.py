@@ -0,0 +1,181 @@
+"""TTC Route Planner for Toronto, Ontario -- Routing Service
+
+This module provides the RoutingService class, a pool of worker processes that compute routes
+with ``pathfinding.find_route``. The pool is started once, when the application launches, and
+each worker loads the transit graph, its ``TransitQuery`` and the default cost model (with its
+landmark table) in the pool's initializer. Route requests are then sent to the warm workers over
+the pool's task queue, so a request does not pay for starting a process or loading the graph.
+
+Each request is a RouteRequest, which can be cancelled, and may be given a deadline. By default
+a new request supersedes the previous one: the previous request is cancelled, and stops at its
+next check of its ``pathfinding.CancelToken``, or as soon as it starts if it is still queued.
+
+Typical use:
+
+    with RoutingService() as service:
+        request = service.submit(start_loc, end_loc, time, day, message_queue)
+        ...  # same ('INFO', n) / ('INC', ...) / ('DONE', path) messages as find_route
+        request.cancel()
+
+Message queues passed to a RoutingService must be shareable between processes, such as the
+queues of a ``multiprocessing.Manager``.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import logging
+from multiprocessing import Manager, Pool
+from multiprocessing.pool import AsyncResult
+from queue import Queue
+from typing import Any, Optional
+
+import pathfinding
+from data_interface import get_pool
+from graph import get_shared_graph
+from heuristic import get_default_cost_model
+
+# number of worker processes started by default
+DEFAULT_PROCESSES = 2
+
+
+class RouteRequest:
+    """A route request submitted to a RoutingService.
+
+    Instance Attributes:
+        - token: the token that cancels the request's search
+    """
+    # Private Instance Attributes:
+    #   - _result: the pool's result for the request
+    token: pathfinding.CancelToken
+    _result: AsyncResult
+
+    def __init__(self, token: pathfinding.CancelToken, result: AsyncResult) -> None:
+        """Initialize a new request cancelled by token, with the pool's result for it."""
+        self.token = token
+        self._result = result
+
+    def cancel(self) -> None:
+        """Cancel this request. Does nothing if it is already done."""
+        self.token.cancel()
+
+    def done(self) -> bool:
+        """Return whether this request has finished, including by being cancelled."""
+        return self._result.ready()
+
+    def get(self, timeout: Optional[float] = None) -> list[tuple[int, int, int]]:
+        """Wait for this request to finish and return its path.
+
+        Raises ``pathfinding.SearchCancelled`` if the request was cancelled, TimeoutError if its
+        deadline passed, and ``multiprocessing.TimeoutError`` if it does not finish within
+        timeout seconds.
+        """
+        return self._result.get(timeout)
+
+
+class RoutingService:
+    """A pool of worker processes computing routes, with the graph loaded once per worker.
+
+    Instance Attributes:
+        - processes: the number of worker processes
+
+    Representation Invariants:
+        - self.processes >= 1
+    """
+    # Private Instance Attributes:
+    #   - _pool: the worker processes, or None once the service is closed
+    #   - _manager: multiprocessing manager owning the requests' cancel flags. Started when
+    #     the first request is submitted.
+    #   - _current: the last request submitted that supersedes earlier ones, if any
+    processes: int
+    _pool: Any
+    _manager: Optional[Any]
+    _current: Optional[RouteRequest]
+
+    def __init__(self, processes: int = DEFAULT_PROCESSES) -> None:
+        """Start a routing service with the given number of worker processes.
+
+        Each worker loads the graph and connects to the database as it starts, in the
+        background, so this returns before the workers are warm.
+
+        Preconditions:
+            - processes >= 1
+        """
+        self.processes = processes
+        self._pool = Pool(processes, initializer=_init_worker)
+        self._manager = None
+        self._current = None
+
+    def __enter__(self) -> RoutingService:
+        """Return this service for use in a ``with`` statement."""
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Close this service when leaving a ``with`` statement."""
+        self.close()
+
+    def submit(self, start_loc: tuple[float, float], end_loc: tuple[float, float], time: int,
+               day: int, message_queue: Queue, deadline: Optional[float] = None,
+               supersede: bool = True, **options: Any) -> RouteRequest:
+        """Queue a request for the quickest transit route on the next free worker, and return
+        it.
+
+        Arguments and options are the same as for ``pathfinding.find_route``, which puts its
+        messages on message_queue as usual. deadline is the deadline of the request's
+        CancelToken, in seconds since the epoch. If supersede is True, the last request
+        submitted with supersede True is cancelled.
+
+        Raises ValueError if the service is closed.
+        """
+        if self._pool is None:
+            raise ValueError('Routing service is closed.')
+        if self._manager is None:
+            self._manager = Manager()
+        if supersede and self._current is not None:
+            self._current.cancel()
+
+        token = pathfinding.CancelToken(deadline, self._manager.Event())
+        result = self._pool.apply_async(pathfinding.find_route,
+                                        (start_loc, end_loc, time, day, message_queue),
+                                        dict(options, cancel=token))
+        request = RouteRequest(token, result)
+        if supersede:
+            self._current = request
+        return request
+
+    def close(self) -> None:
+        """Stop the worker processes, abandoning any requests still running or queued."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+        self._current = None
+
+
+def _init_worker() -> None:
+    """Load the data every route search in this worker process uses."""
+    logger = logging.getLogger(__name__)
+    graph = get_shared_graph()
+    get_pool().local()
+    get_default_cost_model()
+    logger.info('Routing worker ready with %d stops', len(graph))
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['logging', 'multiprocessing', 'multiprocessing.pool', 'queue',
+                          'typing', 'pathfinding', 'data_interface', 'graph', 'heuristic'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
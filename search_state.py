@@ -0,0 +1,255 @@
+"""TTC Route Planner for Toronto, Ontario -- Search State
+
+This module provides the SearchState class, which stores the per-stop labels of a pathfinding
+search, and the set of stops it has settled, in preallocated flat arrays indexed by the dense stop
+indices of a ``graph.CSRGraph``.
+
+Labels are invalidated between searches by incrementing a generation counter instead of
+clearing the arrays, so starting a new search takes constant time and allocates nothing.
+``get_search_state`` keeps one SearchState per thread for reuse by back-to-back searches.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+import threading
+from array import array
+from math import inf
+from typing import Union
+
+from graph import CSRGraph
+
+# largest generation that fits in the stamp array's typecode before it has to be cleared
+_MAX_GENERATION = 2 ** 32 - 1
+
+
+class SearchState:
+    """The labels of every stop during a single search.
+
+    A stop is labelled once the search has found a path to it. A label is only valid if the stop
+    was stamped with the current generation; otherwise the stop is unlabelled, with an infinite
+    g-score.
+
+    Instance Attributes:
+        - size: the number of stops labels are stored for
+        - generation: the generation of the current search
+
+    Representation Invariants:
+        - self.size >= 0
+        - 1 <= self.generation <= _MAX_GENERATION
+    """
+    # Private Instance Attributes:
+    #   - _g_score: cost of the cheapest known path from the start to each stop
+    #   - _pred: index of the previous stop on the cheapest known path, or -1 for a start stop
+    #   - _arrival: time of arrival at each stop, in seconds after midnight of _day
+    #   - _day: day of arrival at each stop
+    #   - _trip: trip_id of the trip taken to each stop, or 0 for walking
+    #   - _stamp: generation in which each stop was last labelled
+    #   - _settled: generation in which each stop was last settled
+    size: int
+    generation: int
+    _g_score: array
+    _pred: array
+    _arrival: array
+    _day: array
+    _trip: array
+    _stamp: array
+    _settled: array
+
+    def __init__(self, size: int) -> None:
+        """Initialize a new SearchState for size stops, with every stop unlabelled.
+
+        Preconditions:
+            - size >= 0
+        """
+        self.size = size
+        self.generation = 1
+        self._g_score = array('d', [inf]) * size
+        self._pred = array('q', [-1]) * size
+        self._arrival = array('d', [0]) * size
+        self._day = array('b', [0]) * size
+        self._trip = array('q', [0]) * size
+        self._stamp = array('I', [0]) * size
+        self._settled = array('I', [0]) * size
+
+    def reset(self) -> None:
+        """Unlabel and unsettle every stop, in preparation for a new search.
+
+        >>> state = SearchState(3)
+        >>> state.set_label(1, 10.0, -1, 0, 0, 1)
+        >>> state.is_labelled(1)
+        True
+        >>> state.reset()
+        >>> state.is_labelled(1), state.get_g(1)
+        (False, inf)
+        """
+        if self.generation == _MAX_GENERATION:  # stamps would overflow, so clear them instead
+            self._stamp = array('I', [0]) * self.size
+            self._settled = array('I', [0]) * self.size
+            self.generation = 0
+        self.generation += 1
+
+    def is_labelled(self, index: int) -> bool:
+        """Return whether the stop with the given index has been labelled in this search."""
+        return self._stamp[index] == self.generation
+
+    def is_settled(self, index: int) -> bool:
+        """Return whether the stop with the given index has been settled in this search.
+
+        >>> state = SearchState(2)
+        >>> state.settle(0)
+        >>> state.is_settled(0), state.is_settled(1)
+        (True, False)
+        """
+        return self._settled[index] == self.generation
+
+    def settle(self, index: int) -> None:
+        """Mark the stop with the given index as settled: its label is final, and the search has
+        expanded it.
+        """
+        self._settled[index] = self.generation
+
+    def unsettle(self, index: int) -> None:
+        """Mark the stop with the given index as not settled, so that the search expands it
+        again. Its label is kept.
+        """
+        self._settled[index] = 0
+
+    def unlabel(self, index: int) -> None:
+        """Unlabel and unsettle the stop with the given index.
+
+        >>> state = SearchState(2)
+        >>> state.set_label(0, 10.0, -1, 0, 0, 1)
+        >>> state.settle(0)
+        >>> state.unlabel(0)
+        >>> state.is_labelled(0), state.is_settled(0), state.get_g(0)
+        (False, False, inf)
+        """
+        self._stamp[index] = 0
+        self._settled[index] = 0
+
+    def has_predecessor(self, index: int) -> bool:
+        """Return whether the stop with the given index was reached from another stop, i.e.
+        whether it is labelled and is not a start stop.
+        """
+        return self._stamp[index] == self.generation and self._pred[index] != -1
+
+    def get_g(self, index: int) -> float:
+        """Return the g-score of the stop with the given index, or inf if it is unlabelled."""
+        if self._stamp[index] == self.generation:
+            return self._g_score[index]
+        return inf
+
+    def get_arrival(self, index: int) -> tuple[Union[int, float], int]:
+        """Return the (arrival time, day) label of the stop with the given index.
+
+        Preconditions:
+            - self.is_labelled(index)
+        """
+        return (self._arrival[index], self._day[index])
+
+    def get_label(self, index: int) -> tuple[int, int, Union[int, float], int]:
+        """Return the (trip_id, predecessor index, arrival time, day) label of the stop with the
+        given index.
+
+        Preconditions:
+            - self.is_labelled(index)
+        """
+        return (self._trip[index], self._pred[index], self._arrival[index], self._day[index])
+
+    def set_label(self, index: int, g_score: float, pred: int, trip_id: int,
+                  arrival: Union[int, float], day: int) -> None:
+        """Label the stop with the given index.
+
+        pred is -1 for a start stop, and trip_id is 0 if the stop was reached by walking.
+        """
+        self._g_score[index] = g_score
+        self._pred[index] = pred
+        self._trip[index] = trip_id
+        self._arrival[index] = arrival
+        self._day[index] = int(day)
+        self._stamp[index] = self.generation
+
+    def path_bin(self, graph: CSRGraph) -> '_PathBin':
+        """Return a read-only view of the labels in this search in the format used by
+        ``pathfinding.construct_filtered_path``.
+
+        graph is the graph whose stop indices this search uses.
+        """
+        return _PathBin(self, graph)
+
+
+class _PathBin:
+    """A read-only mapping from stop_ids to the path information of a SearchState.
+
+    For a stop_id n reached from another stop, ``path_bin[n]`` is the tuple
+    (trip_id, start stop_id, end stop_id, time arrived, day). Start stops and unlabelled stops
+    are not in the mapping.
+    """
+    # Private Instance Attributes:
+    #   - _state: the search state viewed
+    #   - _graph: the graph whose stop indices the search uses
+    _state: SearchState
+    _graph: CSRGraph
+
+    def __init__(self, state: SearchState, graph: CSRGraph) -> None:
+        """Initialize a new view of the labels in state."""
+        self._state = state
+        self._graph = graph
+
+    def _find(self, stop_id: int) -> int:
+        """Return the index of stop_id if it has a predecessor in the search, or -1 otherwise."""
+        try:
+            i = self._graph.index_of(stop_id)
+        except KeyError:
+            return -1
+        return i if self._state.has_predecessor(i) else -1
+
+    def __contains__(self, stop_id: int) -> bool:
+        """Return whether stop_id was reached from another stop in the search."""
+        return self._find(stop_id) != -1
+
+    def __getitem__(self, stop_id: int) -> tuple[int, int, int, Union[int, float], int]:
+        """Return the path information for stop_id.
+
+        Raise a KeyError if stop_id was not reached from another stop in the search.
+        """
+        i = self._find(stop_id)
+        if i == -1:
+            raise KeyError(stop_id)
+        trip_id, pred, arrival, day = self._state.get_label(i)
+        return (trip_id, self._graph.stop_ids[pred], stop_id, arrival, day)
+
+
+# search states reused by the searches run in each thread
+_THREAD_STATES = threading.local()
+
+
+def get_search_state(size: int) -> SearchState:
+    """Return a reset SearchState for size stops, reusing the calling thread's previous
+    SearchState when it has the same size.
+
+    A SearchState returned by this function is only valid until the next call to this function
+    in the same thread.
+    """
+    state = getattr(_THREAD_STATES, 'state', None)
+    if state is None or state.size != size:
+        state = SearchState(size)
+        _THREAD_STATES.state = state
+    else:
+        state.reset()
+    return state
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['threading', 'array', 'math', 'typing', 'graph'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
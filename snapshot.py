@@ -0,0 +1,135 @@
+"""TTC Route Planner for Toronto, Ontario -- Binary Snapshots
+
+This module provides the functions for persisting flat arrays derived from the ``transit.db``
+database (such as the CSR graph arrays) in a versioned binary file stored next to the database.
+
+A snapshot file contains:
+    - a header with a magic number, the kind and version of the data, and the fingerprint
+      (see ``data_interface.database_fingerprint``) of the database the data was derived from
+    - a table with the typecode and length of each array
+    - the raw array data, in native byte order, each array starting at an 8 byte boundary
+
+Snapshots are read by memory-mapping the file, so loading one takes constant time and the
+returned arrays share the operating system's page cache between every process that reads the
+same file.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Optional, Sequence
+
+# magic number, kind, version, byte order, fingerprint, number of arrays
+_HEADER = struct.Struct('<4s4sIc20sI')
+# typecode, array length
+_ARRAY_ENTRY = struct.Struct('<c7xQ')
+_MAGIC = b'TTCS'
+_ALIGNMENT = 8
+
+
+def snapshot_path(db_file: str, extension: str) -> str:
+    """Return the path of the snapshot file with the given extension stored next to db_file.
+
+    >>> snapshot_path('transit.db', '.graph')
+    'transit.graph'
+    """
+    return os.path.splitext(db_file)[0] + extension
+
+
+def _align(offset: int) -> int:
+    """Return the smallest multiple of _ALIGNMENT that is at least offset.
+
+    >>> _align(0), _align(1), _align(8), _align(9)
+    (0, 8, 8, 16)
+    """
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_snapshot(path: str, kind: bytes, version: int, fingerprint: bytes,
+                   arrays: Sequence[array]) -> None:
+    """Write arrays to a snapshot file at path.
+
+    The file is written to a temporary file first and then moved into place, so processes
+    reading the snapshot never see a partially written file.
+
+    Preconditions:
+        - len(kind) == 4
+        - len(fingerprint) == 20
+    """
+    header = _HEADER.pack(_MAGIC, kind, version, sys.byteorder[0].encode(), fingerprint,
+                          len(arrays))
+    table = b''.join(_ARRAY_ENTRY.pack(arr.typecode.encode(), len(arr)) for arr in arrays)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, mode='wb') as f:
+        offset = f.write(header) + f.write(table)
+        for arr in arrays:
+            offset += f.write(b'\0' * (_align(offset) - offset))
+            offset += f.write(arr.tobytes())
+    os.replace(tmp_path, path)
+
+    logging.getLogger(__name__).info('Wrote snapshot "%s"', path)
+
+
+def read_snapshot(path: str, kind: bytes, version: int,
+                  fingerprint: bytes) -> Optional[list[memoryview]]:
+    """Return memoryviews of the arrays in the snapshot file at path, in the order they were
+    written.
+
+    Return None if the file does not exist, or was written for different data: a different
+    kind, version or database fingerprint, or a machine with a different byte order.
+
+    The memoryviews are backed by a read-only memory map of the file.
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        with open(path, mode='rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # missing or empty file
+        return None
+
+    if len(buffer) < _HEADER.size:
+        return None
+    magic, file_kind, file_version, byte_order, file_fingerprint, num_arrays = \
+        _HEADER.unpack_from(buffer)
+    if (magic, file_kind, file_version, byte_order, file_fingerprint) != \
+            (_MAGIC, kind, version, sys.byteorder[0].encode(), fingerprint):
+        logger.info('Snapshot "%s" is out of date', path)
+        return None
+
+    view = memoryview(buffer)
+    offset = _HEADER.size + num_arrays * _ARRAY_ENTRY.size
+    arrays = []
+    for i in range(num_arrays):
+        typecode, length = _ARRAY_ENTRY.unpack_from(buffer, _HEADER.size + i * _ARRAY_ENTRY.size)
+        typecode = typecode.decode()
+        offset = _align(offset)
+        end = offset + length * array(typecode).itemsize
+        if end > len(buffer):
+            logger.warning('Snapshot "%s" is truncated', path)
+            return None
+        arrays.append(view[offset:end].cast(typecode))
+        offset = end
+
+    logger.debug('Read snapshot "%s"', path)
+    return arrays
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['logging', 'mmap', 'os', 'struct', 'sys', 'array', 'typing'],
+        'allowed-io': ['write_snapshot', 'read_snapshot'],
+        'max-line-length': 100,
+        'disable': ['E1136']})
@@ -0,0 +1,412 @@
+"""TTC Route Planner for Toronto, Ontario -- Timetable
+
+This module provides the Timetable class, a flat-array representation of the whole week's
+schedule used by the timetable-based routing engines (such as ``raptor``), and the functions
+for building it from the ``edges``, ``trips`` and ``calendar`` tables.
+
+Times in a Timetable are given in seconds after Monday 00:00 of the current week. Each trip is
+expanded into one trip instance for every day its service runs, and instances that depart after
+the end of the week are moved back by a week, so that every instance departs its first stop
+within ``[0, WEEK)``. Instances are grouped into route patterns: sequences of stops served
+by trips that never overtake each other.
+
+Stops are identified by their index in the transit graph (see ``graph.CSRGraph``). Walking
+footpaths connect every pair of stops within WALK_RADIUS kilometres of each other.
+
+The timetable also stores every elementary connection (one trip instance travelling between two
+consecutive stops) in an array sorted by departure time, for the connection scan engine.
+
+Like the graph, the timetable is cached in a memory-mapped snapshot file next to the database.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+from array import array
+from bisect import bisect_left
+from typing import Optional, Sequence
+
+import data_interface
+import snapshot
+from graph import DB_FILE, CSRGraph, get_shared_graph
+from util import distance
+
+# number of seconds in a day and a week
+DAY = 86400
+WEEK = 7 * DAY
+
+# walking speed in km/s, and the maximum length of a walking footpath in km
+WALK_SPEED = 0.0014
+WALK_RADIUS = 0.05
+
+# format version of the timetable snapshot file. Increment whenever the stored arrays change.
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_KIND = b'TTBL'
+
+# timetable returned by get_shared_timetable, keyed by the database fingerprint
+_SHARED_TIMETABLE = {}
+
+
+class Timetable:
+    """The week's schedule stored in flat arrays.
+
+    For a pattern p with n stops and m trip instances:
+        - its stops are ``pattern_stops[pattern_stop_offsets[p]:pattern_stop_offsets[p + 1]]``
+        - its instances are numbered ``pattern_trip_offsets[p]`` to
+          ``pattern_trip_offsets[p + 1] - 1``, in increasing order of departure, and
+          ``trip_ids`` holds the trip_id of each instance
+        - the arrival and departure times of its k-th instance at its i-th stop are
+          ``arr_times[pattern_time_offsets[p] + i * m + k]`` (and likewise for dep_times), so
+          the departures of all instances from one stop are contiguous and sorted
+
+    The patterns through stop s are given as (pattern, position of s in the pattern) pairs by
+    ``stop_patterns[j], stop_pattern_positions[j]`` for ``stop_pattern_offsets[s] <= j <
+    stop_pattern_offsets[s + 1]``. The footpaths from stop s are given likewise by
+    ``foot_targets[j], foot_times[j]`` for ``foot_offsets[s] <= j < foot_offsets[s + 1]``,
+    where foot_times holds walking times in seconds.
+
+    Connection c departs stop ``conn_from[c]`` at ``conn_dep[c]`` and arrives at stop
+    ``conn_to[c]`` at ``conn_arr[c]``, travelling on the trip instance ``conn_trip[c]`` (an index
+    into trip_ids) from the stop at position ``conn_pos[c]`` of its pattern. Connection times are
+    moved back by whole weeks so that every connection departs within ``[0, WEEK)``, and
+    connections are sorted by departure time.
+
+    Instance Attributes:
+        - graph: the transit graph whose stop indices this timetable uses
+        - pattern_stop_offsets, pattern_stops, pattern_trip_offsets, trip_ids,
+          pattern_time_offsets, arr_times, dep_times, stop_pattern_offsets, stop_patterns,
+          stop_pattern_positions, foot_offsets, foot_targets, foot_times, conn_dep, conn_arr,
+          conn_from, conn_to, conn_trip, conn_pos: see above
+
+    Representation Invariants:
+        - len(self.stop_pattern_offsets) == len(self.foot_offsets) == len(self.graph) + 1
+        - all(0 <= self.dep_times[self.pattern_time_offsets[p] + k] < WEEK
+              for p in range(self.num_patterns())
+              for k in range(self.pattern_trip_offsets[p + 1] - self.pattern_trip_offsets[p]))
+    """
+    graph: CSRGraph
+    pattern_stop_offsets: Sequence[int]
+    pattern_stops: Sequence[int]
+    pattern_trip_offsets: Sequence[int]
+    trip_ids: Sequence[int]
+    pattern_time_offsets: Sequence[int]
+    arr_times: Sequence[int]
+    dep_times: Sequence[int]
+    stop_pattern_offsets: Sequence[int]
+    stop_patterns: Sequence[int]
+    stop_pattern_positions: Sequence[int]
+    foot_offsets: Sequence[int]
+    foot_targets: Sequence[int]
+    foot_times: Sequence[float]
+    conn_dep: Sequence[int]
+    conn_arr: Sequence[int]
+    conn_from: Sequence[int]
+    conn_to: Sequence[int]
+    conn_trip: Sequence[int]
+    conn_pos: Sequence[int]
+
+    def __init__(self, graph: CSRGraph, arrays: Sequence[Sequence]) -> None:
+        """Initialize a timetable for graph from its arrays, given in the order returned by
+        ``to_arrays``.
+        """
+        self.graph = graph
+        (self.pattern_stop_offsets, self.pattern_stops, self.pattern_trip_offsets, self.trip_ids,
+         self.pattern_time_offsets, self.arr_times, self.dep_times, self.stop_pattern_offsets,
+         self.stop_patterns, self.stop_pattern_positions, self.foot_offsets, self.foot_targets,
+         self.foot_times, self.conn_dep, self.conn_arr, self.conn_from, self.conn_to,
+         self.conn_trip, self.conn_pos) = arrays
+
+    def to_arrays(self) -> list[Sequence]:
+        """Return the arrays of this timetable, in the order accepted by the initializer."""
+        return [self.pattern_stop_offsets, self.pattern_stops, self.pattern_trip_offsets,
+                self.trip_ids, self.pattern_time_offsets, self.arr_times, self.dep_times,
+                self.stop_pattern_offsets, self.stop_patterns, self.stop_pattern_positions,
+                self.foot_offsets, self.foot_targets, self.foot_times, self.conn_dep,
+                self.conn_arr, self.conn_from, self.conn_to, self.conn_trip, self.conn_pos]
+
+    def num_patterns(self) -> int:
+        """Return the number of route patterns in this timetable."""
+        return len(self.pattern_stop_offsets) - 1
+
+    def num_trips(self, pattern: int) -> int:
+        """Return the number of trip instances in the given pattern."""
+        return self.pattern_trip_offsets[pattern + 1] - self.pattern_trip_offsets[pattern]
+
+    def pattern_length(self, pattern: int) -> int:
+        """Return the number of stops in the given pattern."""
+        return self.pattern_stop_offsets[pattern + 1] - self.pattern_stop_offsets[pattern]
+
+    def earliest_trip(self, pattern: int, position: int,
+                      time: float) -> Optional[tuple[int, int]]:
+        """Return the earliest trip instance of the pattern departing from the stop at the given
+        position at or after time, as a tuple (k, offset), where k is the number of the instance
+        within the pattern and offset is a multiple of WEEK to add to its times.
+
+        Any week may be searched: time is not restricted to the current week. Return None if the
+        pattern has no trip instances.
+        """
+        m = self.num_trips(pattern)
+        if m == 0:
+            return None
+        lo = self.pattern_time_offsets[pattern] + position * m
+        hi = lo + m
+
+        base = math.floor(time / WEEK) * WEEK
+        best = None
+        # departures at later stops may fall after the end of the week, so instances from the
+        # previous week's schedule can still depart in this week
+        for offset in (base - WEEK, base, base + WEEK):
+            i = bisect_left(self.dep_times, time - offset, lo, hi)
+            if i < hi and (best is None or self.dep_times[i] + offset
+                           < self.dep_times[lo + best[0]] + best[1]):
+                best = (i - lo, offset)
+        return best
+
+    def trip_time(self, pattern: int, k: int, position: int, departure: bool = True) -> int:
+        """Return the departure (or arrival, if departure is False) time of the k-th instance of
+        the pattern at the stop at the given position, without any week offset.
+        """
+        i = self.pattern_time_offsets[pattern] + position * self.num_trips(pattern) + k
+        return self.dep_times[i] if departure else self.arr_times[i]
+
+    def trip_id(self, pattern: int, k: int) -> int:
+        """Return the trip_id of the k-th instance of the given pattern."""
+        return self.trip_ids[self.pattern_trip_offsets[pattern] + k]
+
+    def num_connections(self) -> int:
+        """Return the number of elementary connections in this timetable."""
+        return len(self.conn_dep)
+
+    def first_connection(self, time: float) -> int:
+        """Return the index of the first connection departing at or after time.
+
+        Preconditions:
+            - 0 <= time < WEEK
+        """
+        return bisect_left(self.conn_dep, time)
+
+
+def load_timetable(use_snapshot: bool = True) -> Timetable:
+    """Return the Timetable for the transit database.
+
+    The timetable is built the first time it is loaded, and its arrays are written to the
+    ``transit.timetable`` snapshot file next to ``transit.db``. Later calls memory-map the
+    snapshot, until the database changes. If use_snapshot is False, the timetable is always built
+    from the database and no snapshot is read or written.
+    """
+    graph = get_shared_graph()
+    path = snapshot.snapshot_path(DB_FILE, '.timetable')
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if use_snapshot:
+        arrays = snapshot.read_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint)
+        if arrays is not None:
+            return Timetable(graph, arrays)
+
+    timetable = build_timetable(graph)
+
+    if use_snapshot:
+        try:
+            snapshot.write_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint,
+                                    timetable.to_arrays())
+        except OSError as e:
+            logging.getLogger(__name__).warning('Could not write timetable snapshot: %s', e)
+
+    return timetable
+
+
+def get_shared_timetable() -> Timetable:
+    """Return the Timetable shared by every caller in this process, loading it on first use.
+
+    As with ``graph.get_shared_graph``, the timetable's arrays are memory-mapped from its
+    snapshot file and shared between processes. The timetable is reloaded if the database
+    changes.
+    """
+    graph = get_shared_graph()
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _SHARED_TIMETABLE or _SHARED_TIMETABLE[fingerprint].graph is not graph:
+        _SHARED_TIMETABLE.clear()
+        _SHARED_TIMETABLE[fingerprint] = load_timetable()
+
+    return _SHARED_TIMETABLE[fingerprint]
+
+
+def build_timetable(graph: CSRGraph) -> Timetable:
+    """Return a new Timetable for graph, built from the transit database.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Building timetable')
+
+    # trip instances grouped by stop sequence: each maps to a list of (times, trip_id), where
+    # times is a list of (arrival, departure) pairs
+    sequences = {}
+    with data_interface.get_pool(DB_FILE).connection() as query:
+        for trip_id, stops, times, days in query.get_trip_schedules():
+            key = tuple(graph.index_of(stop_id) for stop_id in stops)
+            instances = sequences.setdefault(key, [])
+            for day in days:
+                offset = (day - 1) * DAY
+                if times[0][1] + offset >= WEEK:  # departs after the end of the week
+                    offset -= WEEK
+                instances.append(([(arr + offset, dep + offset) for arr, dep in times], trip_id))
+
+    patterns = []
+    for stops, instances in sequences.items():
+        instances.sort()
+        patterns.extend((stops, group) for group in _split_overtaking(instances))
+
+    arrays = [array('q', [0]), array('i'), array('q', [0]), array('q'), array('q'),
+              array('i'), array('i')]
+    (pattern_stop_offsets, pattern_stops, pattern_trip_offsets, trip_ids, pattern_time_offsets,
+     arr_times, dep_times) = arrays
+    stop_pattern_lists = [[] for _ in range(len(graph))]
+
+    for p, (stops, instances) in enumerate(patterns):
+        for position, stop in enumerate(stops):
+            stop_pattern_lists[stop].append((p, position))
+        pattern_stops.extend(stops)
+        pattern_stop_offsets.append(len(pattern_stops))
+        trip_ids.extend(trip_id for _, trip_id in instances)
+        pattern_trip_offsets.append(len(trip_ids))
+        pattern_time_offsets.append(len(arr_times))
+        for position in range(len(stops)):
+            arr_times.extend(times[position][0] for times, _ in instances)
+            dep_times.extend(times[position][1] for times, _ in instances)
+
+    stop_pattern_offsets = array('q', [0])
+    stop_patterns = array('i')
+    stop_pattern_positions = array('i')
+    for pattern_list in stop_pattern_lists:
+        stop_patterns.extend(p for p, _ in pattern_list)
+        stop_pattern_positions.extend(position for _, position in pattern_list)
+        stop_pattern_offsets.append(len(stop_patterns))
+
+    foot_offsets, foot_targets, foot_times = compute_footpaths(graph)
+
+    timetable = Timetable(graph, arrays + [stop_pattern_offsets, stop_patterns,
+                                           stop_pattern_positions, foot_offsets, foot_targets,
+                                           foot_times] + [array('i')] * 6)
+    (timetable.conn_dep, timetable.conn_arr, timetable.conn_from, timetable.conn_to,
+     timetable.conn_trip, timetable.conn_pos) = compute_connections(timetable)
+
+    logger.info('Built timetable with %d patterns, %d trip instances and %d connections',
+                len(patterns), len(trip_ids), timetable.num_connections())
+    return timetable
+
+
+def _split_overtaking(instances: list[tuple[list[tuple[int, int]], int]]) \
+        -> list[list[tuple[list[tuple[int, int]], int]]]:
+    """Split trip instances with the same stops into groups where no instance overtakes another,
+    i.e. where every instance arrives at and departs from each stop no earlier than the
+    instances before it.
+
+    Preconditions:
+        - instances is sorted in increasing order of departure from the first stop
+
+    >>> a, b, c = ([(0, 0), (10, 10)], 1), ([(5, 5), (8, 8)], 2), ([(6, 6), (20, 20)], 3)
+    >>> _split_overtaking([a, b, c]) == [[a, c], [b]]
+    True
+    """
+    groups = []
+    for instance in instances:
+        for group in groups:
+            if all(prev[0] <= curr[0] and prev[1] <= curr[1]
+                   for prev, curr in zip(group[-1][0], instance[0])):
+                group.append(instance)
+                break
+        else:
+            groups.append([instance])
+    return groups
+
+
+def compute_connections(timetable: Timetable) -> tuple[array, array, array, array, array, array]:
+    """Return the elementary connections of the trip instances in timetable, as the arrays
+    (conn_dep, conn_arr, conn_from, conn_to, conn_trip, conn_pos) sorted by departure time.
+
+    Connections are sorted with a counting sort over departure seconds, which is stable, so
+    connections of one trip instance departing at the same time stay in the order of its stops.
+    """
+    unsorted = [array('i') for _ in range(6)]
+    dep, arr, from_stop, to_stop, trip, pos = unsorted
+    counts = array('q', [0]) * (WEEK + 1)
+
+    for p in range(timetable.num_patterns()):
+        stops = timetable.pattern_stops[timetable.pattern_stop_offsets[p]:
+                                        timetable.pattern_stop_offsets[p + 1]]
+        for k in range(timetable.num_trips(p)):
+            for i in range(len(stops) - 1):
+                departure = timetable.trip_time(p, k, i)
+                shift = (departure // WEEK) * WEEK
+                dep.append(departure - shift)
+                arr.append(timetable.trip_time(p, k, i + 1, departure=False) - shift)
+                from_stop.append(stops[i])
+                to_stop.append(stops[i + 1])
+                trip.append(timetable.pattern_trip_offsets[p] + k)
+                pos.append(i)
+                counts[departure - shift + 1] += 1
+
+    for t in range(WEEK):
+        counts[t + 1] += counts[t]
+
+    order = array('q', [0]) * len(dep)
+    for c, departure in enumerate(dep):
+        order[counts[departure]] = c
+        counts[departure] += 1
+
+    return tuple(array('i', (column[c] for c in order)) for column in unsorted)
+
+
+def compute_footpaths(graph: CSRGraph) -> tuple[array, array, array]:
+    """Return the walking footpaths between the stops of graph, as CSR arrays
+    (foot_offsets, foot_targets, foot_times).
+
+    A footpath connects every pair of distinct stops within WALK_RADIUS kilometres of each
+    other, and takes their great-circle distance divided by WALK_SPEED seconds to walk. Stops
+    are bucketed into a grid so that only nearby stops are compared.
+    """
+    # grid cells are at least WALK_RADIUS wide in both directions at Toronto's latitude
+    cell_lat = WALK_RADIUS / 111
+    cell_lon = WALK_RADIUS / 80
+    cells = {}
+    for i in range(len(graph)):
+        key = (math.floor(graph.lats[i] / cell_lat), math.floor(graph.lons[i] / cell_lon))
+        cells.setdefault(key, []).append(i)
+
+    foot_offsets = array('q', [0])
+    foot_targets = array('i')
+    foot_times = array('d')
+    for i in range(len(graph)):
+        location = graph.location_of(i)
+        row = math.floor(location[0] / cell_lat)
+        col = math.floor(location[1] / cell_lon)
+        footpaths = []
+        for key in ((r, c) for r in range(row - 1, row + 2) for c in range(col - 1, col + 2)):
+            for j in cells.get(key, []):
+                if j != i and (d := distance(location, graph.location_of(j))) <= WALK_RADIUS:
+                    footpaths.append((j, d / WALK_SPEED))
+        footpaths.sort()
+        foot_targets.extend(j for j, _ in footpaths)
+        foot_times.extend(t for _, t in footpaths)
+        foot_offsets.append(len(foot_targets))
+
+    return (foot_offsets, foot_targets, foot_times)
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['logging', 'math', 'array', 'bisect', 'typing', 'data_interface',
+                          'snapshot', 'graph', 'util'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})
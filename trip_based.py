@@ -0,0 +1,428 @@
+"""TTC Route Planner for Toronto, Ontario -- Trip-Based Routing
+
+This module provides an implementation of trip-based public transit routing (Witt, 2015) over a
+``timetable.Timetable``, as an alternative routing engine to the A* search in ``pathfinding``.
+
+Trip-based routing moves the work of finding transfers out of query time. A preprocessing step
+computes, for every stop event (a trip instance arriving at one of its stops), the trips that can
+be caught from it by staying at the stop or walking a single footpath: the earliest trip instance
+of each route pattern through the stops nearby. Transfers that never lead to an earlier arrival
+at any stop than staying on the trip, or than the transfers kept from the same trip, are pruned.
+The resulting transfer set is cached in a memory-mapped snapshot file next to the database, like
+the graph and the timetable.
+
+A query is then a breadth-first search over trip segments: the stops of a trip instance between
+the stop it was boarded at and the first stop already reached on it (or on an earlier instance of
+the same pattern). Round n of the search scans the segments reached with n transfers, and
+enqueues the segments reached through their precomputed transfers for the next round. No database
+queries are made, and no timetable lookups are needed after the first round.
+
+This file is Copyright (c) 2021 Anna Cho, Charles Wong, Grace Tian, Raymond Li
+"""
+
+from __future__ import annotations
+
+import logging
+from array import array
+from math import inf
+from typing import Optional, Sequence, Union
+
+import data_interface
+import snapshot
+from graph import DB_FILE
+from timetable import WEEK, Timetable, get_shared_timetable
+
+# format version of the transfer set snapshot file. Increment whenever the stored arrays or the
+# way transfers are computed change.
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_KIND = b'TRFS'
+
+# transfer set returned by get_shared_transfers, keyed by the database fingerprint
+_SHARED_TRANSFERS = {}
+
+
+class TransferSet:
+    """The precomputed transfers between the trip instances of a timetable.
+
+    Stop events are numbered like the times of the timetable: the arrival of the k-th instance of
+    pattern p at the stop at position i of the pattern is stop event
+    ``timetable.pattern_time_offsets[p] + i * timetable.num_trips(p) + k``.
+
+    The transfers from stop event e are the j with ``offsets[e] <= j < offsets[e + 1]``. Transfer
+    j boards the ``trips[j]``-th instance of pattern ``patterns[j]`` at the stop at position
+    ``positions[j]``, with the times of that instance moved forward by ``shifts[j]`` weeks
+    relative to the times of the instance transferred from.
+
+    Instance Attributes:
+        - timetable: the timetable whose trip instances are connected
+        - offsets, patterns, trips, positions, shifts: see above
+
+    Representation Invariants:
+        - len(self.offsets) == len(self.timetable.arr_times) + 1
+    """
+    timetable: Timetable
+    offsets: Sequence[int]
+    patterns: Sequence[int]
+    trips: Sequence[int]
+    positions: Sequence[int]
+    shifts: Sequence[int]
+
+    def __init__(self, timetable: Timetable, arrays: Sequence[Sequence[int]]) -> None:
+        """Initialize a transfer set for timetable from its arrays, given in the order returned
+        by ``to_arrays``.
+        """
+        self.timetable = timetable
+        self.offsets, self.patterns, self.trips, self.positions, self.shifts = arrays
+
+    def to_arrays(self) -> list[Sequence[int]]:
+        """Return the arrays of this transfer set, in the order accepted by the initializer."""
+        return [self.offsets, self.patterns, self.trips, self.positions, self.shifts]
+
+    def num_transfers(self) -> int:
+        """Return the number of transfers in this transfer set."""
+        return len(self.patterns)
+
+
+def load_transfers(use_snapshot: bool = True) -> TransferSet:
+    """Return the TransferSet for the shared timetable of the transit database.
+
+    The transfer set is computed the first time it is loaded, and its arrays are written to the
+    ``transit.transfers`` snapshot file next to ``transit.db``. Later calls memory-map the
+    snapshot, until the database changes. If use_snapshot is False, the transfer set is always
+    computed and no snapshot is read or written.
+    """
+    timetable = get_shared_timetable()
+    path = snapshot.snapshot_path(DB_FILE, '.transfers')
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if use_snapshot:
+        arrays = snapshot.read_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint)
+        if arrays is not None:
+            return TransferSet(timetable, arrays)
+
+    transfers = compute_transfers(timetable)
+
+    if use_snapshot:
+        try:
+            snapshot.write_snapshot(path, _SNAPSHOT_KIND, SNAPSHOT_VERSION, fingerprint,
+                                    transfers.to_arrays())
+        except OSError as e:
+            logging.getLogger(__name__).warning('Could not write transfers snapshot: %s', e)
+
+    return transfers
+
+
+def get_shared_transfers() -> TransferSet:
+    """Return the TransferSet shared by every caller in this process, loading it on first use.
+
+    As with ``timetable.get_shared_timetable``, the transfer set is memory-mapped from its
+    snapshot file and reloaded if the database changes.
+    """
+    timetable = get_shared_timetable()
+    fingerprint = data_interface.database_fingerprint(DB_FILE)
+
+    if fingerprint not in _SHARED_TRANSFERS \
+            or _SHARED_TRANSFERS[fingerprint].timetable is not timetable:
+        _SHARED_TRANSFERS.clear()
+        _SHARED_TRANSFERS[fingerprint] = load_transfers()
+
+    return _SHARED_TRANSFERS[fingerprint]
+
+
+def compute_transfers(timetable: Timetable) -> TransferSet:
+    """Return the reduced set of transfers between the trip instances of timetable.
+
+    From each stop event, a transfer to the earliest instance of every pattern departing from
+    the same stop, or from a stop one footpath away, is considered, except to instances of the
+    same pattern that staying on the current instance is at least as good as. The transfers
+    from each trip instance are then reduced: going back from its last stop, a transfer is only
+    kept if it improves the earliest time some stop can be reached at, compared to staying on
+    the instance and to the transfers kept so far.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info('Computing transfers')
+
+    offsets = array('q', [0])
+    patterns, trips, positions, shifts = array('i'), array('i'), array('i'), array('b')
+
+    for p in range(timetable.num_patterns()):
+        m = timetable.num_trips(p)
+        # the transfers kept from each stop event of the pattern, in the order of its events
+        kept = [[] for _ in range(timetable.pattern_length(p) * m)]
+        for k in range(m):
+            for i, transfers in _reduced_transfers(timetable, p, k):
+                kept[i * m + k] = transfers
+
+        for transfers in kept:
+            for p2, k2, j, shift in transfers:
+                patterns.append(p2)
+                trips.append(k2)
+                positions.append(j)
+                shifts.append(shift // WEEK)
+            offsets.append(len(patterns))
+
+    logger.info('Computed %d transfers', len(patterns))
+    return TransferSet(timetable, [offsets, patterns, trips, positions, shifts])
+
+
+def _reduced_transfers(timetable: Timetable, p: int, k: int) \
+        -> list[tuple[int, list[tuple[int, int, int, int]]]]:
+    """Return the kept transfers from the stop events of the k-th instance of pattern p, as a
+    list of (position, transfers) pairs, where transfers is a list of (pattern, instance,
+    position, shift in seconds) tuples.
+    """
+    first = timetable.pattern_stop_offsets[p]
+    n = timetable.pattern_length(p)
+
+    # earliest known time each stop can be reached at, ready to board a trip or walk no further
+    reached = {}
+    result = []
+
+    for i in range(n - 1, 0, -1):
+        stop = timetable.pattern_stops[first + i]
+        arrival = timetable.trip_time(p, k, i, departure=False)
+        _improve(timetable, reached, stop, arrival)
+
+        candidates = []
+        for stop2, walk in _nearby(timetable, stop):
+            for j in range(timetable.stop_pattern_offsets[stop2],
+                           timetable.stop_pattern_offsets[stop2 + 1]):
+                p2 = timetable.stop_patterns[j]
+                position = timetable.stop_pattern_positions[j]
+                if position + 1 == timetable.pattern_length(p2):
+                    continue  # no trip can be boarded at its last stop
+                trip = timetable.earliest_trip(p2, position, arrival + walk)
+                if trip is None or p2 == p and position >= i and (
+                        trip[1] > 0 or trip[1] == 0 and trip[0] >= k):
+                    continue
+                departure = timetable.trip_time(p2, trip[0], position) + trip[1]
+                candidates.append((departure, p2, trip[0], position, trip[1]))
+
+        transfers = []
+        for _, p2, k2, position, shift in sorted(candidates):
+            first2 = timetable.pattern_stop_offsets[p2]
+            keep = False
+            for position2 in range(position + 1, timetable.pattern_length(p2)):
+                arrival2 = timetable.trip_time(p2, k2, position2, departure=False) + shift
+                if _improve(timetable, reached, timetable.pattern_stops[first2 + position2],
+                            arrival2):
+                    keep = True
+            if keep:
+                transfers.append((p2, k2, position, shift))
+        result.append((i, transfers))
+
+    return result
+
+
+def _nearby(timetable: Timetable, stop: int) -> list[tuple[int, float]]:
+    """Return the stops reachable from stop by staying at it or walking a single footpath, as
+    (stop, walking time) pairs.
+    """
+    return [(stop, 0)] + [(timetable.foot_targets[j], timetable.foot_times[j])
+                          for j in range(timetable.foot_offsets[stop],
+                                         timetable.foot_offsets[stop + 1])]
+
+
+def _improve(timetable: Timetable, reached: dict[int, float], stop: int, arrival: float) -> bool:
+    """Record that stop is arrived at by a trip at the given time, updating reached for it and
+    the stops one footpath away. Return whether any time in reached improved.
+    """
+    improved = False
+    for stop2, walk in _nearby(timetable, stop):
+        if arrival + walk < reached.get(stop2, inf):
+            reached[stop2] = arrival + walk
+            improved = True
+    return improved
+
+
+def trip_based(timetable: Timetable, sources: list[tuple[int, float]],
+               targets: list[tuple[int, float]], transfers: Optional[TransferSet] = None) \
+        -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
+    """Return the journey with the earliest arrival at the destination, from any of the sources
+    to any of the targets.
+
+    sources and targets, and the returned journey, are in the same format as for
+    ``raptor.raptor``. transfers is the transfer set of timetable, or None to use the shared
+    transfer set. Return None if no journey exists.
+
+    Preconditions:
+        - sources != []
+        - transfers is None or transfers.timetable is timetable
+    """
+    if transfers is None:
+        transfers = get_shared_transfers()
+    search = _TripSearch(timetable, transfers, targets)
+
+    # stops the journey can start a trip from: the sources, and the stops one footpath away
+    ready = {}
+    for source, time in sources:
+        for stop, walk in _nearby(timetable, source):
+            if time + walk < ready.get(stop, (inf,))[0]:
+                ready[stop] = (time + walk, source)
+
+    for stop, (time, source) in ready.items():
+        if stop in search.egress and time + search.egress[stop] < search.best:
+            search.best = time + search.egress[stop]
+            search.best_journey = (-1, source, stop)
+        for j in range(timetable.stop_pattern_offsets[stop],
+                       timetable.stop_pattern_offsets[stop + 1]):
+            p = timetable.stop_patterns[j]
+            position = timetable.stop_pattern_positions[j]
+            trip = timetable.earliest_trip(p, position, time)
+            if trip is not None and position + 1 < timetable.pattern_length(p):
+                search.enqueue(p, trip[0], trip[1], position, -1, source)
+
+    start = 0
+    while start < len(search.segments):  # each pass scans one round of segments
+        end = len(search.segments)
+        for s in range(start, end):
+            search.scan(s)
+        start = end
+
+    return search.extract_journey()
+
+
+class _TripSearch:
+    """The state of a trip-based search.
+
+    Instance Attributes:
+        - timetable: the timetable searched
+        - transfers: the transfer set of timetable
+        - egress: the time needed to get from each target stop to the destination
+        - lines: for each (pattern, position) whose stop is a target or one footpath away from
+          one, the (time needed to get to the destination, target) from that stop
+        - reached: for each (pattern, instance, week offset) reached, the earliest position it
+          was reached at
+        - segments: the trip segments enqueued, as (pattern, instance, week offset, position
+          boarded at, last position to scan, previous segment, position alighted from the
+          previous segment) tuples; for segments boarded from a source, the previous segment
+          is -1 and the position alighted from is replaced by the source
+        - best: the earliest known arrival at the destination
+        - best_journey: the (segment, position alighted at, target) of the journey arriving at
+          best, where the segment is -1 and the position is replaced by the source if the
+          journey only walks
+    """
+    timetable: Timetable
+    transfers: TransferSet
+    egress: dict[int, float]
+    lines: dict[tuple[int, int], tuple[float, int]]
+    reached: dict[tuple[int, int, int], int]
+    segments: list[tuple[int, int, int, int, int, int, int]]
+    best: float
+    best_journey: Optional[tuple[int, int, int]]
+
+    def __init__(self, timetable: Timetable, transfers: TransferSet,
+                 targets: list[tuple[int, float]]) -> None:
+        """Initialize the state of a search to the given targets, with no segments enqueued."""
+        self.timetable = timetable
+        self.transfers = transfers
+        self.egress = dict(targets)
+        self.reached = {}
+        self.segments = []
+        self.best = inf
+        self.best_journey = None
+
+        self.lines = {}
+        for target, time in self.egress.items():
+            for stop, walk in _nearby(timetable, target):  # footpaths are symmetric
+                for j in range(timetable.stop_pattern_offsets[stop],
+                               timetable.stop_pattern_offsets[stop + 1]):
+                    key = (timetable.stop_patterns[j], timetable.stop_pattern_positions[j])
+                    if key[1] > 0 and walk + time < self.lines.get(key, (inf,))[0]:
+                        self.lines[key] = (walk + time, target)
+
+    def enqueue(self, p: int, k: int, offset: int, position: int, previous: int,
+                alighted: int) -> None:
+        """Enqueue the segment of the k-th instance of pattern p, with the given week offset,
+        boarded at the given position, unless the instance or an earlier instance of p was
+        already reached at or before that position. Every later instance of p is marked as
+        reached at the position.
+        """
+        n = self.timetable.pattern_length(p)
+        last = self.reached.get((p, k, offset), n)
+        if position >= last:
+            return
+        self.segments.append((p, k, offset, position, min(last, n - 1), previous, alighted))
+
+        for later in range(k, self.timetable.num_trips(p)):
+            if self.reached.get((p, later, offset), n) <= position:
+                break
+            self.reached[(p, later, offset)] = position
+
+    def scan(self, s: int) -> None:
+        """Scan the stops of segment s, updating the best journey and enqueuing the segments
+        reached by the transfers from each stop, until the segment ends or arrives no earlier
+        than the best journey.
+        """
+        timetable, transfers = self.timetable, self.transfers
+        p, k, offset, start, end = self.segments[s][:5]
+        m = timetable.num_trips(p)
+        base = timetable.pattern_time_offsets[p] + k
+
+        for position in range(start + 1, end + 1):
+            event = base + position * m
+            arrival = timetable.arr_times[event] + offset
+            if arrival >= self.best:
+                break
+
+            line = self.lines.get((p, position))
+            if line is not None and arrival + line[0] < self.best:
+                self.best = arrival + line[0]
+                self.best_journey = (s, position, line[1])
+
+            for j in range(transfers.offsets[event], transfers.offsets[event + 1]):
+                self.enqueue(transfers.patterns[j], transfers.trips[j],
+                             offset + transfers.shifts[j] * WEEK, transfers.positions[j], s,
+                             position)
+
+    def extract_journey(self) -> Optional[tuple[list[tuple[int, int, int]], Union[int, float]]]:
+        """Return the path and arrival time of the best journey, or None if no target was
+        reached.
+        """
+        if self.best_journey is None:
+            return None
+
+        timetable = self.timetable
+        stop_ids = timetable.graph.stop_ids
+        s, position, target = self.best_journey
+        if s == -1:  # walked from the source, position, to the target
+            path = [] if position == target else [(0, stop_ids[position], stop_ids[target])]
+            return (path, self.best)
+
+        path = []
+        stop = timetable.pattern_stops[timetable.pattern_stop_offsets[self.segments[s][0]]
+                                       + position]
+        if stop != target:
+            path.append((0, stop_ids[stop], stop_ids[target]))
+
+        while s != -1:
+            p, k, _, start, _, previous, alighted = self.segments[s]
+            board = timetable.pattern_stops[timetable.pattern_stop_offsets[p] + start]
+            path.append((timetable.trip_id(p, k), stop_ids[board], stop_ids[stop]))
+
+            if previous == -1:
+                stop = alighted  # the source
+            else:
+                stop = timetable.pattern_stops[
+                    timetable.pattern_stop_offsets[self.segments[previous][0]] + alighted]
+            if stop != board:
+                path.append((0, stop_ids[stop], stop_ids[board]))
+            s = previous
+
+        return (path, self.best)
+
+
+if __name__ == '__main__':
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
+
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['logging', 'array', 'math', 'typing', 'data_interface', 'snapshot',
+                          'graph', 'timetable'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['E1136']})